@@ -0,0 +1,254 @@
+'''
+asyncio control mode.
+
+AsyncRuntime runs the train control logic as coroutines on a single asyncio
+event loop, instead of threads: sensor events, timers, acceleration ramps,
+and waits at sector and crossing boundaries (see runtime.py for the
+procedure protocol shared with the threaded mode).
+
+- Callbacks from BLE threads (vision sensor, handset) are handed to the
+  loop with call_soon_threadsafe.
+- Timed calls are loop.call_later handles.
+- Procedures are tasks. Ramps are cancelled at once, with Task.cancel.
+- Waits for a condition don't poll: every callback, timer and procedure
+  step run by the loop is followed by a notification that wakes up the
+  waiting procedures, which then re-check their conditions. Since all
+  control logic runs on the loop, any change to sector occupancy or
+  crossing bookings is followed by such a notification. Waits honor
+  timeouts, and reservations.cancel_all (see reservations.py).
+- The tkinter GUI is pumped from the loop as well, so the GUI and the
+  control logic share the main thread.
+
+Hub writes still go through the per-hub command queues (hub_writer), since
+pylgbst is a blocking API. Its bleak backend runs its own event loop per
+hub, in a thread.
+
+The loop is created with new_event_loop and driven with run_forever:
+asyncio.run would try to install signal handlers through the standard
+library signal module, which src/signal.py shadows.
+
+The runtime must be created, and run, in the same thread (normally the
+main thread).
+'''
+import asyncio
+import queue
+import threading
+import time
+import tkinter as T
+import traceback
+
+from gui import QUEUE_POLLING, tkinter_output_queue
+from reservations import WAKEUP_TIMEOUT, reservations
+from runtime import Wait
+
+
+class AsyncRuntime():
+    '''
+    Runs the control logic of any number of trains on one event loop.
+    See runtime.py for the methods shared with the threaded runtime.
+
+    :param manager: the reservation manager that counts waits, and cancels
+        them
+    '''
+    def __init__(self, manager=reservations):
+        self.manager = manager
+        self.loop = asyncio.new_event_loop()
+        self.thread_id = threading.get_ident()
+
+        # set, and replaced, by every notification
+        self.changed = asyncio.Event()
+
+        # last task run for each key, so keyed procedures run in order
+        self.chains = {}
+
+        # running tasks; keeps them referenced until they are done
+        self.tasks = set()
+
+    def schedule(self, delay, function, *args, **kwargs):
+        handle = _LoopTimerHandle(self, function, args, kwargs)
+        handle.reschedule(delay)
+        return handle
+
+    def run(self, procedure, key=None, event=None):
+        previous = self.chains.get(key) if key is not None else None
+        task = self._create_task(self._drive(procedure, previous))
+        if key is not None:
+            self.chains[key] = task
+            task.add_done_callback(lambda t: self.chains.get(key) is t and self.chains.pop(key))
+        return task
+
+    def spawn(self, procedure):
+        return self._create_task(self._drive(procedure))
+
+    def dispatch(self, function, *args, **kwargs):
+        if self._in_loop():
+            self._call(function, args, kwargs)
+        else:
+            self.loop.call_soon_threadsafe(self._call, function, args, kwargs)
+
+    def fan_out(self, functions):
+        # control callbacks don't block the loop (hub writes are queued),
+        # so calling them in turn reaches them all at once.
+        for function in functions:
+            self.dispatch(function)
+
+    def notify(self):
+        if not self._in_loop():
+            self.loop.call_soon_threadsafe(self.notify)
+            return
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def clock(self):
+        return time.monotonic()
+
+    def run_forever(self, gui=None):
+        '''
+        Runs the event loop, pumping the GUI (if any) from it, until the
+        GUI window is closed or stop is called.
+        '''
+        asyncio.set_event_loop(self.loop)
+        if gui is not None:
+            self._create_task(self._pump_gui(gui))
+        try:
+            self.loop.run_forever()
+        finally:
+            for task in list(self.tasks):
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*self.tasks, return_exceptions=True))
+            self.loop.close()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def _in_loop(self):
+        return threading.get_ident() == self.thread_id
+
+    def _create_task(self, coroutine):
+        task = self.loop.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print("ERROR: control task failed")
+            traceback.print_exception(task.exception())
+
+    def _call(self, function, args, kwargs):
+        try:
+            function(*args, **kwargs)
+        except Exception:
+            print("ERROR: control callback failed:", function)
+            traceback.print_exc()
+        self.notify()
+
+    async def _drive(self, procedure, previous=None):
+        if previous is not None and not previous.done():
+            await asyncio.wait([previous])
+        try:
+            result = None
+            while True:
+                try:
+                    step = procedure.send(result)
+                except StopIteration:
+                    return
+
+                result = None
+                if callable(step):
+                    step = Wait(step)
+                if isinstance(step, Wait):
+                    result = await self._wait(step)
+                    if result is None:
+                        # cancelled
+                        return
+                elif step > 0.:
+                    await asyncio.sleep(step)
+                self.notify()
+        finally:
+            procedure.close()
+
+    async def _wait(self, step):
+        # True if the condition holds, False on timeout, None if cancelled
+        generation = self.manager.generation
+        deadline = None if step.timeout is None else time.monotonic() + step.timeout
+        blocked = False
+        try:
+            while True:
+                if self.manager.generation != generation:
+                    self.manager.cancelled += 1
+                    return None
+                if step.condition():
+                    self.manager.record(blocked)
+                    return True
+
+                interval = WAKEUP_TIMEOUT
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0.:
+                        self.manager.timeouts += 1
+                        return False
+                    interval = min(interval, remaining)
+
+                if not blocked:
+                    blocked = True
+                    if step.waiter is not None:
+                        # may resolve a deadlock, or stop all trains
+                        self.manager.graph.add(step.waiter, step.resource)
+                        continue
+                try:
+                    await asyncio.wait_for(self.changed.wait(), interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if blocked and step.waiter is not None:
+                self.manager.graph.remove(step.waiter)
+
+    async def _pump_gui(self, gui):
+        # replaces the tkinter mainloop, and the queue polling done by
+        # GUI.after_callback
+        while True:
+            try:
+                while True:
+                    message = tkinter_output_queue.get(block=False)
+                    if message is not None:
+                        gui._decode_message_and_update(message)
+            except queue.Empty:
+                pass
+            try:
+                gui.root.update()
+            except T.TclError:
+                # window was closed
+                self.loop.stop()
+                return
+            await asyncio.sleep(QUEUE_POLLING / 1000.)
+
+
+class _LoopTimerHandle():
+    def __init__(self, runtime, function, args, kwargs):
+        self.runtime = runtime
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.handle = None
+
+    def cancel(self):
+        if not self.runtime._in_loop():
+            self.runtime.loop.call_soon_threadsafe(self.cancel)
+            return
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+
+    def reschedule(self, delay):
+        if not self.runtime._in_loop():
+            self.runtime.loop.call_soon_threadsafe(self.reschedule, delay)
+            return
+        if self.handle is not None:
+            self.handle.cancel()
+        self.handle = self.runtime.loop.call_later(delay, self._fire)
+
+    def _fire(self):
+        self.handle = None
+        self.runtime._call(self.function, self.args, self.kwargs)
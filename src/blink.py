@@ -0,0 +1,155 @@
+'''
+Shared scheduler for blinking hub LEDs.
+
+A stopped train blinks its hub LED between two colors. Instead of one
+thread per stopped train, a single scheduler thread drives the blinking of
+all hubs. It sleeps until the next LED is due, and submits the color change
+to that hub's command queue (see hub_writer.HubWriter).
+
+Blinking LEDs are staggered: each one is assigned a phase within the blink
+period, chosen among STAGGER_SLOTS evenly spaced phases so that LEDs share
+a phase only when there are more LEDs than slots. LED writes to different
+hubs thus don't all go out over BLE at the same time.
+
+Starting and cancelling never wait on the scheduler thread, nor on hub
+writes: color changes are submitted with no lock held, and without
+blocking. A hub whose command queue is full (a slow or disconnected hub)
+just misses blink frames; other hubs keep blinking. Each color change checks, as the hub's writer thread makes
+it, that its blinker is still active. Once cancel returns, no color change
+for that LED is made, other than one the writer thread is making already;
+writes the caller then submits to the same hub come after it.
+'''
+import time
+from threading import Condition, Thread
+
+# time between color changes
+BLINK_TIME = 0.3  # seconds
+
+# number of distinct phases within a blink period
+STAGGER_SLOTS = 6
+
+
+class _Blinker():
+    def __init__(self, writer, led, colors, due, slot):
+        self.writer = writer
+        self.led = led
+        self.colors = colors
+        self.due = due
+        self.slot = slot
+        self.index = 0
+
+        # cleared when the blinker is cancelled or replaced
+        self.active = True
+
+    # runs in the hub writer thread
+    def set_color(self, color):
+        if self.active:
+            self.led.set_color(color)
+
+
+class BlinkScheduler():
+    '''
+    Drives blinking of any number of LEDs from a single thread.
+
+    :param period: time between color changes, in seconds
+    :param slots: number of distinct phases within a period
+    '''
+    def __init__(self, period=BLINK_TIME, slots=STAGGER_SLOTS):
+        self.period = period
+        self.slots = slots
+
+        # active blinkers, keyed by caller-supplied key
+        self.blinkers = {}
+        self.condition = Condition()
+
+        # the scheduler thread is started on first use
+        self.thread = None
+
+    def start(self, key, writer, led, colors, delay=0.):
+        '''
+        Starts blinking an LED, replacing any blinking already set up
+        under the same key.
+
+        :param key: identifies this LED in calls to cancel
+        :param writer: HubWriter of the LED's hub
+        :param led: the LED; must provide set_color
+        :param colors: sequence of colors to cycle through
+        :param delay: time before the first color change, in seconds. The
+            actual time may be up to one period longer, to fit the LED in
+            its phase slot.
+        '''
+        with self.condition:
+            self._remove(key)
+
+            slot = self._free_slot()
+            due = time.monotonic() + delay
+            phase = slot * self.period / self.slots
+            due += (phase - due) % self.period
+
+            self.blinkers[key] = _Blinker(writer, led, list(colors), due, slot)
+
+            if self.thread is None:
+                self.thread = Thread(target=self._run, name="BlinkScheduler", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def cancel(self, key):
+        '''
+        Stops blinking an LED. Does nothing if it is not blinking.
+        '''
+        with self.condition:
+            self._remove(key)
+
+    def _remove(self, key):
+        # called with the condition held
+        blinker = self.blinkers.pop(key, None)
+        if blinker is not None:
+            blinker.active = False
+
+    def is_blinking(self, key):
+        with self.condition:
+            return key in self.blinkers
+
+    def _free_slot(self):
+        usage = [0] * self.slots
+        for blinker in self.blinkers.values():
+            usage[blinker.slot] += 1
+        return usage.index(min(usage))
+
+    def _next_due(self):
+        # returns the color changes due, as (blinker, color) pairs, waiting
+        # until there is at least one
+        with self.condition:
+            while True:
+                if not self.blinkers:
+                    self.condition.wait()
+                    continue
+
+                now = time.monotonic()
+                next_due = min(blinker.due for blinker in self.blinkers.values())
+                if next_due > now:
+                    self.condition.wait(next_due - now)
+                    continue
+
+                due = []
+                for blinker in self.blinkers.values():
+                    if blinker.due <= now:
+                        due.append((blinker, blinker.colors[blinker.index]))
+                        blinker.index = (blinker.index + 1) % len(blinker.colors)
+                        blinker.due += self.period
+                        # don't try to catch up after a long stall
+                        if blinker.due <= now:
+                            blinker.due = now + self.period
+                return due
+
+    def _run(self):
+        while True:
+            # a change for a blinker cancelled meanwhile is skipped by the
+            # blinker itself. Frames that don't fit in a hub's queue are
+            # dropped.
+            for blinker, color in self._next_due():
+                blinker.writer.try_submit(blinker.set_color, color)
+
+
+# scheduler shared by all hubs
+blink_scheduler = BlinkScheduler()
@@ -0,0 +1,289 @@
+'''
+Color classification of raw vision sensor samples.
+
+The reference classifier (classify_rgb) converts each RGB sample to HSV and
+scans the HUE/SATURATION tables in signal.py. That is too much work to be
+done for every BLE notification, so ColorClassifier precomputes the answer
+for the sensor RGB space, quantized in cubic cells, and turns each sample
+into one indexed lookup.
+'''
+from colorsys import rgb_to_hsv
+from signal import (
+    HUE,
+    HUE_WRAP,
+    RGB_MINIMUM,
+    SATURATION,
+    SIGNAL_COLORS,
+    V_MINIMUM,
+)
+
+# The table covers channel values below 2**TABLE_BITS, in cells that
+# are 2**DEFAULT_SHIFT counts wide. Signal tiles read well below 512.
+TABLE_BITS = 9
+DEFAULT_SHIFT = 4
+
+# Table codes. Code 0 means "no color", codes 1..N index the signal
+# colors. Codes with the NOT_GRAY_RED flag set mean "that color, unless
+# G == B" (see _label_cell).
+NO_COLOR = 0
+NOT_GRAY_RED = 64
+AMBIGUOUS = 255
+
+# floating point slack used when comparing cell bounds against table bounds.
+EPSILON = 1.e-9
+
+
+def classify_rgb(r, g, b, hue=HUE, saturation=SATURATION, colors=SIGNAL_COLORS):
+    '''
+    Reference classifier. Returns the signal color that matches the RGB
+    sample, or None.
+
+    This is the logic originally embedded in the vision sensor callback in
+    SmartTrain, and the ground truth the lookup table must reproduce.
+    '''
+    h, s, v = rgb_to_hsv(r, g, b)
+
+    if h >= 1. or h <= 0.:
+        return None
+
+    # RED hue flips back to zero when crossing 1. We add 1. here
+    # so the comparison logic downstream works.
+    if h > 0. and h <= HUE_WRAP:
+        h += 1.
+
+    # ignore events with low signal-to-noise ratio
+    if min(r, g, b) >= RGB_MINIMUM and v >= V_MINIMUM:
+
+        # find matching color.
+        for color in colors:
+
+            if (h >= hue[color][0] and h <= hue[color][1]) and \
+               (s >= saturation[color][0] and s <= saturation[color][1]):
+
+                return color
+
+    return None
+
+
+class ColorClassifier():
+    '''
+    Lookup-table classifier for vision sensor RGB samples.
+
+    The sensor RGB cube is divided in cubic cells 2**shift counts wide. Each
+    cell is labeled once, at construction time, with the color every sample
+    inside it classifies to, or with AMBIGUOUS when the cell straddles a
+    classification boundary. Ambiguous cells are refined to one entry per
+    sample value by classify_rgb, lazily, the first time a sample lands in
+    them. Samples that fall outside the table are handed to classify_rgb.
+    The result is thus always identical to the reference classifier.
+
+    Cell labeling is exact, not sampled. Inside a cell where at most one pair
+    of channels can swap order, hue and saturation are monotonic along each
+    channel axis, so their ranges over the cell are spanned by the values at
+    the cell corners. A cell is labeled with a color only if those ranges sit
+    entirely inside that color's table entry, and outside the entries of the
+    colors checked before it.
+
+    :param shift: log2 of the cell width
+    :param bits: the table covers channel values below 2**bits
+    :param hue: dict with hue ranges, keyed by color
+    :param saturation: dict with saturation ranges, keyed by color
+    :param colors: colors to match, in matching order
+    '''
+    def __init__(self, shift=DEFAULT_SHIFT, bits=TABLE_BITS, hue=HUE,
+                 saturation=SATURATION, colors=SIGNAL_COLORS):
+        self.shift = shift
+        self.bits = bits
+        self.cell_bits = bits - shift
+        self.mask = (1 << shift) - 1
+        self.hue = hue
+        self.saturation = saturation
+        self.colors = list(colors)
+
+        # code -> color translation. Code 0 is "no color".
+        self.codes = [None] + self.colors
+
+        self.table = self._build_table()
+
+        # refined ambiguous cells, keyed by cell index
+        self.refined = {}
+
+    def classify(self, r, g, b):
+        '''
+        Returns the signal color that matches the RGB sample, or None.
+        '''
+        # anything that is not a non-negative integer below 2**bits
+        # is handled by the reference classifier.
+        try:
+            if (r | g | b) >> self.bits:
+                return self._classify_rgb(r, g, b)
+            shift = self.shift
+            cell_bits = self.cell_bits
+            cell = ((((r >> shift) << cell_bits) | (g >> shift)) << cell_bits) | (b >> shift)
+            code = self.table[cell]
+        except TypeError:
+            return self._classify_rgb(r, g, b)
+
+        if code < NOT_GRAY_RED:
+            return self.codes[code]
+
+        if code == AMBIGUOUS:
+            # ambiguous cells get refined to one entry per sample value
+            # the first time a sample falls in them.
+            refined = self.refined.get(cell)
+            if refined is None:
+                refined = self._refine(r >> shift, g >> shift, b >> shift, cell)
+            mask = self.mask
+            return self.codes[refined[((((r & mask) << shift) | (g & mask)) << shift) | (b & mask)]]
+
+        if g == b:
+            return None
+        return self.codes[code - NOT_GRAY_RED]
+
+    @property
+    def coverage(self):
+        '''
+        Fraction of the table cells that resolve without refinement.
+        '''
+        return 1. - self.table.count(AMBIGUOUS) / len(self.table)
+
+    def _classify_rgb(self, r, g, b):
+        return classify_rgb(r, g, b, hue=self.hue, saturation=self.saturation, colors=self.colors)
+
+    def _refine(self, i, j, k, cell):
+        width = 1 << self.shift
+        color_codes = {color: code for code, color in enumerate(self.codes)}
+
+        refined = bytearray(width ** 3)
+        index = 0
+        for r in range(i * width, (i + 1) * width):
+            for g in range(j * width, (j + 1) * width):
+                for b in range(k * width, (k + 1) * width):
+                    refined[index] = color_codes[self._classify_rgb(r, g, b)]
+                    index += 1
+
+        self.refined[cell] = refined
+        return refined
+
+    def _build_table(self):
+        width = 1 << self.shift
+        ncells = 1 << self.cell_bits
+        table = bytearray(ncells ** 3)
+
+        # Cells are labeled from the closed box [low, low + width] on each
+        # channel, so neighboring cells share corners. The box is one count
+        # larger than the cell proper, which just makes labeling a bit more
+        # conservative. Hue and saturation at each corner are computed once.
+        # In R-dominant cells hue is unwrapped around 1., so it varies
+        # continuously across the G == B plane; both versions are kept.
+        nvertices = ncells + 1
+        vertices = [k * width for k in range(nvertices)]
+        hue = {}
+        hue_unwrapped = {}
+        saturation = {}
+        for r in vertices:
+            for g in vertices:
+                h_row = []
+                s_row = []
+                for b in vertices:
+                    h, s, v = rgb_to_hsv(r, g, b)
+                    h_row.append(h)
+                    s_row.append(s)
+                hue[r, g] = h_row
+                hue_unwrapped[r, g] = [h + 1. if h < 0.5 else h for h in h_row]
+                saturation[r, g] = s_row
+
+        # saturation range spanned by all colors, for quick rejection
+        s_lowest = min(self.saturation[color][0] for color in self.colors) - EPSILON
+        s_highest = max(self.saturation[color][1] for color in self.colors) + EPSILON
+
+        index = 0
+        for i in range(ncells):
+            for j in range(ncells):
+                # reduce the 4 (R, G) edges of each column of cells first,
+                # then pairs of neighboring B vertices.
+                rg_corners = [(vertices[i + di], vertices[j + dj]) for di in (0, 1) for dj in (0, 1)]
+                s_min_row = _reduce_row(min, [saturation[c] for c in rg_corners])
+                s_max_row = _reduce_row(max, [saturation[c] for c in rg_corners])
+                h_rows = [hue[c] for c in rg_corners]
+                hu_rows = [hue_unwrapped[c] for c in rg_corners]
+                h_min_row = _reduce_row(min, h_rows)
+                h_max_row = _reduce_row(max, h_rows)
+                hu_min_row = _reduce_row(min, hu_rows)
+                hu_max_row = _reduce_row(max, hu_rows)
+
+                # the signal-to-noise gates are monotonic on every channel,
+                # so the cell corners tell where they pass or fail for sure.
+                # Also, channels whose ranges overlap (or touch) can swap
+                # order inside a cell. Monotonicity of hue and saturation
+                # only holds if that happens for at most one pair.
+                rg_low = (min(i, j), max(i, j))
+                rg_overlap = abs(i - j) <= 1
+
+                for k in range(ncells):
+                    low = min(rg_low[0], k) * width
+                    high = max(rg_low[1], k) * width
+                    if low + width < RGB_MINIMUM or high + width < V_MINIMUM:
+                        label = NO_COLOR
+                    elif low < RGB_MINIMUM or high < V_MINIMUM:
+                        label = AMBIGUOUS
+                    elif rg_overlap + (abs(j - k) <= 1) + (abs(i - k) <= 1) > 1:
+                        label = AMBIGUOUS
+                    elif s_max_row[k] < s_lowest or s_min_row[k] > s_highest:
+                        label = NO_COLOR
+                    elif i > j and i > k:
+                        label = self._label_cell(hu_min_row[k], hu_max_row[k],
+                                                 s_min_row[k], s_max_row[k],
+                                                 r_dominant=True, gray_red=j == k)
+                    else:
+                        label = self._label_cell(h_min_row[k], h_max_row[k],
+                                                 s_min_row[k], s_max_row[k])
+                    table[index] = label
+                    index += 1
+
+        return table
+
+    def _label_cell(self, h_min, h_max, s_min, s_max, r_dominant=False, gray_red=False):
+        # In R-dominant cells the reference classifier wraps hues at or below
+        # HUE_WRAP to above 1., so the unwrapped hue range may map to two
+        # pieces. Samples on the G == B plane (gray_red) have hue exactly 0
+        # and are rejected by the reference classifier.
+        if r_dominant:
+            h_ranges = []
+            if h_min <= 1. + HUE_WRAP + EPSILON:
+                h_ranges.append((h_min, min(h_max, 1. + HUE_WRAP)))
+            if h_max > 1. + HUE_WRAP - EPSILON:
+                h_ranges.append((max(h_min, 1. + HUE_WRAP) - 1., h_max - 1.))
+        else:
+            h_ranges = [(h_min, h_max)]
+
+        for code, color in enumerate(self.colors, start=1):
+            h_low, h_high = self.hue[color]
+            s_low, s_high = self.saturation[color]
+
+            s_inside = s_min >= s_low + EPSILON and s_max <= s_high - EPSILON
+            s_disjoint = s_max < s_low - EPSILON or s_min > s_high + EPSILON
+
+            inside = s_inside and \
+                all(low >= h_low + EPSILON and high <= h_high - EPSILON for low, high in h_ranges)
+            if inside:
+                return code + NOT_GRAY_RED if gray_red else code
+
+            disjoint = s_disjoint or \
+                all(high < h_low - EPSILON or low > h_high + EPSILON for low, high in h_ranges)
+            if not disjoint:
+                return AMBIGUOUS
+
+        return NO_COLOR
+
+
+def _reduce_row(function, rows):
+    # element-wise reduction of a few vertex rows, followed by a reduction
+    # of each pair of neighboring elements. Element k of the result covers
+    # vertices k and k+1 of all rows.
+    row = list(map(function, *rows))
+    return list(map(function, row[:-1], row[1:]))
+
+
+# classifier shared by all vision sensors. The table is built once, at startup.
+classifier = ColorClassifier()
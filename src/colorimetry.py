@@ -0,0 +1,234 @@
+'''
+Batch colorimetry analysis of recorded vision sensor captures.
+
+Captures are CSV files with one R, G, B sample per row, such as the ones in
+test/data. Whole captures are loaded in one go and converted to HSV, and then
+classified, as NumPy arrays. Classification follows the exact same rules as
+the vision sensor callback in SmartTrain (see classifier.classify_rgb), so a
+tuning of the HUE/SATURATION tables in signal.py can be checked against every
+capture in one run:
+
+    python src/colorimetry.py test/data/*.csv
+
+Each capture file is expected to hold samples of a single color. The
+expected color is taken from CAPTURE_LABELS, keyed by the file name without
+extension; it can be set from the command line as well (--label Red=RED).
+Files that record tile colors not in use, or the background, are expected
+to classify as no color (NONE).
+
+Requires numpy.
+'''
+import argparse
+import os
+from signal import (
+    BLUE,
+    GREEN,
+    HUE,
+    HUE_WRAP,
+    PURPLE,
+    RED,
+    RGB_MINIMUM,
+    SATURATION,
+    SIGNAL_COLORS,
+    V_MINIMUM,
+    YELLOW,
+)
+
+import numpy as np
+
+# label used for samples that match no signal color
+NONE = "NONE"
+
+# expected color for each of the captures in test/data
+CAPTURE_LABELS = {
+    "Red": RED,
+    "DarkGreen": GREEN,
+    "DarkerBlue": BLUE,
+    "LighterYellow": YELLOW,
+    "DarkPurple": PURPLE,
+    "DarkerYellow": NONE,
+    "LighterBlue": NONE,
+    "LightPurple": NONE,
+    "Carpet": NONE,
+    "Track": NONE,
+}
+
+
+def load_capture(filename):
+    '''
+    Reads a capture file into a (N, 3) float array of R, G, B samples.
+    '''
+    rgb = np.loadtxt(filename, delimiter=",", ndmin=2)
+    return rgb[:, :3]
+
+
+def capture_name(filename):
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def rgb_to_hsv(rgb):
+    '''
+    Vectorized version of colorsys.rgb_to_hsv. Performs the same floating
+    point operations in the same order, so results are identical.
+
+    :param rgb: (N, 3) array of R, G, B samples
+    :return: three (N,) arrays with H, S, and V
+    '''
+    r = rgb[:, 0]
+    g = rgb[:, 1]
+    b = rgb[:, 2]
+
+    maxc = rgb.max(axis=1)
+    minc = rgb.min(axis=1)
+    rangec = maxc - minc
+    v = maxc
+
+    gray = rangec == 0.
+    # any non-zero value will do on gray samples; they get h = s = 0 below.
+    safe_range = np.where(gray, 1., rangec)
+    safe_max = np.where(maxc == 0., 1., maxc)
+
+    s = rangec / safe_max
+    rc = (maxc - r) / safe_range
+    gc = (maxc - g) / safe_range
+    bc = (maxc - b) / safe_range
+
+    h = np.where(r == maxc, bc - gc,
+                 np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = np.mod(h / 6.0, 1.0)
+
+    h[gray] = 0.
+    s[gray] = 0.
+
+    return h, s, v
+
+
+def wrap_hue(h):
+    '''
+    RED hue flips back to zero when crossing 1. Adds 1. to hues at or below
+    HUE_WRAP, as the vision sensor callback does.
+    '''
+    return np.where((h > 0.) & (h <= HUE_WRAP), h + 1., h)
+
+
+def classify(rgb, hue=HUE, saturation=SATURATION, colors=SIGNAL_COLORS):
+    '''
+    Vectorized version of classifier.classify_rgb.
+
+    :param rgb: (N, 3) array of R, G, B samples
+    :param hue: dict with hue ranges, keyed by color
+    :param saturation: dict with saturation ranges, keyed by color
+    :param colors: colors to match, in matching order
+    :return: (N,) int array. 0 means no color, k means colors[k-1]
+    '''
+    h, s, v = rgb_to_hsv(rgb)
+    return classify_hsv(rgb, h, s, v, hue=hue, saturation=saturation, colors=colors)
+
+
+def classify_hsv(rgb, h, s, v, hue=HUE, saturation=SATURATION, colors=SIGNAL_COLORS):
+    '''
+    Same as classify, for samples already converted to (unwrapped) HSV.
+    '''
+    valid = (h < 1.) & (h > 0.)
+    h = wrap_hue(h)
+
+    # ignore samples with low signal-to-noise ratio
+    valid &= (rgb.min(axis=1) >= RGB_MINIMUM) & (v >= V_MINIMUM)
+
+    # first match wins: assign codes in reverse matching order.
+    codes = np.zeros(len(rgb), dtype=int)
+    for code in range(len(colors), 0, -1):
+        color = colors[code - 1]
+        match = valid & \
+            (h >= hue[color][0]) & (h <= hue[color][1]) & \
+            (s >= saturation[color][0]) & (s <= saturation[color][1])
+        codes[match] = code
+
+    return codes
+
+
+def confusion_matrix(expected, classified, ncodes):
+    '''
+    Counts samples by (expected code, classified code).
+
+    :param expected: (N,) int array with expected codes
+    :param classified: (N,) int array with classified codes
+    :param ncodes: number of codes, including 0
+    :return: (ncodes, ncodes) int array; rows are expected codes
+    '''
+    counts = np.bincount(expected * ncodes + classified, minlength=ncodes * ncodes)
+    return counts.reshape(ncodes, ncodes)
+
+
+def analyze(filenames, labels=CAPTURE_LABELS, hue=HUE, saturation=SATURATION,
+            colors=SIGNAL_COLORS):
+    '''
+    Loads and classifies a set of captures, and prints per-file statistics
+    followed by the confusion matrix over all labeled captures.
+
+    :return: the confusion matrix, rows and columns ordered as [NONE] + colors
+    '''
+    colors = list(colors)
+    names = [NONE] + colors
+    ncodes = len(names)
+
+    total = np.zeros((ncodes, ncodes), dtype=int)
+
+    for filename in filenames:
+        name = capture_name(filename)
+        try:
+            rgb = load_capture(filename)
+        except ValueError:
+            print("%s  (not a capture file, skipped)\n" % filename)
+            continue
+
+        h, s, v = rgb_to_hsv(rgb)
+        codes = classify_hsv(rgb, h, s, v, hue=hue, saturation=saturation, colors=colors)
+        h = wrap_hue(h)
+
+        counts = np.bincount(codes, minlength=ncodes)
+        label = labels.get(name)
+
+        print("%s  (%i samples, expected: %s)" % (filename, len(rgb), label if label else "?"))
+        for title, values in (("H", h), ("S", s), ("V", v)):
+            print("   %s stats: %8.4f %8.4f %8.4f %8.4f" %
+                  (title, values.mean(), values.std(), values.min(), values.max()))
+        print("   classified: " + "  ".join("%s %i" % (names[code], counts[code])
+                                               for code in range(ncodes) if counts[code] > 0))
+
+        if label in names:
+            expected = np.full(len(codes), names.index(label))
+            matrix = confusion_matrix(expected, codes, ncodes)
+            total += matrix
+            print("   accuracy:   %6.2f%%" % (100. * counts[names.index(label)] / len(codes)))
+        print()
+
+    print_confusion_matrix(total, names)
+    return total
+
+
+def print_confusion_matrix(matrix, names):
+    width = max(8, max(len(name) for name in names) + 1)
+    print("Confusion matrix (rows: expected, columns: classified)")
+    print(" " * width + "".join(name.rjust(width) for name in names))
+    for name, row in zip(names, matrix):
+        print(name.ljust(width) + "".join(("%i" % count).rjust(width) for count in row))
+
+
+def _parse_labels(label_args):
+    labels = dict(CAPTURE_LABELS)
+    for label_arg in label_args:
+        name, _, color = label_arg.partition("=")
+        labels[name] = color.upper()
+    return labels
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Classify vision sensor captures with the "
+                                                 "current HUE/SATURATION tables.")
+    parser.add_argument("captures", nargs="+", help="CSV capture files")
+    parser.add_argument("-l", "--label", action="append", default=[], metavar="NAME=COLOR",
+                        help="expected color for capture NAME (file name without extension)")
+    args = parser.parse_args()
+
+    analyze(args.captures, labels=_parse_labels(args.label))
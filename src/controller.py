@@ -6,30 +6,63 @@ from pylgbst.peripherals import RemoteButton
 
 import track
 import uuid_definitions
+from recovery import recoveries
+from reservations import reservations, wait_for
+from runtime import threaded
 from train import SmartTrain
 
 DUAL = "dual"
 LONG = "long"
 
+# time between the departures of trains restarted together
+RESTART_INTERVAL = 0.5 # s
+
 
 class Controller:
     '''
     Main controller class.
 
-    It accepts initialized instances of subclasses of Train.
+    It accepts initialized instances of subclasses of Train, any number of
+    them, and keeps them in a registry keyed by train name. Trains can be
+    added and removed later, with register and unregister.
 
     This class creates a remote handset instance that allows the operator to
-    control one or two trains with one handset.
+    control trains with one handset. Each set of buttons (left and right)
+    drives one train; handset_map sets which one, by train name. By default,
+    the first two trains registered are driven by the left and right button
+    sets. Gestures that act on all trains (dual and long red button presses)
+    reach every train in the registry.
 
-    The class was last used to control two instances of SmartTrain in a
+    The class was last used to control instances of SmartTrain in a
     self-driving setup. Other configurations (such as CompoundTrain) may
     not work without some additional work).
 
+    Handset events are handled in the control context of the given runtime
+    (see runtime.py), the same one the trains use. Reset and restart fan out
+    to all trains concurrently, so an emergency stop reaches the last train
+    about as fast as the first one.
+
     '''
-    def __init__(self, train1, train2=None, handset_address=uuid_definitions.HANDSET_TEST):
-        self.train1 = train1
-        self.train2 = train2
+    def __init__(self, *trains, handset_address=uuid_definitions.HANDSET_TEST,
+                 runtime=threaded, handset_map=None):
         self.handset_address = handset_address
+        self.runtime = runtime
+
+        # trains, keyed by name, in the order they were registered
+        self.trains = {}
+
+        # train name driven by each handset button set
+        self.handset_map = dict(handset_map) if handset_map is not None else None
+
+        # enable system-wide communications
+        self.dispatcher = Dispatcher(self)
+
+        # trains that deadlock, and can't sort it out among themselves,
+        # are stopped and handed over to the handset
+        wait_for.emergency_stop = self.dispatcher.emergency_stop
+
+        for train in trains:
+            self.register(train)
 
         sleep(5)
         self.handset = RemoteHandset(address=self.handset_address)
@@ -41,49 +74,62 @@ class Controller:
         # each button set from the start. Since we may be handling two trains
         # identically, each one on one side of the handset, the one-callback
         # approach seems better at preventing code duplication.
-        self.handset_handler.handset.port_A.subscribe(self.handset_handler.callback_from_button)
-        self.handset_handler.handset.port_B.subscribe(self.handset_handler.callback_from_button)
+        self.handset_handler.handset.port_A.subscribe(self._handset_callback)
+        self.handset_handler.handset.port_B.subscribe(self._handset_callback)
+
+        # actions associated with long and dual red button actions
+        self.red_button_actions = {
+            DUAL: self._restart,
+            LONG: self._manual_reset
+        }
 
-        # define sensible handset actions for a dummy train2 object
-        if self.train2 is None:
-            self.train2 = _DummyTrain("Dummy")
+    def register(self, train):
+        self.trains[train.name] = train
+        train.dispatcher = self.dispatcher
+        self._map_handset()
 
-        # enable system-wide communications
-        self.dispatcher = Dispatcher(self)
-        self.train1.dispatcher = self.dispatcher
-        self.train2.dispatcher = self.dispatcher
+    def unregister(self, train):
+        self.trains.pop(train.name, None)
+        self._map_handset()
+
+    def map_handset(self, button_set, name):
+        '''
+        Makes a handset button set drive a train.
+
+        :param button_set: RemoteButton.LEFT or RemoteButton.RIGHT
+        :param name: train name
+        '''
+        if self.handset_map is None:
+            self.handset_map = self._default_handset_map()
+        self.handset_map[button_set] = name
+        self._map_handset()
+
+    def _default_handset_map(self):
+        return dict(zip([RemoteButton.LEFT, RemoteButton.RIGHT], self.trains))
+
+    def _map_handset(self):
+        handset_map = self.handset_map
+        if handset_map is None:
+            handset_map = self._default_handset_map()
+
+        # define sensible handset actions for button sets with no train
+        trains = {button_set: self.trains.get(handset_map.get(button_set), _DummyTrain("Dummy"))
+                  for button_set in [RemoteButton.LEFT, RemoteButton.RIGHT]}
 
         # actions associated with each handset button. Note that
         # the red buttons require special handling thus their
         # events are processed elsewhere.
         self.handset_actions = {
-            RemoteButton.LEFT:
-            {
-                RemoteButton.PLUS: self.train1.up_speed,
-                RemoteButton.MINUS: self.train1.down_speed
-            },
-            RemoteButton.RIGHT:
-            {
-                RemoteButton.PLUS: self.train2.up_speed,
-                RemoteButton.MINUS: self.train2.down_speed
-                #TODO
-                # RemoteButton.PLUS: self.train1.switch_semaphore,
-                # RemoteButton.RED: self.train1.switch_semaphore,
-                # RemoteButton.MINUS: self.train1.switch_semaphore
-            },
+            button_set: {
+                RemoteButton.PLUS: train.up_speed,
+                RemoteButton.MINUS: train.down_speed
+            }
+            for button_set, train in trains.items()
         }
 
         # actions associated with a short RED button press
-        self.handset_short_red_actions = {
-            RemoteButton.LEFT: self.train1.stop,
-            RemoteButton.RIGHT: self.train2.stop
-        }
-
-        # actions associated with long and dual red button actions
-        self.red_button_actions = {
-            DUAL: self._restart,
-            LONG: self.reset_all
-        }
+        self.handset_short_red_actions = {button_set: train.stop
+                                          for button_set, train in trains.items()}
 
     # def connect_handset(self):
     #     # Subscribe callbacks with train actions to handset button gestures.
@@ -95,47 +141,56 @@ class Controller:
     #     self.handset_handler.handset.port_A.subscribe(self.handset_handler.callback_from_button)
     #     self.handset_handler.handset.port_B.subscribe(self.handset_handler.callback_from_button)
 
+    def _handset_callback(self, button, button_set):
+        self.runtime.dispatch(self.handset_handler.callback_from_button, button, button_set)
+
     def _handle_red_button(self, mode):
         # mode can be "dual" or "long"
         self.red_button_actions[mode]()
 
+    def _smart_trains(self):
+        return [train for train in self.trains.values() if isinstance(train, SmartTrain)]
+
     def reset_all(self):
-        self.train1.stop()
-        self.train2.stop()
+        # stop every train first, all at once
+        self.runtime.fan_out(train.stop for train in list(self.trains.values()))
+
+        # smart trains should be conducted in manual mode from now on
+        trains = self._smart_trains()
+        for train in trains:
+            train.auto = False
+        self.runtime.fan_out(train.cancel_all_threads for train in trains)
 
-        # both trains should be conducted in manual mode from now on
-        if isinstance(self.train1, SmartTrain) and (isinstance(self.train2, SmartTrain) or
-                isinstance(self.train2, _DummyTrain)):
-            self.train1.auto = False
-            self.train2.auto = False
+        # trains waiting for a sector or the crossing give up
+        reservations.cancel_all()
 
-            self.train1.cancel_all_threads()
-            self.train2.cancel_all_threads()
+        for train in trains:
+            train.initialize_sectors()
+            track.initialize_crossings(train)
 
-            self.train1.initialize_sectors()
-            self.train2.initialize_sectors()
+    def _manual_reset(self):
+        recoveries.manual_reset()
+        self.reset_all()
 
-            track.xtrack.initialize(self.train1)
-            track.xtrack.initialize(self.train2)
+    def emergency_stop(self, cycle=None):
+        print("EMERGENCY STOP")
+        self.reset_all()
 
     def _restart(self):
         # this method assumes the trains are stopped at they designated stations,
         # after manual mode was entered, and they were driven manually to there.
 
         track.clear_track()
+        recoveries.restarted()
 
-        if isinstance(self.train1, SmartTrain) and (isinstance(self.train2, SmartTrain) or
-                isinstance(self.train2, _DummyTrain)):
-            self.train1.auto = True
-            self.train2.auto = True
-
-            self.train1.initialize_sectors()
-            self.train2.initialize_sectors()
-
-            self.train1.timed_stop_at_station()
-            time.sleep(0.5)
-            self.train2.timed_stop_at_station()
+        trains = self._smart_trains()
+        for train in trains:
+            train.auto = True
+            train.initialize_sectors()
 
+        # departures are staggered, so trains don't all start at once
+        for i, train in enumerate(trains):
+            self.runtime.schedule(i * RESTART_INTERVAL, train.timed_stop_at_station)
 
 
 class HandsetEvent:
@@ -224,11 +279,11 @@ class Dispatcher:
     def __init__(self, controller):
         self.controller = controller
 
-    def emergency_stop(self):
-        self.controller.reset_all()
+    def emergency_stop(self, cycle=None):
+        self.controller.emergency_stop(cycle)
 
 
-# class that provides dummy methods to be used in case train2 is None
+# class that provides dummy methods for handset button sets with no train
 class _DummyTrain():
     def __init__(self, name):
         self.name = name
@@ -0,0 +1,142 @@
+'''
+Station dwell scheduler.
+
+A train stopped at a station waits there for a while before departing. The
+time used to be picked at random between MINIMUM_TIME_STATION and
+MAXIMUM_TIME_STATION, regardless of where the other trains are, so trains
+would bunch up, and depart only to wait for a sector still held by the
+train ahead.
+
+The scheduler picks the dwell time within the same bounds, from the
+occupancy of the path ahead of the station: a train departs as soon as its
+path is expected to be clear, and not earlier. The time a sector ahead
+stays taken is estimated from its typical transit time (Sector.transit_time)
+and the time it has been held so far; a crossing booked by another train at
+the station exit adds CROSSING_TIME. When the path is clear, the train
+departs after the minimum dwell time.
+
+Set dwell_scheduler.adaptive = False to go back to random dwell times. The
+metrics (dwell_scheduler.dump()) keep separate figures for both policies,
+so runs can be compared: the time spent at stations, and the time a train
+still had to wait for its path once its dwell time was over.
+'''
+import random
+import sys
+from threading import Lock
+
+from reservations import reservation_table
+from track import MAXIMUM_TIME_STATION, MINIMUM_TIME_STATION, layout
+
+# number of sectors ahead of the station checked for occupancy
+HORIZON = 2
+
+# typical time a train takes to clear a crossing
+CROSSING_TIME = 3. # s
+
+# added to the time the path is expected to be clear
+MARGIN = 0.5 # s
+
+ADAPTIVE = "adaptive"
+RANDOM = "random"
+
+
+class _Metrics():
+    def __init__(self):
+        self.dwells = 0
+        self.dwell_time = 0.
+        self.departures = 0
+        self.blocked = 0
+        self.wait_time = 0.
+
+
+class DwellScheduler():
+    '''
+    Picks dwell times at stations.
+
+    :param minimum: shortest dwell time, in seconds
+    :param maximum: longest dwell time, in seconds
+    :param horizon: number of sectors ahead of the station to check
+    :param adaptive: if False, pick dwell times at random
+    :param layout: the track layout
+    '''
+    def __init__(self, minimum=MINIMUM_TIME_STATION, maximum=MAXIMUM_TIME_STATION,
+                 horizon=HORIZON, adaptive=True, layout=layout):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.horizon = horizon
+        self.adaptive = adaptive
+        self.layout = layout
+
+        self.lock = Lock()
+        self.metrics = {ADAPTIVE: _Metrics(), RANDOM: _Metrics()}
+
+    @property
+    def policy(self):
+        return ADAPTIVE if self.adaptive else RANDOM
+
+    def dwell(self, station, direction, name):
+        '''
+        :param station: the station sector the train is stopped at
+        :param direction: the train's direction of movement
+        :param name: the train's name
+        :return: dwell time, in seconds
+        '''
+        if self.adaptive:
+            clear = self.clear_time(station, direction, name)
+            dwell_time = min(max(clear + MARGIN, self.minimum), self.maximum)
+        else:
+            dwell_time = random.uniform(self.minimum, self.maximum)
+
+        with self.lock:
+            metrics = self.metrics[self.policy]
+            metrics.dwells += 1
+            metrics.dwell_time += dwell_time
+        return dwell_time
+
+    def clear_time(self, station, direction, name):
+        '''
+        :return: time until the path ahead of the station is expected to be
+            clear of other trains, in seconds
+        '''
+        clear = 0.
+        crossing = self.layout.exit_crossing(station)
+        if crossing is not None and crossing.booked not in (None, name):
+            clear = CROSSING_TIME
+
+        path = self.layout.path(station, direction, self.horizon)
+        occupiers = reservation_table.snapshot(path)
+        for sector in path:
+            if occupiers[sector] not in (None, name):
+                remaining = sector.transit_time - reservation_table.held_for(sector)
+                clear = max(clear, remaining, 0.)
+        return clear
+
+    def departed(self, wait_time):
+        '''
+        Records a departure from a station.
+
+        :param wait_time: time the train waited for its path once its
+            dwell time was over, in seconds
+        '''
+        with self.lock:
+            metrics = self.metrics[self.policy]
+            metrics.departures += 1
+            metrics.wait_time += wait_time
+            if wait_time > 0.05:
+                metrics.blocked += 1
+
+    def dump(self, fp=sys.stdout):
+        with self.lock:
+            fp.write("Station dwell   dwells  mean dwell (s)  departures  blocked  mean wait (s)\n")
+            for policy, metrics in self.metrics.items():
+                if metrics.dwells == 0:
+                    continue
+                fp.write("%-13s %8i %15.2f %11i %8i %14.2f\n" %
+                         (policy, metrics.dwells, metrics.dwell_time / metrics.dwells,
+                          metrics.departures, metrics.blocked,
+                          metrics.wait_time / metrics.departures if metrics.departures else 0.))
+            fp.flush()
+
+
+# scheduler shared by all trains
+dwell_scheduler = DwellScheduler()
@@ -1,9 +1,13 @@
+import sys
 import time
-from signal import BLUE, GREEN, INTER_SECTOR, RED, YELLOW
-from threading import Timer
-from time import sleep
+from signal import BLUE, GREEN, INTER_SECTOR, RED, SIGNAL_COLORS, YELLOW
 
 from gui import tk_color
+from operations import operations
+from recovery import recoveries
+from reservations import reservation_table
+from runtime import Wait
+from tracing import FILTER, PROCESS, tracer
 from track import (
     DEFAULT_BRAKING_TIME,
     DEFAULT_SPEED,
@@ -15,68 +19,214 @@ from track import (
     XTRACK_BRAKING_TIME,
     StructuredSector,
     XTrack,
+    layout,
     sectors,
-    xtrack,
 )
+from transit import SLOWDOWN_LEAD, transit_times
 
 TIME_THRESHOLD = 0.5  # seconds
 
+# max speed is held while the train is at least this much further from the
+# sector signal than it needs to slow down
+POSITION_CHECK = 0.2  # seconds
+
+# a color is confirmed when it shows up in VOTES of the last WINDOW
+# classified samples.
+VOTES = 2
+WINDOW = 3
+
 
 sign = lambda x: x and (1, -1)[x<0]
 
 
 class SensorEventFilter():
     '''
-    This class is used to filter out multiple detections of the same color
-    by the vision sensor in a SmartTrain.
-
-    It works by ignoring all detections of the given color that take place
-    within a pre-defined time interval (TIME_THRESHOLD). The first event
-    will be passed back to the caller, an instance of SmartTrain, via its
+    This class is used to filter out false and multiple detections of the
+    same color by the vision sensor in a SmartTrain.
+
+    Every classified sample, including the ones that match no color (None),
+    goes into a ring buffer holding the last n samples. A color is confirmed
+    only when at least k of them agree, which rejects isolated spurious
+    samples at the cost of at most k-1 extra samples of latency. Once
+    confirmed, further detections of that color are ignored within a
+    pre-defined time interval (TIME_THRESHOLD). The confirmed event is
+    passed back to the caller, an instance of SmartTrain, via its
     process_event method.
-    '''
-    events = {}
 
-    def __init__(self, train):
+    Each train has its own filter, so a detection by one train never
+    suppresses detections by another.
+    '''
+    def __init__(self, train, votes=VOTES, window=WINDOW, colors=SIGNAL_COLORS,
+                 clock=time.monotonic, journal=None):
         '''
-        
+
         :param train: an instance of SmartTrain
+        :param votes: number of agreeing samples (k) needed to confirm a color
+        :param window: number of most recent samples (n) that vote
+        :param colors: colors that can be confirmed
+        :param clock: returns the current time, in seconds
+        :param journal: optional journal.Journal the confirmed events are
+            logged to
         '''
+        if not 0 < votes <= window:
+            raise ValueError("votes must be between 1 and window")
+
         self.train = train
+        self.votes = votes
+        self.clock = clock
+        self.journal = journal
+
+        # ring buffer with the most recent samples, and the number of
+        # times each color shows up in it. Both are allocated once.
+        self.window = [None] * window
+        self.position = 0
+        self.counts = dict.fromkeys(colors, 0)
+        self.counts[None] = window
+
+        # time of last confirmed event, keyed by color. Times come from
+        # a monotonic clock, so wall clock adjustments can't affect them.
+        self.events = {}
 
     def filter_event(self, event_key):
-        # events are discriminated by their color. If an event of a given
-        # color is already stored here, it means that this current event is
-        # possibly a double detection. Verify by checking event times.
-        event_time = time.time()
-        if event_key in self.events:
-            if (event_time - self.events[event_key]) > TIME_THRESHOLD:
-                # not a double detection. Alert caller and
-                # redefine stored event
-                self.events[event_key] = event_time
-                self.train.event_processor.process_event(event_key)
+        '''
+        Feeds one classified sample into the filter.
 
-            else:
-                # double detection. Do nothing.
-                pass
+        :param event_key: the color the sample matches, or None
+        '''
+        position = self.position
+        self.counts[self.window[position]] -= 1
+        self.window[position] = event_key
+        self.counts[event_key] += 1
+        self.position = (position + 1) % len(self.window)
 
-        # if event of current color is not stored here, store current event
-        else:
+        if event_key is None or self.counts[event_key] < self.votes:
+            return
+
+        # events are discriminated by their color. If an event of a given
+        # color was confirmed recently, this is a double detection.
+        event_time = self.clock()
+        last_time = self.events.get(event_key)
+        if last_time is None or (event_time - last_time) > TIME_THRESHOLD:
             self.events[event_key] = event_time
+            if self.journal is not None:
+                self.journal.event(event_key, event_time)
+            if tracer.enabled:
+                tracer.start(self.train, FILTER)
             self.train.event_processor.process_event(event_key)
 
 
+# train states, as far as sector signals are concerned
+BETWEEN_SECTORS = "between sectors"
+ENTERED = "entered"
+IN_SECTOR = "in sector"
+IN_FAST = "fast sub-sector"
+IN_SLOW = "slow sub-sector"
+
+# sector kinds. A layout's sector kinds are (kind, sector color) pairs; the
+# inter-sector zone has no kind (None).
+REGULAR = "regular"
+STRUCTURED = "structured"
+
+
+class TransitionTable():
+    '''
+    Transition table of the event processor's state machine.
+
+    Events are dispatched on (train state, sector kind, event color). The
+    table is compiled once from the layout: it has an entry for each train
+    state, each kind of sector in the layout (regular or structured, and
+    its color), and each signal color. Each entry names the EventProcessor
+    method that handles the transition; combinations with no entry are
+    ignored. Dispatch is a dict lookup, whatever the number of colors and
+    sector kinds.
+
+    :param layout: the track layout
+    :param colors: signal colors
+    '''
+    def __init__(self, layout, colors=SIGNAL_COLORS):
+        # sector kind, indexed by sector id
+        self.kinds = [(STRUCTURED if isinstance(sector, StructuredSector) else REGULAR,
+                       sector.color) for sector in layout.sectors]
+
+        self.table = {}
+        for color in colors:
+            self._add(BETWEEN_SECTORS, None, color)
+            for kind in set(self.kinds):
+                states = [IN_FAST, IN_SLOW] if kind[0] == STRUCTURED else [IN_SECTOR]
+                for state in [ENTERED] + states:
+                    self._add(state, kind, color)
+
+    def _add(self, state, kind, color):
+        handler = self._handler(state, kind, color)
+        if handler is not None:
+            self.table[(state, kind, color)] = handler
+
+    @staticmethod
+    def _handler(state, kind, color):
+        # YELLOW signals belong to crossings, RED signals to stations,
+        # wherever the train is
+        if color == YELLOW:
+            return "_process_xtrack_event"
+        if color == RED:
+            return "_process_station_event"
+        if color not in [GREEN, BLUE]:
+            return None
+
+        # sector signals
+        if state == BETWEEN_SECTORS:
+            return "_enter_sector"
+        if state == ENTERED or color != kind[1]:
+            # a signal of the sector's color right after entering it, or
+            # of another color
+            return "recover"
+        if state == IN_FAST:
+            return "_leave_fast_sub_sector"
+        if state == IN_SLOW:
+            return "_leave_structured_sector"
+        return "_leave_sector"
+
+    def state(self, train):
+        '''
+        :return: the train state, and the kind of the sector it is in
+        '''
+        sector = train.sector
+        if sector is None:
+            return BETWEEN_SECTORS, None
+        kind = self.kinds[sector.id]
+        if train.just_entered_sector:
+            return ENTERED, kind
+        if kind[0] == STRUCTURED:
+            return (IN_FAST if sector.sub_sector_type == FAST else IN_SLOW), kind
+        return IN_SECTOR, kind
+
+
+# table of the track layout, shared by all trains
+transition_table = TransitionTable(layout)
+
+# all event processors created so far, for reporting
+event_processors = []
+
+
 class EventProcessor:
     '''
     Delegate class that handles everything associated with sensor
     events in a SmartTrain instance.
     '''
-    def __init__(self, train):
+    def __init__(self, train, table=transition_table, clock=time.monotonic):
         '''
 
         :param train: an instance of SmartTrain
+        :param table: the state machine's transition table
+        :param clock: returns the current time, in seconds
         '''
         self.train = train
+        self.table = table
+        self.clock = clock
+
+        # number of times each transition was taken, and the time it was
+        # last taken, keyed by (train state, sector kind, event color)
+        self.transitions = {}
+        event_processors.append(self)
 
         # handling of station events
         self.last_station_event = None
@@ -84,6 +234,16 @@ class EventProcessor:
         # this helps to detected unexpected, thus invalid, events.
         self.last_processed_xtrack_event = None
 
+        # time the train entered its sector, and the motor power it
+        # entered with; None once the transit was measured, or if it can't
+        # be (the train stopped in the sector).
+        self.entered_at = None
+        self.entry_power = None
+
+        # timer that goes off at the latest expected arrival at the sector
+        # signal
+        self.missed_signal_timer = None
+
     def process_event(self, event):
         '''
         Processes events pre-filtered by SensorEventFilter.
@@ -93,10 +253,20 @@ class EventProcessor:
         other factors, on the occupied/free status of the sector ahead of the
         current sector.
 
-        TODO this badly needs refactoring. A conditional-plagued
-        code is not conducive to a modular, scalable design.
+        Events drive a state machine: the handler is looked up in the
+        transition table (see TransitionTable) from the train state, the
+        kind of sector it is in, and the event color.
         '''
+        if tracer.enabled:
+            tracer.stamp(self.train, PROCESS)
 
+        # handling an event may involve waiting (for the train to stop at
+        # a crossing, or for the sector ahead to be freed). Events of the
+        # same train are handled one at a time, in order.
+        self.train.runtime.run(self._process_event(event), key=self.train, event=event)
+
+    # procedure (see runtime.py)
+    def _process_event(self, event):
         # report signal color
         self.train.report_signal(tk_color[event])
 
@@ -120,65 +290,46 @@ class EventProcessor:
         # PURPLE events are associated with the cross-track.
         #TODO PURPLE tiles are not being detected reliably enough.
         # Using YELLOW for now (no braking needed in current setup).
-        # if event in [PURPLE]:
-        #     self._process_xtrack_event()
-
-        # YELLOW events cause a temporary drop in speed. In the current track
-        # layout, they are caused by a signal positioned at the highest point
-        # in a bridge; its purpose is to reduce the power setting so the train
-        # doesn't speed up too much while going over the descending part of the
-        # track.
-        if event in [YELLOW]:
-            # self._process_braking_event()
-            self._process_xtrack_event()
-
-        # RED events are reserved for handling sectors that contain a
-        # train stop (station). As such, they require a specialized logic
-        # that differs from the logic applied to regular track sectors.
-        elif event in [RED]:
-            self._process_station_event(event)
-
-        # signal events coming from sector-defining signal tiles are handled here
-        elif event in [GREEN, BLUE]:
-
-            # if the most recent signal event has a color identical to the
-            # sector color where the train is right now, this means the train
-            # detected either the sector's end signal, or the FAST-SLOW transition
-            # point in the current (structured) sector.
-            if self.train.sector is not None and \
-                    self.train.sector.color is not None and \
-                    self.train.sector.color == event and \
-                    not self.train.just_entered_sector:
-
-                if isinstance(self.train.sector, StructuredSector):
-
-                    self._handle_structured_sector(event)
+        #
+        # YELLOW events are handled by the crossing logic. RED events are
+        # reserved for handling sectors that contain a train stop (station).
+        # GREEN and BLUE events come from sector-defining signal tiles: a
+        # train in the inter-sector zone enters the sector ahead; a train in
+        # a sector that sees the sector's color detected either the sector's
+        # end signal, or the FAST-SLOW transition point in a structured
+        # sector. Anything else is an unusual situation.
+        state, kind = self.table.state(self.train)
+        key = (state, kind, event)
+        handler = self.table.table.get(key)
+        if handler is None:
+            return
 
-                else:
-                    # for a regular, non-structured sector, this event signals the
-                    # end-of-sector situation. Because in our track layout a regular
-                    # sector precedes a station sector where a mandatory stop takes
-                    # place, immediately start a slowdown to minimum speed. Note that
-                    # this logic depends in part of the specific track layout.
-                    # TODO generalize handling for regular sectors anywhere in the track.
-                    self._exit_sector(event)
-
-            elif self.train.sector is None:
-                # train is in inter-sector zone, thus this event signals the entry
-                # in a new sector
-                self._enter_sector(event)
+        transition = self.transitions.get(key)
+        if transition is None:
+            transition = self.transitions[key] = [0, 0.]
+        transition[0] += 1
+        transition[1] = self.clock()
 
-            else:
-                # handle unusual situations
-                self.recover(event)
+        steps = getattr(self, handler)(event)
+        if steps is not None:
+            yield from steps
 
     def _enter_sector(self, event):
         '''
         This method handles the situation of a train moving from the
         inter-sector zone into the sector ahead
         '''
+        # a signal of another color than the sector ahead: the train
+        # missed signals, and is further down the track
+        next_sector = layout.next_sector(self.train.previous_sector, self.train.direction)
+        if next_sector.color != event:
+            self.recover(event)
+            return
+
         # update current sector in Train instance
-        self.train.sector = self.train.previous_sector.next[self.train.direction]
+        self.train.sector = next_sector
+        operations.entered(self.train.name, self.train.sector)
+        self.train.position.entered(self.train.sector)
 
         self.train.report_sector(tk_color[event])
 
@@ -192,66 +343,135 @@ class EventProcessor:
         # it again here just in case.
         self.train.sector.occupier = self.train.name
 
-        # make sure previous sector is released.
-        self.train.previous_sector.occupier = None
+        # make sure previous sector is released, unless another train
+        # grabbed it already.
+        reservation_table.release([self.train.previous_sector], self.train.name)
+
+        # a train that looks ahead reserves its path as soon as it enters
+        # the sector, so it needs to slow down only if the path is blocked.
+        if self.train.lookahead > 0:
+            self._reserve_path()
 
         # set up timer for sanity check to prevent false detections
         # of a spurious end-of-sector signal. The sector_time parameter
         # defines a time interval, counted from the instant of sector
         # entry, during which the train is blind from sector signals.
-        # This thread acts just on the ability of a signal event to be
-        # detected; it doesn't affect train movement.
-        sector_time = self.train.sector.sector_time
-        self.train.time_in_sector = Timer(sector_time, self.train.mark_exit_valid)
+        # This timer acts just on the ability of a signal event to be
+        # detected; it doesn't affect train movement. This timer and the
+        # speedup timer below are set from the transit times measured so
+        # far (see transit.py), or from the sector settings until there
+        # are enough.
+        self.entered_at = self.clock()
+        self.entry_power = self.train.motor_handler.power
+        sector_time = transit_times.guard_time(self.train.name, self.train.sector,
+                                               self.entry_power)
+        if self.train.time_in_sector is not None:
+            self.train.time_in_sector.cancel()
         self.train.just_entered_sector = True
-        self.train.time_in_sector.start()
+        self.train.time_in_sector = self.train.runtime.schedule(sector_time,
+                                                                self.train.mark_exit_valid)
 
         # when entering sector, set timed speedup. Make sure the speedup
         # time duration ends before reaching any signal on the track.
         if self.train.speedup_timer is not None:
             self.train.speedup_timer.cancel()
-        self.train.speedup_timer = Timer(self.train.sector.max_speed_time,
-                                         self._return_to_sector_speed)
-        self.train.speedup_timer.start()
+        max_speed_time = transit_times.max_speed_time(self.train.name, self.train.sector,
+                                                      self.entry_power)
+        self.train.speedup_timer = self.train.runtime.schedule(max_speed_time,
+                                                               self._return_to_sector_speed)
+
+        # once the transit times are known, a sector signal not seen by the
+        # latest expected arrival was probably missed.
+        if self.missed_signal_timer is not None:
+            self.missed_signal_timer.cancel()
+            self.missed_signal_timer = None
+        window = transit_times.window(self.train.name, self.train.sector, self.entry_power)
+        if window is not None:
+            self.missed_signal_timer = self.train.runtime.schedule(window[1],
+                                                                   self._check_missed_signal,
+                                                                   self.entered_at)
 
         # enter sector at max speed setting
         self.accelerate(self.train.sector.max_speed)
 
+    def _record_transit(self):
+        # the train reached the sector signal: the end of a regular
+        # sector, or the FAST-SLOW transition of a structured one.
+        self.train.position.passed_signal()
+        if self.entered_at is None:
+            return
+        transit_times.record(self.train.name, self.train.sector, self.entry_power,
+                             self.clock() - self.entered_at)
+        self.entered_at = None
+
+    def _check_missed_signal(self, entered_at):
+        # the train is past the latest expected arrival at its sector
+        # signal. If it's still in the same transit, and moving, it has
+        # probably missed the signal: slow down, and hold the sector ahead,
+        # so it gets there safely. The next signal it sees places it (see
+        # recover).
+        self.missed_signal_timer = None
+        if self.entered_at != entered_at or not self.train.auto or self.train.power_index == 0:
+            return
+        print("WARNING: sector signal overdue in sector", self.train.sector.name,
+              "  ", self.train.name)
+        recoveries.late(self.train.name)
+        self.train.cancel_speedup_timer()
+        self._reserve_path()
+        if self.train.power_index > SECTOR_EXIT_SPEED:
+            self.accelerate(SECTOR_EXIT_SPEED, time=0.5)
+
     def _return_to_sector_speed(self):
+        # the train may be further from the sector signal than the timer
+        # assumed: hold max speed until its estimated position says
+        # otherwise (see position.py).
+        hold = self.train.position.time_to_signal()
+        if hold is not None and hold - SLOWDOWN_LEAD > POSITION_CHECK:
+            self.train.speedup_timer = self.train.runtime.schedule(hold - SLOWDOWN_LEAD,
+                                                                   self._return_to_sector_speed)
+            return
         self.accelerate(DEFAULT_SPEED, time=0.8)
 
-    def _handle_structured_sector(self, event):
-        '''
-        Structured sectors are divided in two sub-sectors, named FAST and SLOW.
-        The signal that marks the transition between sub-sectors is of the same
-        color as the sector color. The train always enters the sector by the FAST
-        side. The purpose of this is to provide the train an opportunity to gradually
-        slow down and check the status of the next sector, before hitting the
-        end-of-sector signal.
-
-        This method handles the two situations that may happen within a structured
-        sector:
-        1 - transition between the FAST and SLOW sub-sectors
-        2 - exit of the entire structured sector into a inter-sector zone
-        '''
-        next_sector = self.train.sector.next[self.train.direction]
-
-        if self.train.sector.sub_sector_type == FAST:
-
-            self._handle_subsector_transition(next_sector, event)
-
+    def _leave_sector(self, event):
+        # for a regular, non-structured sector, the sector signal marks the
+        # end of the sector. Because in our track layout a regular sector
+        # precedes a station sector where a mandatory stop takes place,
+        # immediately start a slowdown to minimum speed. Note that this
+        # logic depends in part of the specific track layout.
+        # TODO generalize handling for regular sectors anywhere in the track.
+        self._record_transit()
+        self._exit_sector(event)
+
+    # Structured sectors are divided in two sub-sectors, named FAST and SLOW.
+    # The signal that marks the transition between sub-sectors is of the same
+    # color as the sector color. The train always enters the sector by the FAST
+    # side. The purpose of this is to provide the train an opportunity to gradually
+    # slow down and check the status of the next sector, before hitting the
+    # end-of-sector signal.
+    #
+    # Two situations may happen within a structured sector:
+    # 1 - transition between the FAST and SLOW sub-sectors
+    # 2 - exit of the entire structured sector into a inter-sector zone
+
+    def _leave_fast_sub_sector(self, event):
+        self._record_transit()
+        next_sector = layout.next_sector(self.train.sector, self.train.direction)
+        self._handle_subsector_transition(next_sector, event)
+
+    # procedure (see runtime.py)
+    def _leave_structured_sector(self, event):
+        # leaving SLOW sub-sector, thus leaving the entire structured
+        # sector as well. Either do a full stop-and-wait, or keep going,
+        # based on occupancy status of next sector
+        self._record_transit()
+        next_sector = layout.next_sector(self.train.sector, self.train.direction)
+        if self._reserve_path():
+            # next sector is free (and now ours): exit current sector
+            # and keep moving
+            self._exit_sector(event)
         else:
-            # leaving SLOW sub-sector, thus leaving the entire structured
-            # sector as well. Either do a full stop-and-wait, or keep going,
-            # based on occupancy status of next sector
-            if next_sector.occupier is not None and \
-                    next_sector.occupier != self.train.name:
-                # occupied: stop and keep interrogating next sector
-                self._stop_and_wait(next_sector)
-            else:
-                # next sector is free: exit current sector
-                # and keep moving
-                self._exit_sector(event)
+            # occupied: stop and keep interrogating next sector
+            yield from self._stop_and_wait(next_sector)
 
     def _handle_subsector_transition(self, next_sector, event):
         '''
@@ -267,14 +487,16 @@ class EventProcessor:
         # Decision on how to behave from now on depends on the occupancy status
         # of the next sector ahead of train. Train should slow down and eventually
         # stop only if next sector is occupied. Otherwise, grab next sector.
-        if next_sector.occupier is not None and next_sector.occupier != self.train.name:
+        # Checking and grabbing is a single atomic step, so two trains can't
+        # both grab it. With look-ahead, the next sector is normally ours
+        # already.
+        if not self._reserve_path():
             # next sector is occupied: slow down to minimum speed and wait for
             # end-of-sector signal.
             self.accelerate(SECTOR_EXIT_SPEED, time=0.2)
 
         else:
-            # next sector is free. Grab it.
-            next_sector.occupier = self.train.name
+            # next sector was free, and is now ours.
 
             # drop speed to a reasonable value to cross over the inter-sector zone,
             # but avoid using train.down_speed(), since it kills any underlying threads.
@@ -283,7 +505,7 @@ class EventProcessor:
 
     def _process_station_event(self, event):
         '''
-        Processes events associated with train stations
+        Processes events associated with train stations. Procedure (see runtime.py).
         '''
         # Check if this is the first, or second signal in a station segment.
         if self.last_station_event is None:
@@ -299,21 +521,31 @@ class EventProcessor:
             # thread associated with train movement is cancelled.
             self.train.cancel_acceleration_thread()
             self.train.cancel_speedup_timer()
-            sleep(0.01)
+            yield 0.01
             self.train.stop(from_handset=False)
 
             # gui displays station color
             self.train.report_sector(tk_color[event])
 
             # make sure previous sector is released.
-            self.train.previous_sector.occupier = None
+            reservation_table.release([self.train.previous_sector], self.train.name)
 
             # mark current sector as occupied. Note that this is not
             # strictly required in the current implementation, but we
             # do it anyway for debugging and logging purposes.
-            self.train.previous_sector.next[self.train.direction].occupier = self.train.name
+            station_sector = layout.next_sector(self.train.previous_sector, self.train.direction)
+            station_sector.occupier = self.train.name
+
+            # each station stop completes a lap
+            operations.stopped(self.train.name, station_sector)
+            self.train.position.anchor()
+            self.train.report_laps()
 
-            # after stopping at station, execute a Timer delay followed by a re-start
+            # give up any path reserved beyond the station, so other trains
+            # can use it while this one waits.
+            layout.release_path(station_sector, self.train.direction, self.train.name)
+
+            # after stopping at station, execute a timed delay followed by a re-start
             self.train.timed_stop_at_station()
 
             # if a secondary train instance is registered, call its stop
@@ -333,6 +565,16 @@ class EventProcessor:
             # above.
             self.train.initialize_sectors()
 
+    def _reserve_path(self):
+        '''
+        Reserves the path ahead of the current sector: the next sector, or
+        as many sectors as the train looks ahead.
+
+        :return: the path reserved; empty if the next sector is taken
+        '''
+        return layout.reserve_path(self.train.sector, self.train.direction, self.train.name,
+                                   max(1, self.train.lookahead))
+
     def _exit_sector(self, event):
 
         # define speed to be used in inter-sector zone
@@ -343,16 +585,19 @@ class EventProcessor:
         # entering inter-sector zone
         self.train.previous_sector = self.train.sector
         self.train.sector = None
+        operations.left(self.train.name)
+        self.train.position.anchor()
         self.train.report_sector(tk_color[INTER_SECTOR])
 
         self.accelerate(exit_speed, time=0.5)
 
+    # procedure (see runtime.py)
     def _process_braking_event(self):
         # fast braking
         self.accelerate(1, time=0.1)
 
         # keep brake applied
-        time.sleep(DEFAULT_BRAKING_TIME)
+        yield DEFAULT_BRAKING_TIME
 
         # accelerate back to sector speed
         if self.train.sector is not None:
@@ -362,7 +607,8 @@ class EventProcessor:
 
         self.accelerate(pi)
 
-    def _process_xtrack_event(self):
+    # procedure (see runtime.py)
+    def _process_xtrack_event(self, event):
 
         # catch false detections and special situations
         # In the curremt layout, a special situation arises with a
@@ -372,7 +618,7 @@ class EventProcessor:
                 # this can be a xtrack in an inter-sector stretch of track
                 previous_sector = self.train.previous_sector
                 if previous_sector is not None:
-                    xt1 = previous_sector.look_ahead
+                    xt1 = layout.exit_crossing(previous_sector)
                     if xt1 is not None and isinstance(xt1, XTrack):
                         # check out from xtrack
                         xt1.book(self.train)
@@ -382,6 +628,11 @@ class EventProcessor:
             else:
                 return
 
+        # the crossing whose signals show up in this sector, if any
+        xtrack = layout.crossing_in(self.train.sector, self.train.direction)
+        if xtrack is None:
+            return
+
         # only handle signal if sector and direction are self-consistent.
         # This is redundant for now, but we keep the code in here in the
         # hopes it might be needed when implementing other track layouts.
@@ -394,14 +645,19 @@ class EventProcessor:
                 self.train.cancel_speedup_timer()
                 self.train.cancel_station_timer()
 
+                # stopping skews the transit time of this sector
+                self.entered_at = None
+
                 # brake and wait until full stop
                 speed = self.train.power_index
                 self.accelerate(0, time=XTRACK_BRAKING_TIME)
-                time.sleep(XTRACK_BRAKING_TIME + 0.5) # leeway to account for inertia
+                yield XTRACK_BRAKING_TIME + 0.5 # leeway to account for inertia
 
                 # wait until crossing opens
-                while not xtrack.is_free(self.train):
-                    time.sleep(0.5)
+                waiting = self.clock()
+                yield Wait(lambda: xtrack.is_free(self.train),
+                           waiter=self.train.name, resource=xtrack)
+                operations.waited(self.train.name, xtrack, self.clock() - waiting)
 
                 # this is the train that last stopped at the xtrack
                 xtrack.last_stopped = self.train.name
@@ -476,57 +732,84 @@ class EventProcessor:
 
         self.train.accelerate(power_index_range, power_index_sign, sleep_time=sleep_time)
 
+    # procedure (see runtime.py)
     def _stop_and_wait(self, next_sector):
         self.train.stop(from_handset=False)
 
         # make sure we wait for the next sector to go free. This
         # may be redundant here, since train.restart_movement should
         # be doing the same check anyway. We do just in case though.
-        while next_sector.occupier is not None and \
-              next_sector.occupier != self.train.name:
-            time.sleep(0.3)
+        waiting = self.clock()
+        yield Wait(lambda: next_sector.occupier is None or next_sector.occupier == self.train.name,
+                   waiter=self.train.name, resource=next_sector)
+        operations.waited(self.train.name, next_sector, self.clock() - waiting)
 
         self._exit_sector("from stop and wait")
-        self.train.restart_movement()
+        yield from self.train._restart_movement()
 
     def recover(self, event):
-        # TODO this situation may happen when moving from BLUE to GREEN (or vice-versa)
-        # and missing the BLUE end-of-sector signal. The next signal to be detected is
-        # GREEN, so it is interpreted as a spurious signal. We may attempt to fix the
-        # situation by forcing the current sector to be this last sensed event, GREEN.
-        # This requires that:
-        # - the train.sector attribute be updated;
-        # - the track sectors be updated
-        # These updates are contingent upon the availability of sectors. Any conflict
-        # should result in an emergency stop. Could we try a recovery sequence after this
-        # stop?
-        # Maybe we don't need to handle the other similar case, that is, missing the
-        # GREEN end-of-sector signal, because a station reset will happen anyway (provided
-        # the RED signal be detected).
-        print("ERROR: spurious signal inside sector. Train sector: ", self.train.sector.color,
-              "  event: ", event, "  just entered: ", self.train.just_entered_sector, "  ",
-              self.train.name)
-
-        # # event color matches train's next sector color. This means that the end-of-sector
-        # # signal was missed and the train already entered the next sector.
-        #
-        # if not self.train.just_entered_sector:
-        #
-        #     if event == self.train.sector.next[self.train.direction].color:
-        #
-        #         # if next sector (where the train is physically in now) is not occupied,
-        #         # grab it
-        #         if self.train.sector.next[self.train.direction].occupier is None:
-        #             self.train.sector.next[self.train.direction].occupier = self.train.name
-        #             self.train.previous_sector = self.train.sector
-        #             self.train.sector = self.train.sector.next
-        #
-        #             print("Fixed!")
-        #
-        #         # if next sector is occupied, emergency abort
-        #         else:
-        #             self.train.dispatcher.emergency_stop()
+        '''
+        Resynchronizes a train that missed signals: it saw a sector signal
+        that doesn't match the sector it believes it's in, or the sector
+        ahead of it (see recovery.py).
+
+        This happens, for instance, when moving from BLUE to GREEN and missing
+        the BLUE end-of-sector signal: the next signal detected is GREEN. The
+        train is then placed in the nearest sector of the event color ahead,
+        and carries on as if it had just entered it. If that sector is held
+        by another train, all trains are stopped.
+        '''
+        name = self.train.name
+        sector = self.train.sector
+
+        # the signal of the sector just entered, once more: a double
+        # detection of the entry signal. Or, between sectors, the exit
+        # signal of the sector just left, seen again by a slow or stopped
+        # train.
+        origin = sector if sector is not None else self.train.previous_sector
+        if origin.color == event:
+            recoveries.spurious(name)
+            return
+
+        path = layout.locate(origin, self.train.direction, event)
+
+        # claiming the sector is a single atomic step, so a train can't
+        # grab it meanwhile
+        if not path or not reservation_table.try_acquire(path[-1:], name):
+            print("ERROR: missed signal, can't resynchronize. Train sector: ", origin.name,
+                  "  event: ", event, "  ", name)
+            recoveries.emergency_stop(name)
+            self._emergency_stop()
+            return
+
+        print("WARNING: missed signal, resynchronized to sector", path[-1].name,
+              "from", origin.name, "  ", name)
+        recoveries.recovered(name, len(path) - 1)
+
+        # the train passed the sectors in between: give them up
+        reservation_table.release([origin] + path[:-1], name)
+        if sector is not None:
+            operations.left(name)
+
+        # the transit through the sector left can't be measured, and any
+        # station on the way was passed
+        self.entered_at = None
+        self.last_station_event = None
+
+        self.train.sector = None
+        self.train.previous_sector = path[-2] if len(path) > 1 else origin
+        self._enter_sector(event)
+
+    def _emergency_stop(self):
+        dispatcher = self.train.dispatcher
+        if dispatcher is not None:
+            dispatcher.emergency_stop()
+            return
 
+        # no controller: stop this train, and hand it over to manual mode
+        self.train.auto = False
+        self.train.cancel_all_threads()
+        self.train.stop(from_handset=False)
 
     def _debug(self, msg):
         print("----------------- SECTORS STATUS ---------------------------------")
@@ -537,6 +820,24 @@ class EventProcessor:
         print("")
 
 
+def dump_transitions(fp=sys.stdout):
+    '''
+    Prints the number of times each state machine transition was taken,
+    and how long ago it was last taken, for all trains.
+    '''
+    fp.write("State machine transitions\n")
+    fp.write("%-12s %-16s %-20s %-8s %7s %9s\n" %
+             ("train", "state", "sector kind", "event", "count", "ago (s)"))
+    for processor in event_processors:
+        now = processor.clock()
+        for (state, kind, event), (count, last) in sorted(processor.transitions.items(),
+                                                           key=lambda item: str(item[0])):
+            kind = "%s %s" % kind if kind is not None else "-"
+            fp.write("%-12s %-16s %-20s %-8s %7i %9.1f\n" %
+                     (processor.train.name[:12], state, kind, event, count, now - last))
+    fp.flush()
+
+
 class DummyEventProcessor(EventProcessor):
     '''
     Testing / debug
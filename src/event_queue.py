@@ -0,0 +1,209 @@
+'''
+Per-train event queue.
+
+In the threaded control mode, a train's signal events used to be handled
+in the BLE notification thread that delivered the vision sensor sample.
+Handling an event may wait for seconds (braking at a booked crossing,
+waiting for the sector ahead to be freed), and sensor notifications backed
+up, or were dropped, in the meantime.
+
+Each train now gets an EventQueue: a bounded queue drained by a single
+worker thread, which handles the train's events one at a time, in order.
+The BLE callback only classifies the sample, votes it through the sensor
+event filter, and enqueues the events confirmed.
+
+The queue holds sensor events, and other control procedures of the train
+(the restart at the end of a station stop). Only sensor events, submitted
+with a tag (their color), can be dropped; other items are always kept, so
+a train can't be stranded by a lost restart.
+
+While a train sits on a tile, waiting at a crossing or for the sector
+ahead, the sensor event filter confirms the same color again every
+TIME_THRESHOLD. These repeats are coalesced: a sensor event is dropped if
+the last sensor event waiting has the same tag. A sensor event that waited
+longer than max_age is stale, and is dropped when it comes up: it would be
+checked against the train state of a different time.
+
+When the queue is full, the overflow policy decides what happens to a
+sensor event:
+
+    DROP_OLDEST     the oldest sensor event waiting is dropped (the
+                    default; events that waited that long are stale)
+    DROP_NEWEST     the new event is dropped
+    BLOCK           the caller blocks until there is room
+
+Each queue keeps counters on events submitted, handled, coalesced, stale
+and dropped, on queue depth, and on the time events wait in the queue.
+dump_event_queues prints them for all queues.
+'''
+import collections
+import sys
+import time
+import traceback
+from threading import Condition, Thread
+
+from tracing import Histogram
+
+# events waiting per train
+EVENT_QUEUE_SIZE = 16
+
+# sensor events that waited longer than this are stale
+EVENT_MAX_AGE = 2. # s
+
+# overflow policies
+DROP_OLDEST = "drop oldest"
+DROP_NEWEST = "drop newest"
+BLOCK = "block"
+
+# all queues created so far, for metrics reporting
+event_queues = []
+
+
+class EventQueue():
+    '''
+    Bounded event queue and worker thread for one train.
+
+    :param name: name used in metrics reports, typically the train name
+    :param handler: called by the worker thread with each event
+    :param maxsize: maximum number of events waiting in the queue
+    :param policy: overflow policy: DROP_OLDEST, DROP_NEWEST, or BLOCK
+    :param on_drop: optional; called with each event dropped
+    :param max_age: sensor events that waited longer than this, in
+        seconds, are dropped
+    '''
+    def __init__(self, name, handler, maxsize=EVENT_QUEUE_SIZE, policy=DROP_OLDEST,
+                 on_drop=None, max_age=EVENT_MAX_AGE):
+        if policy not in (DROP_OLDEST, DROP_NEWEST, BLOCK):
+            raise ValueError("unknown overflow policy: %s" % policy)
+
+        self.name = name
+        self.handler = handler
+        self.maxsize = maxsize
+        self.policy = policy
+        self.on_drop = on_drop
+        self.max_age = max_age
+
+        self.condition = Condition()
+
+        # (submit time, event, tag) entries; tag is None for items that
+        # can't be dropped
+        self.events = collections.deque()
+
+        # metrics. Counters are protected by the condition's lock, except
+        # for those updated by the worker thread only.
+        self.submitted = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.stale = 0
+        self.max_depth = 0
+        self.handled = 0
+        self.errors = 0
+        self.wait_latency = Histogram()
+
+        self.thread = Thread(target=self._run, name="EventQueue " + name, daemon=True)
+        self.thread.start()
+
+        event_queues.append(self)
+
+    def submit(self, event, tag=None):
+        '''
+        Enqueues an event and returns, unless the queue is full and the
+        policy is BLOCK.
+
+        :param tag: for sensor events, the color seen; None for items that
+            must not be dropped
+        :return: False if the event was dropped
+        '''
+        dropped = None
+        with self.condition:
+            self.submitted += 1
+            if tag is not None:
+                if tag == self._last_tag():
+                    # a repeat of the last sensor event, still waiting
+                    self.coalesced += 1
+                    dropped = event
+                elif len(self.events) >= self.maxsize:
+                    if self.policy == DROP_NEWEST:
+                        self.dropped += 1
+                        dropped = event
+                    elif self.policy == DROP_OLDEST:
+                        dropped = self._drop_oldest()
+                    else:
+                        while len(self.events) >= self.maxsize:
+                            self.condition.wait()
+
+            if dropped is not event:
+                self.events.append((time.perf_counter(), event, tag))
+                self.max_depth = max(self.max_depth, len(self.events))
+                self.condition.notify_all()
+
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+        return dropped is not event
+
+    def _last_tag(self):
+        # tag of the last sensor event waiting. Called with the lock held.
+        for entry in reversed(self.events):
+            if entry[2] is not None:
+                return entry[2]
+        return None
+
+    def _drop_oldest(self):
+        # drops the oldest sensor event waiting, if any. Called with the
+        # lock held.
+        for entry in self.events:
+            if entry[2] is not None:
+                self.events.remove(entry)
+                self.dropped += 1
+                return entry[1]
+        return None
+
+    @property
+    def depth(self):
+        with self.condition:
+            return len(self.events)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.events:
+                    self.condition.wait()
+                submit_time, event, tag = self.events.popleft()
+                # room for a blocked caller
+                self.condition.notify_all()
+
+            waited = time.perf_counter() - submit_time
+            self.wait_latency.add(waited * 1000.)
+            if tag is not None and waited > self.max_age:
+                with self.condition:
+                    self.stale += 1
+                if self.on_drop is not None:
+                    self.on_drop(event)
+                continue
+
+            try:
+                self.handler(event)
+            except Exception:
+                self.errors += 1
+                print("ERROR: event handling failed on", self.name)
+                traceback.print_exc()
+            self.handled += 1
+
+
+def dump_event_queues(fp=sys.stdout):
+    '''
+    Prints queue metrics, with wait latencies in milliseconds, for all
+    event queues.
+    '''
+    fp.write("Event queues (latencies in ms)\n")
+    fp.write("%-16s %9s %7s %9s %5s %7s %7s %6s %6s %9s %9s\n" %
+             ("train", "submitted", "handled", "coalesced", "stale", "dropped", "errors",
+              "depth", "max", "wait avg", "wait max"))
+    for event_queue in event_queues:
+        fp.write("%-16s %9i %7i %9i %5i %7i %7i %6i %6i %9.2f %9.2f\n" %
+                 (event_queue.name[:16], event_queue.submitted, event_queue.handled,
+                  event_queue.coalesced, event_queue.stale, event_queue.dropped,
+                  event_queue.errors, event_queue.depth,
+                  event_queue.max_depth, event_queue.wait_latency.mean,
+                  event_queue.wait_latency.maximum))
+    fp.flush()
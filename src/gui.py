@@ -28,12 +28,13 @@ ASTATION = "@STATION"
 SECTOR = "SECTOR"
 SIGNAL = "SIGNAL"
 XTRACK = "XTRACK"
+LAPS = "LAPS"
 
 
 class GUI():
     def __init__(self):
         self.root = T.Tk()
-        self.root.geometry("600x480")
+        self.root.geometry("600x540")
         font = ('Helvetica', 36)
 
         self.root.title("Lego train control")
@@ -52,6 +53,7 @@ class GUI():
         T.Label(left_frame, text="@ station", font=font, justify=LEFT).pack(side=TOP)
         T.Label(left_frame, text="Sector",    font=font, justify=LEFT).pack(side=TOP)
         T.Label(left_frame, text="Xtrack",    font=font, justify=LEFT).pack(side=TOP)
+        T.Label(left_frame, text="Laps/h",    font=font, justify=LEFT).pack(side=TOP)
 
         # text variables
         self.name_1_text     = StringVar(center_frame, '')
@@ -60,6 +62,7 @@ class GUI():
         self.speed_1_text    = StringVar(center_frame, '- - -')
         self.power_1_text    = StringVar(center_frame, '- - -')
         self.astation_1_text = StringVar(center_frame, '- - -')
+        self.laps_1_text     = StringVar(center_frame, '- - -')
         # self.sector_1_text   = StringVar(center_frame, '- - -')
 
         self.name_2_text     = StringVar(right_frame, '')
@@ -68,6 +71,7 @@ class GUI():
         self.speed_2_text    = StringVar(right_frame, '- - -')
         self.power_2_text    = StringVar(right_frame, '- - -')
         self.astation_2_text = StringVar(center_frame, '- - -')
+        self.laps_2_text     = StringVar(right_frame, '- - -')
         # self.sector_2_text   = StringVar(center_frame, '- - -')
 
         # center frame: fields associated with id 1
@@ -82,6 +86,7 @@ class GUI():
         # self.sector_1_label   = T.Label(center_frame, textvariable=self.sector_1_text, font=font, width=width, anchor="e")
         self.sector_1_label   = T.Label(center_frame, font=font, width=5, anchor="e")
         self.xtrack_1_label   = T.Label(center_frame, font=font, width=5, anchor="e")
+        self.laps_1_label     = T.Label(center_frame, textvariable=self.laps_1_text, font=font, width=width)
 
         self.name_1_label.pack(side=TOP)
         self.voltage_1_label.pack(side=TOP)
@@ -92,6 +97,7 @@ class GUI():
         self.astation_1_label.pack(side=TOP)
         self.sector_1_label.pack(side=TOP)
         self.xtrack_1_label.pack(side=TOP)
+        self.laps_1_label.pack(side=TOP)
 
         # right frame: fields associated with id 2
         self.name_2_label     = T.Label(right_frame, textvariable=self.name_2_text, font=font)
@@ -104,6 +110,7 @@ class GUI():
         # self.sector_2_label   = T.Label(right_frame, textvariable=self.sector_2_text, font=font, width=width, anchor="e")
         self.sector_2_label   = T.Label(right_frame, font=font, width=5, anchor="e")
         self.xtrack_2_label   = T.Label(right_frame, font=font, width=5, anchor="e")
+        self.laps_2_label     = T.Label(right_frame, textvariable=self.laps_2_text, font=font, width=width)
 
         self.name_2_label.pack(side=TOP)
         self.voltage_2_label.pack(side=TOP)
@@ -114,6 +121,7 @@ class GUI():
         self.astation_2_label.pack(side=TOP)
         self.sector_2_label.pack(side=TOP)
         self.xtrack_2_label.pack(side=TOP)
+        self.laps_2_label.pack(side=TOP)
 
         left_frame.pack(side=LEFT)
         center_frame.pack(side=LEFT)
@@ -175,6 +183,13 @@ class GUI():
             vname = f"astation_{id}_text".format(id=id)
             self.__dict__[vname].set(astation)
 
+        elif tokens[0] == LAPS:
+            id = tokens[2].strip()
+            laps = tokens[3]
+
+            vname = f"laps_{id}_text".format(id=id)
+            self.__dict__[vname].set(laps)
+
         elif tokens[0] == SECTOR:
             id = tokens[2].strip()
 
@@ -0,0 +1,175 @@
+'''
+Per-hub BLE command queue.
+
+pylgbst is not thread-safe, so writes to a hub (motor power, LED color,
+headlight brightness) must not overlap. Instead of serializing every write
+to every hub through one lock, each hub gets a HubWriter: a bounded command
+queue drained by a single writer thread, which is then the only thread that
+writes to that hub. Callers enqueue a command and return immediately, and a
+slow write to one hub no longer stalls the others.
+
+Writes that can be lost, such as LED blink frames, are submitted with
+try_submit, which drops them instead of blocking when the queue is full.
+
+Each writer keeps metrics on queue depth, on the time commands wait in the
+queue, and on the time the writes themselves take. dump_metrics prints
+them for all writers.
+'''
+import queue
+import sys
+import time
+import traceback
+from threading import Event, Lock, Thread
+
+from tracing import Histogram
+
+# commands waiting per hub. When full, callers block until there's room,
+# or, with try_submit, drop their write.
+QUEUE_SIZE = 32
+
+# sentinel that stops the writer thread
+_STOP = object()
+
+# all writers created so far, for metrics reporting
+writers = []
+
+
+class HubWriter():
+    '''
+    Bounded command queue and writer thread for one hub.
+
+    :param name: name used in metrics reports, typically the train name
+    :param maxsize: maximum number of commands waiting in the queue
+    :param lock: optional lock held around each write. Only needed when
+        writes must also be serialized with something outside this writer.
+    '''
+    def __init__(self, name, maxsize=QUEUE_SIZE, lock=None):
+        self.name = name
+        self.lock = lock
+        self.queue = queue.Queue(maxsize)
+
+        # metrics. Counters updated by callers are protected by
+        # metrics_lock; the rest is updated by the writer thread only.
+        self.metrics_lock = Lock()
+        self.submitted = 0
+        self.blocked = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.writes = 0
+        self.errors = 0
+        self.wait_latency = Histogram()
+        self.write_latency = Histogram()
+
+        self.thread = Thread(target=self._run, name="HubWriter " + name, daemon=True)
+        self.thread.start()
+
+        writers.append(self)
+
+    def submit(self, function, *args, **kwargs):
+        '''
+        Enqueues a hub write and returns. The writer thread will call
+        function(*args, **kwargs).
+        '''
+        self._put((time.perf_counter(), function, args, kwargs, None))
+
+    def try_submit(self, function, *args, **kwargs):
+        '''
+        Enqueues a hub write and returns, unless the queue is full: the
+        write is then dropped.
+
+        :return: False if the write was dropped
+        '''
+        return self._put((time.perf_counter(), function, args, kwargs, None), block=False)
+
+    def call(self, function, *args, **kwargs):
+        '''
+        Enqueues a hub access and waits for it to be done, in order with
+        the writes already queued. Returns what function returns.
+        '''
+        done = Event()
+        result = [None, None]
+        self._put((time.perf_counter(), function, args, kwargs, (done, result)))
+        done.wait()
+        if result[1] is not None:
+            raise result[1]
+        return result[0]
+
+    def close(self):
+        '''
+        Stops the writer thread once the commands already queued are done.
+        '''
+        self.queue.put(_STOP)
+        self.thread.join()
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+    def _put(self, item, block=True):
+        try:
+            self.queue.put_nowait(item)
+            blocked = 0
+        except queue.Full:
+            if not block:
+                with self.metrics_lock:
+                    self.dropped += 1
+                return False
+            blocked = 1
+            self.queue.put(item)
+
+        depth = self.queue.qsize()
+        with self.metrics_lock:
+            self.submitted += 1
+            self.blocked += blocked
+            self.max_depth = max(self.max_depth, depth)
+        return True
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+
+            submit_time, function, args, kwargs, reply = item
+            start = time.perf_counter()
+            result = None
+            error = None
+            try:
+                if self.lock is not None:
+                    with self.lock:
+                        result = function(*args, **kwargs)
+                else:
+                    result = function(*args, **kwargs)
+            except Exception as exception:
+                error = exception
+                self.errors += 1
+                if reply is None:
+                    print("ERROR: hub write failed on", self.name)
+                    traceback.print_exc()
+            end = time.perf_counter()
+
+            self.writes += 1
+            self.wait_latency.add((start - submit_time) * 1000.)
+            self.write_latency.add((end - start) * 1000.)
+
+            if reply is not None:
+                done, reply_result = reply
+                reply_result[0] = result
+                reply_result[1] = error
+                done.set()
+
+
+def dump_metrics(fp=sys.stdout):
+    '''
+    Prints queue and latency metrics, in milliseconds, for all writers.
+    '''
+    fp.write("Hub command queues (latencies in ms)\n")
+    fp.write("%-16s %7s %7s %7s %7s %7s %6s %9s %9s %9s %9s\n" %
+             ("hub", "writes", "errors", "blocked", "dropped", "depth", "max",
+              "wait avg", "wait max", "write avg", "write max"))
+    for writer in writers:
+        fp.write("%-16s %7i %7i %7i %7i %7i %6i %9.2f %9.2f %9.2f %9.2f\n" %
+                 (writer.name[:16], writer.writes, writer.errors, writer.blocked, writer.dropped,
+                  writer.depth, writer.max_depth, writer.wait_latency.mean, writer.wait_latency.maximum,
+                  writer.write_latency.mean, writer.write_latency.maximum))
+    fp.flush()
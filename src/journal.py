@@ -0,0 +1,176 @@
+'''
+Binary sensor journal.
+
+A SmartTrain can log every raw vision sensor sample, and every event its
+sensor event filter confirms, to an append-only binary file: the train's
+journal. A run from the field can then be replayed, far faster than real
+time, to reproduce whatever the train did (see replay.py).
+
+The journal is a sequence of fixed-size records, little endian:
+
+    timestamp   double      monotonic clock, seconds
+    r, g, b     uint16      raw RGB sample (zero for events)
+    color       int8        index of the color in SIGNAL_COLORS; -1 if the
+                            sample matches no color
+    kind        uint8       START, SAMPLE, or EVENT
+
+Every time a journal is opened, a START record is appended, so a file
+holds any number of runs. Timestamps start over with each run (monotonic
+clocks have no fixed origin).
+
+Callers never block on the file: records are packed and put on a queue,
+drained by a writer thread that writes them out in batches.
+'''
+import queue
+import struct
+import sys
+import time
+import traceback
+from signal import SIGNAL_COLORS
+from threading import Thread
+
+# record kinds
+START = 0
+SAMPLE = 1
+EVENT = 2
+
+RECORD = struct.Struct("<d3HbB")
+
+# records written at most per file write
+BATCH = 256
+
+# sentinel that stops the writer thread
+_STOP = object()
+
+# all journals opened so far, so they can be closed at exit
+journals = []
+
+
+class Journal():
+    '''
+    Append-only journal of one train's vision sensor samples and events.
+
+    :param path: journal file name; appended to if it exists
+    :param clock: returns the current time, in seconds
+    :param colors: colors that can be logged, in index order
+    '''
+    def __init__(self, path, clock=time.monotonic, colors=SIGNAL_COLORS):
+        self.path = path
+        self.clock = clock
+        self.index = {color: i for i, color in enumerate(colors)}
+        self.index[None] = -1
+
+        self.queue = queue.SimpleQueue()
+        self.records = 0
+        self.errors = 0
+
+        self.fp = open(path, "ab")
+        self.thread = Thread(target=self._run, name="Journal " + path, daemon=True)
+        self.thread.start()
+
+        self.queue.put(RECORD.pack(self.clock(), 0, 0, 0, -1, START))
+
+        journals.append(self)
+
+    def sample(self, r, g, b, color):
+        '''
+        Logs a raw sample, and the color it was classified as.
+        '''
+        self.queue.put(RECORD.pack(self.clock(), _clip(r), _clip(g), _clip(b),
+                                   self.index[color], SAMPLE))
+
+    def event(self, color, event_time=None):
+        '''
+        Logs an event confirmed by the sensor event filter.
+        '''
+        if event_time is None:
+            event_time = self.clock()
+        self.queue.put(RECORD.pack(event_time, 0, 0, 0, self.index[color], EVENT))
+
+    def close(self):
+        '''
+        Writes out the records queued, and closes the file.
+        '''
+        self.queue.put(_STOP)
+        self.thread.join()
+        if self in journals:
+            journals.remove(self)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < BATCH:
+                try:
+                    batch.append(self.queue.get(block=False))
+                except queue.Empty:
+                    break
+
+            stop = batch[-1] is _STOP
+            if stop:
+                batch.pop()
+            try:
+                self.fp.write(b"".join(batch))
+                self.fp.flush()
+                self.records += len(batch)
+            except Exception:
+                self.errors += 1
+                print("ERROR: journal write failed on", self.path)
+                traceback.print_exc()
+            if stop:
+                self.fp.close()
+                return
+
+
+def close_journals():
+    '''
+    Closes all journals, writing out the records queued.
+    '''
+    for journal in list(journals):
+        journal.close()
+
+
+def _clip(value):
+    return min(max(int(value), 0), 0xffff)
+
+
+def read_journal(path, colors=SIGNAL_COLORS):
+    '''
+    Reads a journal file.
+
+    :return: the records, as (timestamp, r, g, b, color, kind) tuples;
+        color is None if the sample matched no color. An incomplete last
+        record (the file was being written) is skipped.
+    '''
+    with open(path, "rb") as fp:
+        data = fp.read()
+    end = len(data) - len(data) % RECORD.size
+    for timestamp, r, g, b, index, kind in RECORD.iter_unpack(data[:end]):
+        yield timestamp, r, g, b, (colors[index] if index >= 0 else None), kind
+
+
+def runs(records):
+    '''
+    Splits journal records into runs, at START records.
+
+    :return: list of runs, each a list of records
+    '''
+    result = []
+    for record in records:
+        if record[5] == START or not result:
+            result.append([])
+        if record[5] != START:
+            result[-1].append(record)
+    return result
+
+
+def dump_journal(path, fp=sys.stdout):
+    '''
+    Prints a summary of each run in a journal file.
+    '''
+    fp.write("Journal %s\n" % path)
+    fp.write("%4s %9s %9s %7s\n" % ("run", "duration", "samples", "events"))
+    for i, run in enumerate(runs(read_journal(path))):
+        duration = run[-1][0] - run[0][0] if run else 0.
+        samples = sum(1 for record in run if record[5] == SAMPLE)
+        fp.write("%4i %9.1f %9i %7i\n" % (i, duration, samples, len(run) - samples))
+    fp.flush()
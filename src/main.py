@@ -1,9 +1,24 @@
-from threading import RLock
 
 import uuid_definitions
+from aio import AsyncRuntime
 from controller import Controller
+from dwell import dwell_scheduler
+from event import dump_transitions
+from event_queue import dump_event_queues
 from gui import GUI
-from train import CompoundTrain, SimpleTrain, SmartTrain
+from hub_writer import dump_metrics
+from journal import close_journals
+from operations import operations
+from position import dump_positions
+from recovery import recoveries
+from reservations import reservations, wait_for
+from runtime import threaded
+from tracing import tracer
+from train import CompoundTrain, SimpleTrain, SmartTrain, dump_motor_metrics
+from transit import transit_times
+
+# operational metrics are written here, as JSON, when the GUI window is closed
+OPERATIONS_FILE = "operations.json"
 
 '''
 Correct startup sequence requires that, with the script already started, the train
@@ -18,9 +33,24 @@ won't respond to button presses from this point on).
 
 if __name__ == '__main__':
 
-    # global lock for threading access to BLE functionality
-    lock = RLock()
-    # lock = None
+    # each hub gets its own command queue and writer thread, so no global
+    # lock is needed to access BLE functionality. Use a global lock only to
+    # serialize writes across all hubs.
+    # lock = RLock()
+    lock = None
+
+    # latency tracing, from vision sensor notification to motor command.
+    # Latency histograms are printed when the GUI window is closed.
+    # tracer.enable()
+
+    # control mode: threads (the default), or coroutines on a single asyncio
+    # event loop that also drives the GUI.
+    runtime = threaded
+    # runtime = AsyncRuntime()
+
+    # station dwell times follow the occupancy of the path ahead; uncomment
+    # to pick them at random instead, and compare the metrics at exit.
+    # dwell_scheduler.adaptive = False
 
     # Tkinter window for displaying status information
     gui = GUI()
@@ -29,44 +59,70 @@ if __name__ == '__main__':
 
     # ---------------------- Simple train setup --------------------------
 
-    # train = SimpleTrain("Train", "1", lock=lock, report=True, record=True,
+    # train = SimpleTrain("Train", "1", lock=lock, runtime=runtime, report=True, record=True,
     #                           gui=gui, address=uuid_definitions.HUB_ORIG)
-    # controller = Controller(train)
+    # controller = Controller(train, runtime=runtime)
 
     # ---------------------- Smart train setup for testing ----------------------------
 
-    # train = SmartTrain("Train 1", "1", lock=lock, report=True, record=True,
+    # train = SmartTrain("Train 1", "1", lock=lock, runtime=runtime, report=True, record=True,
     #                         gui=gui, direction=DIRECTION_B, address=uuid_definitions.HUB_ORIG)
-    # train = SmartTrain("Train 2", "2", lock=lock, report=True, record=True,
+    # train = SmartTrain("Train 2", "2", lock=lock, runtime=runtime, report=True, record=True,
     #                         gui=gui, address=uuid_definitions.HUB_TEST)
-    # controller = Controller(train)
+    # controller = Controller(train, runtime=runtime)
 
     # ---------------------- Two-train setup (Smart self-driving) ----------------------------
 
-    # train1 = SmartTrain("Blue", "1", lock=lock, report=True, record=True,
+    # train1 = SmartTrain("Blue", "1", lock=lock, runtime=runtime, report=True, record=True,
     #                     gui=gui, direction=DIRECTION_B, address=uuid_definitions.HUB_ORIG)
-    # train2 = SmartTrain("Purple", "2", ncars=1, led_color=COLOR_PURPLE, lock=lock, report=True, record=True,
+    # train2 = SmartTrain("Purple", "2", ncars=1, led_color=COLOR_PURPLE, lock=lock, runtime=runtime, report=True, record=True,
     #                         gui=gui, address=uuid_definitions.HUB_TEST)
     #
-    # controller = Controller(train1, train2=train2)
+    # controller = Controller(train1, train2, runtime=runtime)
+    #
+    # Any number of trains can be handed to the controller. The handset left
+    # and right button sets drive the first two, unless mapped otherwise:
+    #
+    # controller = Controller(train1, train2, train3, runtime=runtime,
+    #                         handset_map={RemoteButton.LEFT: "Blue", RemoteButton.RIGHT: "Green"})
 
     # ---------------------- Compound train setup --------------------------
 
     # front train hub allows control over the LED headlight.
-    train_front = SimpleTrain("Front", "1", lock=lock, report=True, record=True,
+    train_front = SimpleTrain("Front", "1", lock=lock, runtime=runtime, report=True, record=True,
                               gui=gui, address=uuid_definitions.HUB_ORIG)
 
     # rear train hub has a vision sensor
-    train_rear = SmartTrain("Rear", "2", lock=lock, report=True, record=True,
-                            gui=gui, address=uuid_definitions.HUB_TEST)
+    train_rear = SmartTrain("Rear", "2", lock=lock, runtime=runtime, report=True, record=True,
+                            gui=gui, address=uuid_definitions.HUB_TEST, journal=True)
 
     train = CompoundTrain("Massive train", train_front, train_rear)
 
-    controller = Controller(train)
+    controller = Controller(train, runtime=runtime)
 
     # --------------------------------------------------------------------------
 
     # connect everything and start main loop
     # controller.connect_handset()
-    gui.root.after(100, gui.after_callback)
-    gui.root.mainloop()
+    if isinstance(runtime, AsyncRuntime):
+        runtime.run_forever(gui)
+    else:
+        gui.root.after(100, gui.after_callback)
+        gui.root.mainloop()
+
+    close_journals()
+    dump_metrics()
+    dump_event_queues()
+    dump_transitions()
+    dump_motor_metrics()
+    reservations.dump()
+    wait_for.dump()
+    dwell_scheduler.dump()
+    operations.dump()
+    transit_times.dump()
+    dump_positions()
+    recoveries.dump()
+    with open(OPERATIONS_FILE, "w") as fp:
+        operations.dump_json(fp)
+    if tracer.enabled:
+        tracer.dump()
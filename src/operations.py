@@ -0,0 +1,231 @@
+'''
+Operational metrics: how well the layout runs.
+
+The event processor reports the transitions of each train as they happen:
+entering and leaving sectors, stopping at and departing from its station,
+and the time spent waiting for a sector or a crossing. From these, the
+metrics keep, per train:
+
+    laps per hour   from the time between station stops (one per lap)
+    waits           time spent waiting, per sector and crossing
+    dwell           time spent stopped at the station
+
+and, per sector, the fraction of the time it has been occupied by a train.
+
+Memory is constant per train: running totals only, keyed by sector and
+crossing name, so a layout bounds their number. Reports come from any
+control context, so bookkeeping is done under a lock.
+
+Dump the metrics at any time with operations.dump() (a table), or
+operations.dump_json(); operations.laps_per_hour(name) is shown live in
+the GUI.
+'''
+import json
+import sys
+import time
+from threading import Lock
+
+# shorter waits are not counted: the resource was free, or nearly so
+MINIMUM_WAIT = 0.05 # s
+
+
+class _Occupancy():
+    def __init__(self):
+        self.entries = 0
+        self.occupied = 0.
+
+
+class _TrainMetrics():
+    def __init__(self):
+        self.laps = 0
+        self.first_lap = None
+        self.last_lap = None
+
+        # sector the train is in, and the time it entered it
+        self.sector = None
+        self.since = None
+
+        # station stops
+        self.dwells = 0
+        self.dwell_time = 0.
+        self.stopped = None
+
+        # time spent waiting, keyed by sector or crossing name: [count, total]
+        self.waits = {}
+
+
+class OperationalMetrics():
+    '''
+    Running totals of train operations, per train and per sector.
+
+    :param clock: returns the current time, in seconds
+    '''
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = self.clock()
+            self.trains = {}
+            self.sectors = {}
+
+    def _train(self, name):
+        # called with the lock held
+        metrics = self.trains.get(name)
+        if metrics is None:
+            metrics = self.trains[name] = _TrainMetrics()
+        return metrics
+
+    def _leave(self, metrics, now):
+        # closes the train's occupancy of its current sector. Called with
+        # the lock held.
+        if metrics.sector is None:
+            return
+        occupancy = self.sectors.get(metrics.sector)
+        if occupancy is None:
+            occupancy = self.sectors[metrics.sector] = _Occupancy()
+        occupancy.entries += 1
+        occupancy.occupied += now - metrics.since
+        metrics.sector = None
+
+    def entered(self, name, sector):
+        '''
+        A train entered a sector.
+
+        :param name: train name
+        :param sector: the sector entered
+        '''
+        now = self.clock()
+        with self.lock:
+            metrics = self._train(name)
+            self._leave(metrics, now)
+            metrics.sector = sector.name
+            metrics.since = now
+
+    def left(self, name):
+        '''
+        A train left its sector, into an inter-sector zone.
+        '''
+        now = self.clock()
+        with self.lock:
+            self._leave(self._train(name), now)
+
+    def stopped(self, name, station):
+        '''
+        A train stopped at its station. Each stop completes a lap.
+
+        :param station: the station sector
+        '''
+        now = self.clock()
+        with self.lock:
+            metrics = self._train(name)
+            self._leave(metrics, now)
+            metrics.sector = station.name
+            metrics.since = now
+            metrics.stopped = now
+
+            if metrics.first_lap is None:
+                metrics.first_lap = now
+            else:
+                metrics.laps += 1
+            metrics.last_lap = now
+
+    def departed(self, name):
+        '''
+        A train departed from its station.
+        '''
+        now = self.clock()
+        with self.lock:
+            metrics = self._train(name)
+            if metrics.stopped is None:
+                return
+            metrics.dwells += 1
+            metrics.dwell_time += now - metrics.stopped
+            metrics.stopped = None
+
+    def waited(self, name, resource, wait_time):
+        '''
+        A train waited for a sector or a crossing.
+
+        :param resource: the sector or crossing
+        :param wait_time: time waited, in seconds
+        '''
+        if wait_time < MINIMUM_WAIT:
+            return
+        with self.lock:
+            waits = self._train(name).waits
+            entry = waits.get(resource.name)
+            if entry is None:
+                entry = waits[resource.name] = [0, 0.]
+            entry[0] += 1
+            entry[1] += wait_time
+
+    def laps_per_hour(self, name):
+        with self.lock:
+            return self._laps_per_hour(self.trains.get(name))
+
+    def _laps_per_hour(self, metrics):
+        if metrics is None or metrics.laps == 0:
+            return 0.
+        return metrics.laps * 3600. / (metrics.last_lap - metrics.first_lap)
+
+    def snapshot(self):
+        '''
+        :return: the metrics, as a dict of plain values
+        '''
+        now = self.clock()
+        with self.lock:
+            elapsed = now - self.started
+
+            # include the sectors trains are in right now
+            occupied = {name: occupancy.occupied for name, occupancy in self.sectors.items()}
+            for metrics in self.trains.values():
+                if metrics.sector is not None:
+                    occupied[metrics.sector] = (occupied.get(metrics.sector, 0.) +
+                                                now - metrics.since)
+
+            trains = {}
+            for name, metrics in self.trains.items():
+                trains[name] = {
+                    "laps": metrics.laps,
+                    "laps_per_hour": self._laps_per_hour(metrics),
+                    "dwells": metrics.dwells,
+                    "mean_dwell": metrics.dwell_time / metrics.dwells if metrics.dwells else 0.,
+                    "wait_time": sum(total for count, total in metrics.waits.values()),
+                    "waits": {resource: {"count": count, "time": total}
+                              for resource, (count, total) in metrics.waits.items()},
+                }
+            return {
+                "elapsed": elapsed,
+                "trains": trains,
+                "occupancy": {name: time_occupied / elapsed if elapsed > 0. else 0.
+                              for name, time_occupied in occupied.items()},
+            }
+
+    def dump_json(self, fp=sys.stdout):
+        json.dump(self.snapshot(), fp, indent=2, sort_keys=True)
+        fp.write("\n")
+        fp.flush()
+
+    def dump(self, fp=sys.stdout):
+        snapshot = self.snapshot()
+        fp.write("Operations over %.0f s\n" % snapshot["elapsed"])
+        fp.write("%-12s %6s %8s %7s %14s %13s\n" %
+                 ("train", "laps", "laps/h", "dwells", "mean dwell (s)", "wait time (s)"))
+        for name, metrics in sorted(snapshot["trains"].items()):
+            fp.write("%-12s %6i %8.1f %7i %14.2f %13.2f\n" %
+                     (name, metrics["laps"], metrics["laps_per_hour"], metrics["dwells"],
+                      metrics["mean_dwell"], metrics["wait_time"]))
+            for resource, wait in sorted(metrics["waits"].items()):
+                fp.write("    waited for %-12s %5i times, %8.2f s\n" %
+                         (resource, wait["count"], wait["time"]))
+        fp.write("Sector occupancy: %s\n" %
+                 "  ".join("%s %.0f%%" % (name, ratio * 100.)
+                           for name, ratio in sorted(snapshot["occupancy"].items())))
+        fp.flush()
+
+
+# metrics shared by all trains
+operations = OperationalMetrics()
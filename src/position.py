@@ -0,0 +1,157 @@
+'''
+Dead-reckoning train position, between signal tiles.
+
+The controller only knows where a train is when it crosses a signal tile.
+In between, the position is estimated by integrating a speed model over
+time: speed is taken as proportional to the motor power actually
+commanded (MotorHandler.power), which already corrects the power setting
+for battery voltage and number of cars. Distances are thus measured in
+power-seconds: the distance covered in one second at full power.
+
+Each estimator re-anchors at tile events reported by the event processor:
+sector entry, the sector signal (the end of a regular sector, or the
+FAST-SLOW transition of a structured one), sector exit, and station stops.
+The distance from sector entry to the sector signal is learned, per
+sector, as a moving average (see transit.py); since a stopped train covers
+no distance, stops at crossings don't skew it. Once MINIMUM_SAMPLES
+distances have been measured, the estimator reports the distance left to
+the sector signal, conservatively, from the shortest expected distance
+(mean - SIGMAS * deviation), and the time to get there at the current
+power.
+
+The event processor holds max speed until the train is SLOWDOWN_LEAD away
+from the sector signal at its current speed, instead of for a fixed time.
+'''
+import sys
+import time
+from threading import Lock
+
+from transit import ALPHA, MINIMUM_SAMPLES, SIGMAS, MovingEstimate
+
+
+class PositionEstimator():
+    '''
+    Dead-reckoning position of one train.
+
+    :param name: train name, used in reports
+    :param clock: returns the current time, in seconds
+    '''
+    def __init__(self, name, clock=time.monotonic):
+        self.name = name
+        self.clock = clock
+        self.lock = Lock()
+
+        # motor power, and the time it was set
+        self.power = 0.
+        self.since = clock()
+
+        # distance covered since the last anchor, in power-seconds
+        self.distance = 0.
+
+        # sector whose sector signal the train is heading for, if any
+        self.sector = None
+
+        # distance from sector entry to the sector signal, keyed by sector name
+        self.lengths = {}
+
+        estimators.append(self)
+
+    def _integrate(self):
+        # called with the lock held
+        now = self.clock()
+        self.distance += self.power * (now - self.since)
+        self.since = now
+
+    def set_power(self, power):
+        '''
+        :param power: motor power, as sent to the motor (-1 to 1)
+        '''
+        with self.lock:
+            self._integrate()
+            self.power = abs(power)
+
+    def entered(self, sector):
+        '''
+        The train crossed the signal that marks a sector's entry.
+        '''
+        with self.lock:
+            self._integrate()
+            self.distance = 0.
+            self.sector = sector.name
+
+    def passed_signal(self):
+        '''
+        The train crossed the sector signal of the sector it is in.
+        '''
+        with self.lock:
+            self._integrate()
+            if self.sector is not None:
+                estimate = self.lengths.get(self.sector)
+                if estimate is None:
+                    estimate = self.lengths[self.sector] = MovingEstimate()
+                estimate.add(self.distance, ALPHA)
+            self.distance = 0.
+            self.sector = None
+
+    def anchor(self):
+        '''
+        The train crossed any other signal (sector exit, station).
+        '''
+        with self.lock:
+            self._integrate()
+            self.distance = 0.
+            self.sector = None
+
+    def distance_to_signal(self):
+        '''
+        :return: distance left to the sector signal, in power-seconds; None
+            if the train isn't heading for one, or its distance isn't known
+            yet
+        '''
+        with self.lock:
+            return self._distance_to_signal()
+
+    def _distance_to_signal(self):
+        if self.sector is None:
+            return None
+        estimate = self.lengths.get(self.sector)
+        if estimate is None or estimate.count < MINIMUM_SAMPLES:
+            return None
+        self._integrate()
+        length = estimate.mean - SIGMAS * estimate.deviation
+        return max(length - self.distance, 0.)
+
+    def time_to_signal(self):
+        '''
+        :return: time to reach the sector signal at the current power, in
+            seconds; None if unknown, or if the train is stopped
+        '''
+        with self.lock:
+            distance = self._distance_to_signal()
+            if distance is None or self.power == 0.:
+                return None
+            return distance / self.power
+
+    def dump(self, fp=sys.stdout):
+        with self.lock:
+            for sector, estimate in sorted(self.lengths.items()):
+                fp.write("%-12s %-10s %7i %9.2f %9.2f\n" %
+                         (self.name, sector, estimate.count, estimate.mean,
+                          estimate.deviation))
+            fp.flush()
+
+
+# estimators of all trains created so far, for reporting
+estimators = []
+
+
+def dump_positions(fp=sys.stdout):
+    '''
+    Prints the distances learned from sector entry to the sector signal,
+    in power-seconds, for all trains.
+    '''
+    fp.write("Distance to sector signal (power-seconds)\n")
+    fp.write("%-12s %-10s %7s %9s %9s\n" % ("train", "sector", "count", "mean", "deviation"))
+    for estimator in estimators:
+        estimator.dump(fp)
+    fp.flush()
@@ -0,0 +1,132 @@
+'''
+Missed-signal recovery metrics.
+
+A train that misses a signal tile loses track of where it is: its next
+sector signal doesn't match the sector it believes it's in. The event
+processor resynchronizes it (EventProcessor.recover): the train's real
+sector is the nearest one ahead of the color seen (Layout.locate). If that
+sector is free, or already reserved for the train, the train claims it,
+gives up the sectors it skipped, and carries on in auto mode, as if it had
+just entered it. If another train holds it, the trains may be about to
+collide, and the dispatcher stops all of them.
+
+Before, every missed signal stalled the layout until someone reset it with
+the handset (long red button press), which takes minutes. These metrics
+count, per train, the automatic recoveries, the signals ignored as double
+detections, the sector signals not seen by the latest time expected (see
+transit.py), and the emergency stops, and, for the whole layout, the
+manual resets and the time trains spent stopped, from a reset or an
+emergency stop, until they were restarted.
+'''
+import sys
+import time
+from threading import Lock
+
+
+class _TrainRecoveries():
+    def __init__(self):
+        self.recovered = 0
+        self.skipped = 0
+        self.spurious = 0
+        self.late = 0
+        self.emergency_stops = 0
+
+
+class RecoveryMetrics():
+    '''
+    Counters of missed-signal recoveries, and manual resets.
+
+    :param clock: returns the current time, in seconds
+    '''
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.lock = Lock()
+        self.trains = {}
+
+        self.manual_resets = 0
+
+        # time trains were stopped at, until they are restarted; and the
+        # total time they spent stopped so far
+        self.stopped = None
+        self.downtime = 0.
+
+    def _train(self, name):
+        # called with the lock held
+        metrics = self.trains.get(name)
+        if metrics is None:
+            metrics = self.trains[name] = _TrainRecoveries()
+        return metrics
+
+    def recovered(self, name, skipped):
+        '''
+        A train was resynchronized automatically.
+
+        :param name: train name
+        :param skipped: number of sectors the train passed without seeing
+            their signals
+        '''
+        with self.lock:
+            metrics = self._train(name)
+            metrics.recovered += 1
+            metrics.skipped += skipped
+
+    def spurious(self, name):
+        '''
+        A train saw the signal of the sector it just entered again.
+        '''
+        with self.lock:
+            self._train(name).spurious += 1
+
+    def late(self, name):
+        '''
+        A train didn't see its sector signal by the latest time expected:
+        it probably missed it.
+        '''
+        with self.lock:
+            self._train(name).late += 1
+
+    def emergency_stop(self, name):
+        '''
+        A train couldn't be resynchronized safely: all trains are stopped.
+        '''
+        now = self.clock()
+        with self.lock:
+            self._train(name).emergency_stops += 1
+            if self.stopped is None:
+                self.stopped = now
+
+    def manual_reset(self):
+        '''
+        All trains were stopped from the handset.
+        '''
+        now = self.clock()
+        with self.lock:
+            self.manual_resets += 1
+            if self.stopped is None:
+                self.stopped = now
+
+    def restarted(self):
+        '''
+        Trains were restarted from the handset.
+        '''
+        now = self.clock()
+        with self.lock:
+            if self.stopped is not None:
+                self.downtime += now - self.stopped
+                self.stopped = None
+
+    def dump(self, fp=sys.stdout):
+        with self.lock:
+            fp.write("Missed-signal recovery\n")
+            fp.write("%-12s %9s %8s %8s %6s %10s\n" %
+                     ("train", "recovered", "skipped", "spurious", "late", "emergency"))
+            for name, metrics in sorted(self.trains.items()):
+                fp.write("%-12s %9i %8i %8i %6i %10i\n" %
+                         (name, metrics.recovered, metrics.skipped, metrics.spurious,
+                          metrics.late, metrics.emergency_stops))
+            fp.write("%i manual resets, %.1f s stopped\n" % (self.manual_resets, self.downtime))
+            fp.flush()
+
+
+# metrics shared by all trains
+recoveries = RecoveryMetrics()
@@ -0,0 +1,335 @@
+'''
+Accelerated replay of a train's sensor journal.
+
+A journal (see journal.py) holds every raw vision sensor sample a train
+got during a run. Replaying it feeds the samples, at their recorded times,
+back through the train's own classifier, SensorEventFilter and
+EventProcessor, on a virtual clock: there is no waiting, so an hour-long
+run from the field replays in seconds, and changes to the filter, the
+state machine, or the timers can be checked against it.
+
+ReplayRuntime is a control runtime (see runtime.py) that runs on virtual
+time. Timed calls and procedure sleeps go into a heap ordered by due time;
+advance(t) moves the clock forward, firing whatever is due on the way.
+Everything runs in the caller's thread, one step at a time, so waits are
+just re-checked after each step.
+
+ReplayTrain is a SmartTrain driven by a ReplayRuntime, with a stand-in hub
+that accepts, and ignores, motor and LED writes. It logs the events its
+event processor handles, with the transition taken, and the power
+settings it commands, both on the virtual clock.
+
+Limitations: the replay covers one train; other trains don't exist, so
+sectors and crossings are always free. Waits don't go into the wait-for
+graph. Metrics kept by modules with their own clock (sector reservations,
+dwell and operational metrics) mix virtual and wall clock times during a
+replay.
+
+Usage:
+
+    python replay.py <journal file> [run]
+'''
+import collections
+import heapq
+import itertools
+import sys
+import time
+import traceback
+
+from event import EventProcessor
+from journal import EVENT, SAMPLE, dump_journal, read_journal, runs
+from runtime import Wait
+from train import SmartTrain
+
+
+class ReplayRuntime():
+    '''
+    Runs control logic on a virtual clock. See runtime.py for the methods
+    shared with the other runtimes.
+
+    :param start: virtual time to start at, in seconds
+    '''
+    def __init__(self, start=0.):
+        self.now = start
+
+        # timed calls, as [due time, sequence number, callback] entries;
+        # cancelled entries have no callback.
+        self.timers = []
+        self.sequence = itertools.count()
+
+        # procedures run for each key; the first one is running, the
+        # others wait their turn.
+        self.chains = {}
+
+        # procedures blocked on a Wait
+        self.waiting = []
+
+    def clock(self):
+        return self.now
+
+    def schedule(self, delay, function, *args, **kwargs):
+        handle = _ReplayTimerHandle(self, function, args, kwargs)
+        handle.reschedule(delay)
+        return handle
+
+    def run(self, procedure, key=None, event=None):
+        task = _ReplayTask(procedure, key)
+        if key is None:
+            self._step(task)
+            return task
+
+        chain = self.chains.get(key)
+        if chain is None:
+            chain = self.chains[key] = collections.deque()
+        chain.append(task)
+        if len(chain) == 1:
+            self._step(task)
+        return task
+
+    def spawn(self, procedure):
+        task = _ReplayTask(procedure)
+        self._step(task)
+        return task
+
+    def dispatch(self, function, *args, **kwargs):
+        self._call(function, *args, **kwargs)
+
+    def fan_out(self, functions):
+        for function in functions:
+            self._call(function)
+
+    def notify(self):
+        self._check_waits()
+
+    def advance(self, until):
+        '''
+        Moves the virtual clock forward to until, firing the timed calls,
+        and running the procedure steps, due on the way.
+        '''
+        self._check_waits()
+        while self.timers and self.timers[0][0] <= until:
+            due, sequence, callback = heapq.heappop(self.timers)
+            if callback is not None:
+                self.now = max(self.now, due)
+                self._call(callback)
+        self.now = max(self.now, until)
+
+    def _at(self, delay, callback):
+        entry = [self.now + max(delay, 0.), next(self.sequence), callback]
+        heapq.heappush(self.timers, entry)
+        return entry
+
+    def _call(self, function, *args, **kwargs):
+        try:
+            function(*args, **kwargs)
+        except Exception:
+            print("ERROR: control callback failed:", function)
+            traceback.print_exc()
+        self._check_waits()
+
+    def _step(self, task, result=None):
+        while True:
+            if task.cancelled:
+                task.procedure.close()
+                self._finish(task)
+                return
+            try:
+                step = task.procedure.send(result)
+            except StopIteration:
+                self._finish(task)
+                return
+            except Exception:
+                print("ERROR: control procedure failed:", task.procedure)
+                traceback.print_exc()
+                self._finish(task)
+                return
+
+            result = None
+            if callable(step):
+                step = Wait(step)
+            if isinstance(step, Wait):
+                if step.condition():
+                    result = True
+                    continue
+                task.wait = step
+                task.deadline = None
+                if step.timeout is not None:
+                    task.deadline = self.now + step.timeout
+                    self._at(step.timeout, self._check_waits)
+                self.waiting.append(task)
+                return
+            if step > 0.:
+                self._at(step, lambda: self._step(task))
+                return
+
+    def _finish(self, task):
+        if task.key is None:
+            return
+        chain = self.chains[task.key]
+        chain.popleft()
+        if chain:
+            self._step(chain[0])
+        else:
+            del self.chains[task.key]
+
+    def _check_waits(self):
+        # a procedure resumed may change what the others wait for
+        resumed = True
+        while resumed:
+            resumed = False
+            for task in list(self.waiting):
+                if task.cancelled:
+                    result = None
+                elif task.wait.condition():
+                    result = True
+                elif task.deadline is not None and task.deadline <= self.now:
+                    result = False
+                else:
+                    continue
+                self.waiting.remove(task)
+                self._step(task, result)
+                resumed = True
+
+
+class _ReplayTask():
+    def __init__(self, procedure, key=None):
+        self.procedure = procedure
+        self.key = key
+        self.cancelled = False
+        self.wait = None
+        self.deadline = None
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class _ReplayTimerHandle():
+    def __init__(self, runtime, function, args, kwargs):
+        self.runtime = runtime
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.entry = None
+
+    def cancel(self):
+        if self.entry is not None:
+            self.entry[2] = None
+            self.entry = None
+
+    def reschedule(self, delay):
+        self.cancel()
+        self.entry = self.runtime._at(delay, self._fire)
+
+    def _fire(self):
+        self.entry = None
+        self.function(*self.args, **self.kwargs)
+
+
+class _ReplayDevice():
+    '''
+    Stands in for any hub peripheral: writes and subscriptions are ignored.
+    '''
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class _ReplayHub():
+    def __init__(self):
+        self.port_A = _ReplayDevice()
+        self.port_B = None
+        self.led = _ReplayDevice()
+        self.vision_sensor = _ReplayDevice()
+        self.voltage = _ReplayDevice()
+        self.current = _ReplayDevice()
+
+
+class _ReplayEventProcessor(EventProcessor):
+    # procedure (see runtime.py)
+    def _process_event(self, event):
+        handler = None
+        if self.train.auto and not self.train.signal_blind:
+            state, kind = self.table.state(self.train)
+            handler = self.table.table.get((state, kind, event))
+        self.train.events.append((self.clock(), event, handler))
+        yield from super()._process_event(event)
+
+
+class ReplayTrain(SmartTrain):
+    '''
+    A SmartTrain that runs on a ReplayRuntime, with no hub.
+
+    :param name: train name
+    :param runtime: a ReplayRuntime
+    :param kwargs: SmartTrain parameters (direction, lookahead, ncars)
+
+    Besides the SmartTrain attributes, it keeps:
+
+        events      events handled, as (time, color, handler) tuples;
+                    handler is the EventProcessor method the event was
+                    dispatched to, or None if it was ignored
+        powers      power settings commanded, as (time, power index)
+        recorded    events confirmed in the recorded run, as (time, color)
+    '''
+    def __init__(self, name, runtime, **kwargs):
+        self.events = []
+        self.powers = []
+        self.recorded = []
+
+        super(ReplayTrain, self).__init__(name, runtime=runtime, hub=_ReplayHub(), **kwargs)
+
+        self.event_processor = _ReplayEventProcessor(self, clock=runtime.clock)
+        self.auto = True
+
+    def set_power(self, power_index, force_led_blink=False):
+        super(ReplayTrain, self).set_power(power_index, force_led_blink=force_led_blink)
+        self.powers.append((self.runtime.clock(), power_index))
+
+
+def replay(path, run=-1, name="Replay", **kwargs):
+    '''
+    Replays one run of a journal file.
+
+    :param path: journal file name
+    :param run: index of the run in the file; the last one by default
+    :param name: name of the train replayed
+    :param kwargs: SmartTrain parameters (direction, lookahead, ncars)
+    :return: the ReplayTrain, once all samples were fed
+    '''
+    records = runs(read_journal(path))[run]
+    runtime = ReplayRuntime()
+    train = ReplayTrain(name, runtime, **kwargs)
+
+    start = records[0][0] if records else 0.
+    for timestamp, r, g, b, color, kind in records:
+        runtime.advance(timestamp - start)
+        if kind == SAMPLE:
+            train._vision_sensor_callback(r, g, b)
+        elif kind == EVENT:
+            train.recorded.append((runtime.now, color))
+    return train
+
+
+def dump_replay(train, fp=sys.stdout):
+    '''
+    Prints the events handled in a replay, and the power settings
+    commanded, in time order.
+    '''
+    fp.write("Replay of %s\n" % train.name)
+    lines = [(t, "event %-8s %s" % (color, handler)) for t, color, handler in train.events]
+    lines += [(t, "power %i" % power_index) for t, power_index in train.powers]
+    for t, line in sorted(lines, key=lambda line: line[0]):
+        fp.write("%9.3f  %s\n" % (t, line))
+    fp.write("%i events replayed, %i recorded\n" % (len(train.events), len(train.recorded)))
+    fp.flush()
+
+
+if __name__ == '__main__':
+    path = sys.argv[1]
+    run = int(sys.argv[2]) if len(sys.argv) > 2 else -1
+    dump_journal(path)
+
+    started = time.perf_counter()
+    train = replay(path, run)
+    elapsed = time.perf_counter() - started
+    dump_replay(train)
+    print("replayed %.1f s in %.1f s" % (train.runtime.now, elapsed))
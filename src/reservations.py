@@ -0,0 +1,446 @@
+'''
+Reservation manager: wakes up trains waiting for a sector or crossing.
+
+A train that stops at a sector boundary or at a crossing waits until the
+sector ahead is freed (Sector.occupier) or the crossing opens
+(XTrack.is_free). Instead of polling, waiting threads block on one shared
+condition variable, and every change to sector occupancy or crossing
+bookings notifies it:
+
+    reservations.wait(lambda: sector.occupier is None, timeout=10.)
+
+Waits can time out, and are cancelled all at once by cancel_all (when the
+handset resets the layout, for instance): waiting trains then get
+WaitCancelled. The runtimes (see runtime.py) use this for the wait
+conditions yielded by procedures.
+
+The manager also measures restart latency: the time from the release that
+satisfied a wait to the moment the waiting train notices it. Dump it with
+reservations.dump().
+
+Sector occupancy itself is kept in the reservation table (reservation_table
+below). Each sector has its own entry, with its own lock, so trains working
+on different sectors don't contend:
+
+    if reservation_table.try_acquire([next_sector], train.name):
+        ...                                 # next_sector is ours
+    reservation_table.release([sector], train.name)
+
+try_acquire covers one or more sectors, atomically: all of them are
+acquired, or none. Entries carry a version counter, bumped before and after
+every change, so readers get consistent snapshots of several sectors
+without taking any lock (reservation_table.snapshot()).
+
+Trains that wait for a sector or crossing held by another train are tracked
+in a wait-for graph (wait_for below). A train waits for one resource at a
+time, so finding out whether a new wait closes a cycle only takes a walk
+along the chain of owners. Deadlocks are detected as they happen, and
+handed to a resolution policy.
+'''
+import itertools
+import sys
+import time
+from threading import Condition, Lock, RLock
+
+from tracing import Histogram
+
+# waiters re-check their conditions at least this often, even without
+# notifications: a condition may depend on state the manager doesn't see.
+WAKEUP_TIMEOUT = 0.5  # seconds
+
+
+class WaitCancelled(Exception):
+    '''
+    Raised in a waiting train when its wait is cancelled.
+    '''
+    pass
+
+
+class WaitForGraph():
+    '''
+    Wait-for graph of trains waiting on sectors and crossings.
+
+    Resources (sectors, crossings) must provide an `occupier` attribute
+    with the name of the train holding them. Each waiting train points at
+    the resource it waits for; that resource points at its occupier. A
+    cycle is detected as soon as the wait that closes it is added.
+
+    Deadlocks are resolved at the lowest cost: trains can register a cost
+    (how many sectors they would give up) and a release callable (give up
+    sectors reserved ahead, that they don't need to move on). The cheapest
+    train in the cycle that can release something does so. If that doesn't
+    break the cycle, or no train can release anything, emergency_stop is
+    called.
+
+    Near-deadlocks, waits on a train that is itself waiting, are counted
+    so that layouts can be tuned.
+    '''
+    def __init__(self):
+        self.lock = RLock()
+
+        # resource each train waits for, keyed by train name
+        self.waiting = {}
+
+        # resolution policy, keyed by train name: (cost, release)
+        self.policies = {}
+
+        # called, with the cycle, when a deadlock can't be resolved
+        self.emergency_stop = None
+
+        self.waits = 0
+        self.near_deadlocks = 0
+        self.longest_chain = 0
+        self.deadlocks = 0
+        self.resolved = 0
+        self.emergency_stops = 0
+
+    def register(self, name, cost, release):
+        '''
+        :param name: train name
+        :param cost: callable; number of sectors the train would give up
+        :param release: callable; gives up sectors reserved ahead
+        '''
+        with self.lock:
+            self.policies[name] = (cost, release)
+
+    def add(self, name, resource):
+        '''
+        Records that a train waits for a resource, and resolves the
+        deadlock if this wait closes a cycle.
+        '''
+        with self.lock:
+            self.waiting[name] = resource
+            self.waits += 1
+            cycle, length = self._chain(name)
+            if length > 1:
+                self.near_deadlocks += 1
+            self.longest_chain = max(self.longest_chain, length)
+            if cycle is None:
+                return
+            self.deadlocks += 1
+
+        # resolved outside the lock: releases wake up other waiting trains
+        self._resolve(name, cycle)
+
+    def remove(self, name):
+        with self.lock:
+            self.waiting.pop(name, None)
+
+    def _chain(self, name):
+        # follows owners from the given train. Returns the cycle (list of
+        # (train, resource) pairs), if it gets back to the train, and the
+        # length of the chain.
+        chain = []
+        waiter = name
+        while True:
+            resource = self.waiting.get(waiter)
+            if resource is None:
+                return None, len(chain)
+            owner = resource.occupier
+            chain.append((waiter, resource))
+            if owner is None or owner == waiter:
+                return None, len(chain)
+            if owner == name:
+                return chain, len(chain)
+            if len(chain) > len(self.waiting):
+                # a cycle that doesn't involve this train
+                return None, len(chain)
+            waiter = owner
+
+    def _resolve(self, name, cycle):
+        candidates = []
+        for waiter, resource in cycle:
+            owner = resource.occupier
+            if owner in self.policies:
+                cost, release = self.policies[owner]
+                candidates.append((cost(), owner, release))
+
+        for cost, owner, release in sorted(candidates, key=lambda c: c[0]):
+            if cost > 0:
+                print("Deadlock: %s gives up its path" % owner)
+                release()
+                break
+
+        with self.lock:
+            cycle, length = self._chain(name)
+            if cycle is None:
+                self.resolved += 1
+                return
+            self.emergency_stops += 1
+
+        print("ERROR: deadlock between", ", ".join(waiter for waiter, resource in cycle))
+        if self.emergency_stop is not None:
+            self.emergency_stop(cycle)
+
+    def dump(self, fp=sys.stdout):
+        with self.lock:
+            fp.write("Wait-for graph: %i waits, %i near-deadlocks (longest chain %i), "
+                     "%i deadlocks, %i resolved, %i emergency stops\n" %
+                     (self.waits, self.near_deadlocks, self.longest_chain, self.deadlocks,
+                      self.resolved, self.emergency_stops))
+            fp.flush()
+
+
+# wait-for graph of all trains
+wait_for = WaitForGraph()
+
+
+class ReservationManager():
+    '''
+    Shared condition variable for waits on sector occupancy and crossing
+    bookings, with wait statistics.
+
+    :param wakeup_timeout: longest time between re-checks of a wait
+        condition, in seconds
+    :param graph: wait-for graph that blocked waits of trains go into
+    '''
+    def __init__(self, wakeup_timeout=WAKEUP_TIMEOUT, graph=wait_for):
+        self.wakeup_timeout = wakeup_timeout
+        self.graph = graph
+        self.condition = Condition()
+
+        # bumped by cancel_all; waits started before that are cancelled
+        self.generation = 0
+
+        # time of the most recent change
+        self.changed_at = time.perf_counter()
+
+        # restart latency, in milliseconds, for waits that had to block
+        self.latency = Histogram()
+        self.waits = 0
+        self.timeouts = 0
+        self.cancelled = 0
+
+    def notify(self):
+        '''
+        Tells waiting trains that occupancy or bookings changed. Must be
+        called after the change, and not with any track lock held.
+        '''
+        with self.condition:
+            self.changed_at = time.perf_counter()
+            self.condition.notify_all()
+
+    def wake(self):
+        '''
+        Wakes up waiting trains so they check for cancellation, without
+        counting as a change.
+        '''
+        with self.condition:
+            self.condition.notify_all()
+
+    def cancel_all(self):
+        '''
+        Cancels every wait under way. Waits started afterwards are not
+        affected.
+        '''
+        with self.condition:
+            self.generation += 1
+            self.condition.notify_all()
+
+    def wait(self, predicate, timeout=None, is_cancelled=None, waiter=None, resource=None):
+        '''
+        Blocks until predicate() holds.
+
+        :param predicate: the wait condition; called with the manager's
+            lock held, so it must not block
+        :param timeout: longest time to wait, in seconds; None waits
+            indefinitely
+        :param is_cancelled: optional callable; the wait is cancelled when
+            it returns True. Call wake after setting it.
+        :param waiter: name of the waiting train, if it waits for a
+            resource held by another train
+        :param resource: the sector or crossing waited for
+        :return: True if the condition holds, False on timeout
+        :raises WaitCancelled: if the wait was cancelled
+        '''
+        with self.condition:
+            generation = self.generation
+        deadline = None if timeout is None else time.monotonic() + timeout
+        blocked = False
+        try:
+            while True:
+                with self.condition:
+                    if self.generation != generation or (is_cancelled is not None and is_cancelled()):
+                        self.cancelled += 1
+                        raise WaitCancelled()
+                    if predicate():
+                        self.record(blocked)
+                        return True
+
+                    interval = self.wakeup_timeout
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0.:
+                            self.timeouts += 1
+                            return False
+                        interval = min(interval, remaining)
+
+                    joins_graph = not blocked and waiter is not None
+                    blocked = True
+                    if not joins_graph:
+                        self.condition.wait(interval)
+                        continue
+
+                # the wait goes into the wait-for graph with the condition
+                # released: resolving a deadlock releases sectors, or stops
+                # all trains, and both wake up waits from other threads.
+                # The condition is checked again right after.
+                self.graph.add(waiter, resource)
+        finally:
+            if blocked and waiter is not None:
+                self.graph.remove(waiter)
+
+    def record(self, blocked):
+        '''
+        Counts a wait whose condition now holds. Waits that had to block
+        add their restart latency, since the last change.
+        '''
+        with self.condition:
+            self.waits += 1
+            if blocked:
+                self.latency.add((time.perf_counter() - self.changed_at) * 1000.)
+
+    def dump(self, fp=sys.stdout):
+        '''
+        Prints wait counts and the restart latency, in milliseconds.
+        '''
+        with self.condition:
+            latency = self.latency
+            fp.write("Reservation waits: %i satisfied (%i blocked), %i timed out, %i cancelled\n" %
+                     (self.waits, latency.count, self.timeouts, self.cancelled))
+            fp.write("  restart latency (ms): mean %.2f  p50 %.2f  p90 %.2f  max %.2f\n" %
+                     (latency.mean, latency.quantile(0.5), latency.quantile(0.9), latency.maximum))
+            fp.flush()
+
+
+# manager shared by all sectors and crossings
+reservations = ReservationManager()
+
+
+class _Entry():
+    def __init__(self, index):
+        # entries are locked in index order, so multi-sector acquisitions
+        # can't deadlock
+        self.index = index
+        self.lock = Lock()
+        self.occupier = None
+
+        # odd while a change is under way
+        self.version = 0
+
+        # time of the last change
+        self.since = time.monotonic()
+
+    def write(self, occupier):
+        # called with the entry lock held
+        self.version += 1
+        self.occupier = occupier
+        self.since = time.monotonic()
+        self.version += 1
+
+
+class ReservationTable():
+    '''
+    Occupancy of track sectors, with atomic acquisition of one or more
+    sectors. Sectors register themselves when created.
+
+    :param manager: the reservation manager to notify when sectors are
+        released
+    '''
+    def __init__(self, manager=reservations):
+        self.manager = manager
+        self.entries = {}
+        self.sequence = itertools.count()
+        self.lock = Lock()
+
+    def register(self, sector):
+        with self.lock:
+            if sector not in self.entries:
+                self.entries[sector] = _Entry(next(self.sequence))
+
+    def occupier(self, sector):
+        return self.entries[sector].occupier
+
+    def held_for(self, sector):
+        '''
+        :return: time since the sector's occupier last changed, in seconds
+        '''
+        return time.monotonic() - self.entries[sector].since
+
+    def try_acquire(self, sectors, name):
+        '''
+        Reserves all the given sectors for a train, if each of them is
+        free or already reserved for that train.
+
+        :return: True if the sectors were acquired; False if any of them is
+            reserved for another train, in which case none is changed
+        '''
+        entries = self._locked(sectors)
+        try:
+            if any(entry.occupier not in (None, name) for entry in entries):
+                return False
+            for entry in entries:
+                if entry.occupier != name:
+                    entry.write(name)
+            return True
+        finally:
+            for entry in entries:
+                entry.lock.release()
+
+    def release(self, sectors, name=None):
+        '''
+        Releases the given sectors. With a train name, only sectors
+        reserved for that train are released.
+        '''
+        entries = self._locked(sectors)
+        try:
+            for entry in entries:
+                if entry.occupier is not None and (name is None or entry.occupier == name):
+                    entry.write(None)
+        finally:
+            for entry in entries:
+                entry.lock.release()
+        self.manager.notify()
+
+    def set(self, sector, name):
+        '''
+        Sets a sector's occupier, unconditionally.
+        '''
+        entry = self.entries[sector]
+        with entry.lock:
+            entry.write(name)
+        if name is None:
+            self.manager.notify()
+
+    def snapshot(self, sectors=None):
+        '''
+        Consistent view of the occupancy of the given sectors (all of them
+        by default), taken without locking.
+
+        :return: dict of occupiers, keyed by sector
+        '''
+        if sectors is None:
+            with self.lock:
+                sectors = list(self.entries)
+        entries = [self.entries[sector] for sector in sectors]
+        while True:
+            versions = [entry.version for entry in entries]
+            if any(version % 2 for version in versions):
+                time.sleep(0)
+                continue
+            occupiers = [entry.occupier for entry in entries]
+            if versions == [entry.version for entry in entries]:
+                return dict(zip(sectors, occupiers))
+
+    def _locked(self, sectors):
+        # locks the entries of the given sectors, in index order
+        entries = {self.entries[sector].index: self.entries[sector] for sector in sectors}
+        entries = [entries[index] for index in sorted(entries)]
+        for entry in entries:
+            entry.lock.acquire()
+        return entries
+
+
+# occupancy of all sectors
+reservation_table = ReservationTable()
+
@@ -0,0 +1,200 @@
+'''
+Control runtimes.
+
+Train control logic that takes time to play out (acceleration ramps, the
+wait at a station exit for the sector ahead to be freed, stopping at a
+booked crossing) is written once, as procedures: generators that yield
+what they have to wait for.
+
+    yield 0.5                       # wait 0.5 s
+    yield lambda: sector.occupier is None
+                                    # wait until the condition holds
+    free = yield Wait(lambda: xtrack.is_free(train), timeout=10.)
+                                    # same, for at most 10 s; free is False
+                                    # if it timed out
+    yield Wait(lambda: xtrack.is_free(train), waiter=train.name, resource=xtrack)
+                                    # the wait goes into the wait-for graph,
+                                    # for deadlock detection
+
+Waiting procedures are woken up as soon as a sector or crossing is
+released (see reservations.py). reservations.cancel_all() cancels every
+wait under way: the procedures waiting are closed.
+
+A runtime drives procedures, schedules timed calls, and hands over
+callbacks that come from BLE threads. Two runtimes are provided:
+
+- ThreadedRuntime (this module) is the original threaded control mode.
+  Procedures run in a thread, sleeping, and blocking on the reservation
+  manager's condition variable, as needed: keyed procedures (a train's
+  event handling) in the worker thread of the key's event queue (see
+  event_queue.py), others in the calling thread;
+  ramps get a thread of their own; timed calls go to the central timer
+  scheduler (timers.timers); callbacks run straight in the BLE thread.
+
+- aio.AsyncRuntime runs all of the control logic as coroutines on one
+  asyncio event loop.
+
+Both runtimes provide:
+
+    schedule(delay, function, *args) -> handle
+        handle.cancel(), handle.reschedule(delay)
+    run(procedure, key=None, event=None)
+        drives a procedure. Procedures run with the same key run one at a
+        time, in order. Procedures that handle a sensor event name it
+        (event): a runtime may drop them when it falls behind. Others are
+        always run.
+    spawn(procedure) -> handle
+        drives a procedure concurrently with the caller. handle.cancel()
+        stops it before its next step.
+    dispatch(function, *args)
+        calls function from the runtime's control context. Used by
+        callbacks that come from BLE threads.
+    fan_out(functions)
+        calls each function (no arguments) concurrently, and returns when
+        all are done. Used to reach every train at once.
+    notify()
+        tells waiting procedures that shared state (sector occupancy,
+        crossing bookings) changed, so they check their conditions now.
+    clock() -> seconds
+        the runtime's monotonic time, which delays and timeouts count in.
+        Control logic that measures durations should read it, so it
+        measures them in virtual time under replay (see replay.py).
+'''
+import time
+import traceback
+from threading import Lock, Thread
+
+from event_queue import EventQueue
+from reservations import WaitCancelled, reservations
+from timers import timers
+
+
+class Wait():
+    '''
+    Procedure step: wait until condition() holds, or until timeout seconds
+    pass. The procedure is sent True if the condition holds, False if the
+    wait timed out. A callable yielded by itself waits with no timeout.
+
+    A train waiting for a sector or crossing held by another train should
+    name itself (waiter) and the resource, so the wait goes into the
+    wait-for graph (reservations.wait_for) while it blocks.
+    '''
+    def __init__(self, condition, timeout=None, waiter=None, resource=None):
+        self.condition = condition
+        self.timeout = timeout
+        self.waiter = waiter
+        self.resource = resource
+
+
+class ThreadedRuntime():
+    '''
+    The threaded control mode.
+
+    :param manager: the reservation manager waits block on
+    '''
+    def __init__(self, manager=reservations):
+        self.manager = manager
+
+        # event queue for each key
+        self.queues = {}
+        self.queues_lock = Lock()
+
+    def schedule(self, delay, function, *args, **kwargs):
+        return timers.schedule(delay, function, *args, **kwargs)
+
+    def run(self, procedure, key=None, event=None):
+        if key is None:
+            _drive(procedure, self.manager)
+            return
+
+        # keyed procedures are handed to the key's event queue, so the
+        # calling thread (BLE notification, timer worker) never waits on
+        # them. Its worker runs them one at a time, in order. Sensor events
+        # are tagged with their color, for the queue to coalesce, or drop.
+        self.queue(key).submit(procedure, tag=event)
+
+    def queue(self, key):
+        with self.queues_lock:
+            event_queue = self.queues.get(key)
+            if event_queue is None:
+                event_queue = self.queues[key] = EventQueue(
+                    getattr(key, "name", str(key)),
+                    lambda procedure: _drive(procedure, self.manager),
+                    on_drop=lambda procedure: procedure.close())
+            return event_queue
+
+    def spawn(self, procedure):
+        handle = _ThreadHandle(self.manager)
+        handle.thread = Thread(target=_drive, args=(procedure, self.manager, handle), daemon=True)
+        handle.thread.start()
+        return handle
+
+    def dispatch(self, function, *args, **kwargs):
+        function(*args, **kwargs)
+
+    def fan_out(self, functions):
+        # one thread per function, but the first one, which runs in the
+        # calling thread
+        functions = list(functions)
+        threads = [Thread(target=_call, args=(function,), daemon=True) for function in functions[1:]]
+        for thread in threads:
+            thread.start()
+        if functions:
+            _call(functions[0])
+        for thread in threads:
+            thread.join()
+
+    def notify(self):
+        self.manager.notify()
+
+    def clock(self):
+        return time.monotonic()
+
+
+class _ThreadHandle():
+    def __init__(self, manager):
+        self.manager = manager
+        self.thread = None
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+        self.manager.wake()
+
+
+def _call(function):
+    try:
+        function()
+    except Exception:
+        print("ERROR: control callback failed:", function)
+        traceback.print_exc()
+
+
+def _drive(procedure, manager, handle=None):
+    is_cancelled = (lambda: handle.cancelled) if handle is not None else None
+    result = None
+    while True:
+        if handle is not None and handle.cancelled:
+            procedure.close()
+            return
+        try:
+            step = procedure.send(result)
+        except StopIteration:
+            return
+
+        result = None
+        if callable(step):
+            step = Wait(step)
+        if isinstance(step, Wait):
+            try:
+                result = manager.wait(step.condition, step.timeout, is_cancelled,
+                                      step.waiter, step.resource)
+            except WaitCancelled:
+                procedure.close()
+                return
+        elif step > 0.:
+            time.sleep(step)
+
+
+# runtime used unless a train is given another one
+threaded = ThreadedRuntime()
@@ -15,6 +15,15 @@ INTER_SECTOR = "inter-sector"
 RGB_MINIMUM = 10.0
 V_MINIMUM = 100.
 
+# colors are matched against the HUE/SATURATION tables in this order;
+# the first match wins.
+SIGNAL_COLORS = [PURPLE, BLUE, GREEN, RED, YELLOW]
+
+# RED hue flips back to zero when crossing 1. Hues at or below this value
+# get 1. added to them, so the RED range can be expressed as a single
+# interval that straddles 1.
+HUE_WRAP = 0.05
+
 HUE = {}
 SATURATION = {}
 
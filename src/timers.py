@@ -0,0 +1,200 @@
+'''
+Central timer scheduler.
+
+Sector timers, speedup timers, signal blinding, station waits and the like
+used to be threading.Timer objects, each one an OS thread of its own. They
+are now entries in a single heap-ordered scheduler, run by one thread:
+
+    handle = timers.schedule(2.5, train.mark_exit_valid)
+    handle.reschedule(3.)    # push it back
+    handle.cancel()          # drop it; it won't run once cancel returns
+
+Scheduling and rescheduling take O(log n). Cancelling takes O(1): cancelled
+entries are left in the heap and skipped when they come up, and the heap is
+compacted when they start to dominate it.
+
+Callbacks run on the scheduler thread, and must return quickly: work that
+may block (waiting for a sector to be freed, for instance) is handed to the
+train's event queue (see event_queue.py). The thread count doesn't grow
+with the number of trains or timers.
+'''
+import heapq
+import itertools
+import time
+import traceback
+from threading import Condition, Thread
+
+
+class TimerHandle():
+    '''
+    A scheduled call. Returned by TimerScheduler.schedule; supports cancel,
+    as threading.Timer does, and reschedule.
+    '''
+    def __init__(self, scheduler, function, args, kwargs):
+        self.scheduler = scheduler
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+
+        # heap entries carry the version they were pushed with. Cancelling
+        # or rescheduling bumps the version, which invalidates them.
+        self.version = 0
+        self.due = None
+        self.active = False
+
+    def cancel(self):
+        self.scheduler.cancel(self)
+
+    def reschedule(self, delay):
+        self.scheduler.reschedule(self, delay)
+
+
+class TimerScheduler():
+    '''
+    Runs scheduled calls from one thread, in order of due time.
+
+    :param clock: returns the current time, in seconds
+    '''
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.heap = []
+        self.sequence = itertools.count()
+        self.condition = Condition()
+
+        # number of heap entries invalidated by cancel or reschedule
+        self.stale = 0
+
+        # the thread is started on first use
+        self.thread = None
+        self.stopped = False
+
+    def schedule(self, delay, function, *args, **kwargs):
+        '''
+        Schedules function(*args, **kwargs) to run after delay seconds.
+
+        :return: a TimerHandle
+        '''
+        handle = TimerHandle(self, function, args, kwargs)
+        self.reschedule(handle, delay)
+        return handle
+
+    def reschedule(self, handle, delay):
+        '''
+        Sets a new due time for a scheduled call, or schedules it again if
+        it was cancelled or has already run.
+        '''
+        with self.condition:
+            if handle.active:
+                self.stale += 1
+            handle.version += 1
+            handle.due = self.clock() + delay
+            handle.active = True
+            heapq.heappush(self.heap, (handle.due, next(self.sequence), handle, handle.version))
+
+            if self.thread is None and not self.stopped:
+                self.thread = Thread(target=self._run, name="TimerScheduler", daemon=True)
+                self.thread.start()
+            if self.heap[0][2] is handle:
+                self.condition.notify()
+
+    def cancel(self, handle):
+        '''
+        Cancels a scheduled call. Does nothing if it already ran, or was
+        cancelled. A callback already running is not interrupted.
+        '''
+        with self.condition:
+            if handle.active:
+                handle.active = False
+                self.stale += 1
+            # a call already collected as due, but not yet started, is
+            # skipped too (see _run)
+            handle.version += 1
+
+    def wake(self):
+        '''
+        Makes the scheduler thread check for due calls now. Needed only
+        when the clock moves other than with time (a test clock).
+        '''
+        with self.condition:
+            self.condition.notify()
+
+    def shutdown(self):
+        '''
+        Stops the scheduler thread, once the callback it's running, if any,
+        returns. Calls still scheduled don't run.
+        '''
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+            thread = self.thread
+        if thread is not None:
+            thread.join()
+
+    @property
+    def pending(self):
+        with self.condition:
+            return len(self.heap) - self.stale
+
+    def _compact(self):
+        self.heap = [entry for entry in self.heap if entry[3] == entry[2].version]
+        heapq.heapify(self.heap)
+        self.stale = 0
+
+    def _next_due(self):
+        # returns the handles that are due, with their versions, waiting
+        # until there is at least one; None once the scheduler is shut down
+        with self.condition:
+            while not self.stopped:
+                while self.heap and self.heap[0][3] != self.heap[0][2].version:
+                    heapq.heappop(self.heap)
+                    self.stale -= 1
+                if self.stale > len(self.heap) // 2:
+                    self._compact()
+
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+
+                now = self.clock()
+                if self.heap[0][0] > now:
+                    self.condition.wait(self.heap[0][0] - now)
+                    continue
+
+                due = []
+                while self.heap and self.heap[0][0] <= now:
+                    entry = heapq.heappop(self.heap)
+                    handle = entry[2]
+                    if entry[3] != handle.version:
+                        self.stale -= 1
+                        continue
+                    handle.active = False
+                    due.append((handle, entry[3]))
+                if due:
+                    return due
+            return None
+
+    def _run(self):
+        while True:
+            due = self._next_due()
+            if due is None:
+                return
+            for handle, version in due:
+                # an earlier callback may have cancelled or rescheduled
+                # this one since it was collected. Once the version is
+                # checked, the call counts as running.
+                with self.condition:
+                    if handle.version != version:
+                        continue
+                _call(handle)
+
+
+def _call(handle):
+    try:
+        handle.function(*handle.args, **handle.kwargs)
+    except Exception:
+        print("ERROR: timer callback failed:", handle.function)
+        traceback.print_exc()
+
+
+# scheduler shared by all trains
+timers = TimerScheduler()
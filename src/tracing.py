@@ -0,0 +1,185 @@
+'''
+Opt-in latency tracing, from vision sensor notification to motor command.
+
+Each signal event is stamped at a series of stages as it travels through
+the code, possibly across threads:
+
+    SENSOR      BLE notification reaches SmartTrain._vision_sensor_callback
+    FILTER      SensorEventFilter.filter_event confirms the color
+    PROCESS     EventProcessor.process_event starts handling it
+    ACCELERATE  the Train.accelerate thread starts the power ramp
+    MOTOR       MotorHandler.set_motor_power has sent the first new power
+                setting and released the lock
+
+Traces are keyed by train. The latency between each stage and the previous
+stage stamped for the same event goes into a per-stage histogram; the
+latency from SENSOR to MOTOR goes into an end-to-end histogram. Stages can
+be skipped (an event that stops the train sets power straight from
+process_event), and events that never reach the motor are simply dropped
+when the next event starts.
+
+Tracing is disabled by default. Every stamping point checks the `enabled`
+attribute first, so the cost of disabled tracing is one attribute lookup
+per stage. Enable with tracer.enable(), and dump the histograms at any
+time with tracer.dump().
+'''
+import bisect
+import sys
+import time
+from threading import Lock
+
+# stages, in the order an event goes through them
+SENSOR = "sensor"
+FILTER = "filter"
+PROCESS = "process"
+ACCELERATE = "accelerate"
+MOTOR = "motor"
+STAGES = [SENSOR, FILTER, PROCESS, ACCELERATE, MOTOR]
+
+# end-to-end, SENSOR to MOTOR
+TOTAL = "total"
+
+# histogram bin upper edges, in milliseconds. The last bin is open-ended.
+BINS = [0.1, 0.2, 0.5, 1., 2., 5., 10., 20., 50., 100., 200., 500., 1000., 2000.]
+
+# traces that didn't reach the motor within this time are discarded
+TRACE_TIMEOUT = 5.  # seconds
+
+
+class Histogram():
+    '''
+    Fixed-bin latency histogram, with running count, sum, and maximum.
+
+    :param bins: bin upper edges, in milliseconds
+    '''
+    def __init__(self, bins=BINS):
+        self.bins = list(bins)
+        self.counts = [0] * (len(self.bins) + 1)
+        self.count = 0
+        self.total = 0.
+        self.maximum = 0.
+
+    def add(self, latency):
+        '''
+        :param latency: latency in milliseconds
+        '''
+        self.counts[bisect.bisect_left(self.bins, latency)] += 1
+        self.count += 1
+        self.total += latency
+        self.maximum = max(self.maximum, latency)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+    def quantile(self, q):
+        '''
+        Upper edge of the bin holding quantile q. Samples past the last
+        edge report the maximum.
+        '''
+        if self.count == 0:
+            return 0.
+        target = q * self.count
+        accumulated = 0
+        for edge, count in zip(self.bins, self.counts):
+            accumulated += count
+            if accumulated >= target:
+                return edge
+        return self.maximum
+
+
+class Tracer():
+    '''
+    Stamps events at each stage and aggregates stage latencies.
+
+    Stamping calls may come from the BLE notification thread, timer
+    threads, and acceleration threads, so bookkeeping is done under a lock.
+    Callers should check `enabled` before calling any of the stamping
+    methods, to keep the disabled cost down.
+
+    :param enabled: start with tracing enabled
+    :param bins: histogram bin upper edges, in milliseconds
+    '''
+    def __init__(self, enabled=False, bins=BINS):
+        self.enabled = enabled
+        self.bins = bins
+        self.lock = Lock()
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {stage: Histogram(self.bins) for stage in STAGES[1:] + [TOTAL]}
+
+            # time of the most recent sensor notification, keyed by train
+            self.samples = {}
+
+            # events in flight, keyed by train: [start time, last stamp time]
+            self.traces = {}
+
+    def sample(self, key):
+        '''
+        Stamps a sensor notification. Called for every sample, so it only
+        stores the time; a trace starts when the sample is confirmed.
+        '''
+        self.samples[key] = time.perf_counter()
+
+    def start(self, key, stage=FILTER):
+        '''
+        Starts tracing an event, from the time of the latest sensor sample.
+        Any event still in flight for the same train is dropped.
+        '''
+        now = time.perf_counter()
+        with self.lock:
+            start = self.samples.get(key, now)
+            self.traces[key] = [start, now]
+            self.histograms[stage].add((now - start) * 1000.)
+
+    def stamp(self, key, stage):
+        '''
+        Stamps an event in flight at the given stage. Stamping MOTOR ends
+        the trace. Does nothing when no event is in flight for the train.
+        '''
+        now = time.perf_counter()
+        with self.lock:
+            trace = self.traces.get(key)
+            if trace is None:
+                return
+            start, last = trace
+            if now - start > TRACE_TIMEOUT:
+                del self.traces[key]
+                return
+
+            self.histograms[stage].add((now - last) * 1000.)
+            trace[1] = now
+
+            if stage == MOTOR:
+                self.histograms[TOTAL].add((now - start) * 1000.)
+                del self.traces[key]
+
+    def dump(self, fp=sys.stdout):
+        '''
+        Prints the latency histograms, in milliseconds, one row per stage.
+        Each stage shows the latency since the previous stage stamped.
+        '''
+        with self.lock:
+            fp.write("Latency histograms (ms)\n")
+            fp.write("%-11s %7s %9s %9s %9s %9s  %s\n" %
+                     ("stage", "count", "mean", "p50", "p90", "max",
+                      " ".join("<%g" % edge for edge in self.bins) + " more"))
+            for stage in STAGES[1:] + [TOTAL]:
+                histogram = self.histograms[stage]
+                fp.write("%-11s %7i %9.2f %9.2f %9.2f %9.2f  %s\n" %
+                         (stage, histogram.count, histogram.mean, histogram.quantile(0.5),
+                          histogram.quantile(0.9), histogram.maximum,
+                          " ".join("%i" % count for count in histogram.counts)))
+            fp.flush()
+
+
+# tracer shared by all trains.
+tracer = Tracer()
@@ -1,7 +1,15 @@
-from signal import BLUE, GREEN, PURPLE, RED
+import json
+import os
+from signal import BLUE, GREEN, PURPLE, RED, SIGNAL_COLORS
 from threading import RLock
 
+try:
+    import tomllib
+except ImportError:  # python < 3.11
+    tomllib = None
+
 from gui import INTER_SECTOR, tk_color
+from reservations import reservation_table, reservations
 
 # these names are actually descriptive on a topologically circular track,
 # but are just labels on a figure-8 track, or more complex topologies.
@@ -18,6 +26,20 @@ XTRACK_BRAKING_TIME = 0.5
 MINIMUM_TIME_STATION = 2.
 MAXIMUM_TIME_STATION = 12.
 
+# typical time a train holds a sector, from entry to exit
+DEFAULT_TRANSIT_TIME = 6. # s
+
+# layout used unless another one is loaded
+LAYOUT_FILE = os.path.join(os.path.dirname(__file__), "layouts", "figure8.json")
+
+# sector and crossing ids are indices into the layout arrays. NONE marks
+# the absence of a successor, or of a crossing ahead.
+NONE = -1
+
+# number of sectors a train reserves ahead of the one it enters. With 0,
+# a structured sector grabs the next sector only at its FAST-SLOW transition.
+LOOKAHEAD = 0
+
 MAX_SPEED = 7
 MAX_SPEED_TIME = 4.5 # s
 DEFAULT_SPEED = 4
@@ -71,13 +93,33 @@ class Sector():
         self.exit_speed = exit_speed
         self.look_ahead = look_ahead
 
+        # name and index in the track layout, and typical time a train
+        # holds the sector; set when the layout is compiled
+        self.name = None
+        self.id = NONE
+        self.transit_time = DEFAULT_TRANSIT_TIME
+
         # Describes sector position in track. For now, this is a 2-element dict
         # with pointers to the two neighboring sectors, keyed by the train's
         # sense of motion (A or B).
         self.next = {}
 
-        # This attribute tells what train owns the sector.
-        self.occupier = None
+        # crossing whose signals (YELLOW tiles) a train meets while in the
+        # sector, keyed by the train's sense of motion.
+        self.crossing = {}
+
+        # The train that owns the sector is kept in the reservation table.
+        # Use reservation_table.try_acquire for check-and-set.
+        reservation_table.register(self)
+
+    # trains waiting for the sector are woken up whenever it is freed
+    @property
+    def occupier(self):
+        return reservation_table.occupier(self)
+
+    @occupier.setter
+    def occupier(self, name):
+        reservation_table.set(self, name)
 
 
 class StructuredSector(Sector):
@@ -129,21 +171,26 @@ class XTrack():
     it means that the cross-track exit signal was detected; it that case, just open
     the cross-track.
     '''
-    # signals may not be required at the 4 sides of a cross-track. The list
+    # signals may not be required at the 4 sides of a cross-track. The set
     # of valid signals should be queried by the user in order to accept track
-    # signals that make sense for the specific track layout. The list contains
-    # valid pairs of (sector, direction).
-    # For the specific track layout we have now, this is redundant. But we keep
-    # it in place just in case. New layouts are coming out soon...
-    valid_signals = [
+    # signals that make sense for the specific track layout. The set contains
+    # valid pairs of (sector color, direction).
+    # Layouts build it from the sectors each crossing declares; this default
+    # covers a crossing reachable from anywhere.
+    DEFAULT_SIGNALS = frozenset([
         (BLUE, DIRECTION_A),
         (BLUE, DIRECTION_B),
         (GREEN, DIRECTION_A),
         (GREEN, DIRECTION_B),
         (RED, DIRECTION_A),
         (RED, DIRECTION_B),
-    ]
-    def __init__(self, name):
+    ])
+    def __init__(self, name, valid_signals=DEFAULT_SIGNALS):
+        self.name = name
+        self.valid_signals = frozenset(valid_signals)
+
+        # index in the track layout; set when the layout is compiled
+        self.id = NONE
 
         # keep identifications of trains that booked, and last stopped
         self.booked = None
@@ -151,6 +198,11 @@ class XTrack():
 
         self.lock = RLock()
 
+    # crossings are resources in the wait-for graph (reservations.wait_for)
+    @property
+    def occupier(self):
+        return self.booked
+
     def is_free(self, train):
         self.lock.acquire()
         result = not (self.booked is not None and self.booked != train.name)
@@ -174,8 +226,13 @@ class XTrack():
 
         self.lock.release()
 
+        # wake up trains waiting for the crossing
+        reservations.notify()
+
     def initialize(self, train):
-        self.booked = None
+        with self.lock:
+            self.booked = None
+        reservations.notify()
         if train is not None and train.gui is not None:
             train.report_xtrack(tk_color[INTER_SECTOR])
 
@@ -208,47 +265,306 @@ class XTrack():
         return result
 
 
+class Layout():
+    '''
+    A track layout, compiled into an indexed graph. Sectors and crossings
+    are numbered in the order they are listed in the layout description;
+    their ids index the layout arrays:
+
+        successors[direction][sector id]  id of the next sector, or NONE
+        look_ahead[sector id]             id of the crossing to check before
+                                          leaving the sector, or NONE
+        crossing_at[direction][sector id] id of the crossing whose signals a
+                                          train meets in the sector, or NONE
+        stations[direction]               id of the station sector
+
+    The arrays are also expanded into path tables: for each direction and
+    sector, the sectors ahead, up to a dead end, or back to a sector already
+    on the path. The
+    event processor and path reservation read the arrays and the tables,
+    through the methods below, so finding the sectors ahead of a train is a
+    slice, not a walk along the track.
+
+    The Sector and XTrack objects get their id and name, and the sectors
+    are wired (next, look_ahead, crossing) from the arrays, for code that
+    follows sector pointers. Each crossing has its own lock and booking
+    state, so trains at different crossings don't contend.
+
+    Layouts are built by load_layout, or compile_layout.
+    '''
+    def __init__(self, name, sectors, crossings, successors, look_ahead, crossing_at, stations):
+        self.name = name
+        self.sectors = sectors
+        self.crossings = crossings
+        self.successors = successors
+        self.look_ahead = look_ahead
+        self.crossing_at = crossing_at
+        self.stations = stations
+
+        self.sector_ids = {sector.name: sector.id for sector in sectors}
+        self.crossing_ids = {crossing.name: crossing.id for crossing in crossings}
+
+        for sector in sectors:
+            for direction, ids in successors.items():
+                if ids[sector.id] != NONE:
+                    sector.next[direction] = sectors[ids[sector.id]]
+            if look_ahead[sector.id] != NONE:
+                sector.look_ahead = crossings[look_ahead[sector.id]]
+            for direction, ids in crossing_at.items():
+                if ids[sector.id] != NONE:
+                    sector.crossing[direction] = crossings[ids[sector.id]]
+
+        # path tables. A path that runs into a loop that doesn't go back to
+        # its start ends before it would repeat a sector.
+        self.paths = {}
+        for direction, ids in successors.items():
+            table = []
+            for sector in sectors:
+                path = []
+                seen = {sector.id}
+                sector_id = ids[sector.id]
+                while sector_id != NONE and sector_id not in seen:
+                    path.append(sectors[sector_id])
+                    seen.add(sector_id)
+                    sector_id = ids[sector_id]
+                table.append(tuple(path))
+            self.paths[direction] = table
+
+    def sector(self, name):
+        return self.sectors[self.sector_ids[name]]
+
+    def crossing(self, name):
+        return self.crossings[self.crossing_ids[name]]
+
+    def station(self, direction):
+        return self.sectors[self.stations[direction]]
+
+    def next(self, sector_id, direction):
+        '''
+        :return: id of the sector that follows sector_id, in direction
+        '''
+        return self.successors[direction][sector_id]
+
+    def next_sector(self, sector, direction):
+        '''
+        :return: the sector that follows sector, in direction; None at a
+            dead end
+        '''
+        sector_id = self.successors[direction][sector.id]
+        return self.sectors[sector_id] if sector_id != NONE else None
+
+    def exit_crossing(self, sector):
+        '''
+        :return: the crossing to check before leaving sector, or None
+        '''
+        crossing_id = self.look_ahead[sector.id]
+        return self.crossings[crossing_id] if crossing_id != NONE else None
+
+    def crossing_in(self, sector, direction):
+        '''
+        :return: the crossing whose signals a train meets in sector, going
+            in direction, or None
+        '''
+        crossing_id = self.crossing_at[direction][sector.id]
+        return self.crossings[crossing_id] if crossing_id != NONE else None
+
+    def path(self, sector, direction, length):
+        '''
+        :return: list of up to length sectors that follow sector, in
+            direction. The path ends early at a dead end, or when it gets
+            back to a sector already on it.
+        '''
+        return list(self.paths[direction][sector.id][:length])
+
+    def locate(self, sector, direction, color):
+        '''
+        Finds where a train that left sector is, from the color of a
+        sector signal it saw: the nearest sector of that color ahead.
+
+        :return: the path from sector to the sector found (included); empty
+            if there is no sector of that color ahead
+        '''
+        path = self.paths[direction][sector.id]
+        for index, ahead in enumerate(path):
+            if ahead.color == color:
+                return list(path[:index + 1])
+        return []
+
+    def reserve_path(self, sector, direction, name, length):
+        '''
+        Reserves the sectors ahead of sector for a train, as one atomic
+        step. When the whole path can't be reserved, the longest path that
+        can be is. Paths stop at a sector whose exit crossing is booked by
+        another train, since the train can't get past it anyway.
+
+        :return: the path reserved; empty if the next sector is taken
+        '''
+        if self._exit_booked(sector, name):
+            return []
+        path = self.path(sector, direction, length)
+        for index, ahead in enumerate(path):
+            if self._exit_booked(ahead, name):
+                path = path[:index + 1]
+                break
+
+        while path:
+            if reservation_table.try_acquire(path, name):
+                return path
+            path = path[:-1]
+        return path
+
+    def reserved_path(self, sector, direction, name):
+        '''
+        :return: the sectors reserved by a train ahead of sector
+        '''
+        path = []
+        for ahead in self.paths[direction][sector.id]:
+            if ahead.occupier != name:
+                break
+            path.append(ahead)
+        return path
+
+    def release_path(self, sector, direction, name):
+        '''
+        Releases the sectors reserved by a train ahead of sector.
+        '''
+        path = self.reserved_path(sector, direction, name)
+        if path:
+            reservation_table.release(path, name)
+
+    def _exit_booked(self, sector, name):
+        # True if the crossing at the sector exit is booked by another train
+        crossing_id = self.look_ahead[sector.id]
+        return crossing_id != NONE and self.crossings[crossing_id].booked not in (None, name)
+
+
+def load_layout(path=LAYOUT_FILE):
+    '''
+    Reads a layout description from a JSON or TOML file, and compiles it.
+    See layouts/figure8.json for the format.
+    '''
+    if path.endswith(".toml"):
+        if tomllib is None:
+            raise ValueError("TOML layouts require python 3.11 or later: " + path)
+        with open(path, "rb") as f:
+            description = tomllib.load(f)
+    else:
+        with open(path) as f:
+            description = json.load(f)
+
+    return compile_layout(description)
+
+
+def compile_layout(description):
+    '''
+    Builds a Layout from a layout description: a dict with a list of
+    crossings, a list of sectors, and the station sector for each
+    direction. Each sector lists its color, optional speed settings, the
+    name of the sector that follows it in each direction ("next"),
+    optionally, the crossing to check before leaving it ("look_ahead"), and
+    the typical time a train holds it ("transit_time").
+    Each crossing lists, for each direction, the sectors in which trains
+    meet its signals ("signals").
+
+    :raises ValueError: if the description refers to unknown sectors,
+        crossings, colors, or directions, or if two crossings claim the
+        signals in the same sector and direction
+    '''
+    directions = [DIRECTION_A, DIRECTION_B]
+
+    crossings = []
+    crossing_ids = {}
+    for entry in description.get("crossings", []):
+        # valid signals are narrowed below to the sectors the crossing
+        # claims, if it claims any
+        crossing = XTrack(entry["name"])
+        crossing.id = len(crossings)
+        crossing_ids[crossing.name] = crossing.id
+        crossings.append(crossing)
+
+    sectors = []
+    sector_ids = {}
+    for entry in description["sectors"]:
+        if entry["color"] not in SIGNAL_COLORS:
+            raise ValueError("Unknown color %s in sector %s" % (entry["color"], entry["name"]))
+        if entry["name"] in sector_ids:
+            raise ValueError("Duplicate sector " + entry["name"])
+
+        settings = {key: entry[key] for key in
+                    ("sector_time", "max_speed", "max_speed_time", "exit_speed") if key in entry}
+        sector_class = StructuredSector if entry.get("structured", False) else Sector
+        sector = sector_class(entry["color"], **settings)
+        sector.name = entry["name"]
+        sector.id = len(sectors)
+        sector.transit_time = entry.get("transit_time", DEFAULT_TRANSIT_TIME)
+        sector_ids[sector.name] = sector.id
+        sectors.append(sector)
+
+    def lookup(ids, name, kind):
+        if name not in ids:
+            raise ValueError("Unknown %s %s" % (kind, name))
+        return ids[name]
+
+    successors = {direction: [NONE] * len(sectors) for direction in directions}
+    look_ahead = [NONE] * len(sectors)
+    for entry, sector in zip(description["sectors"], sectors):
+        for direction, name in entry.get("next", {}).items():
+            if direction not in successors:
+                raise ValueError("Unknown direction %s in sector %s" % (direction, sector.name))
+            successors[direction][sector.id] = lookup(sector_ids, name, "sector")
+        if "look_ahead" in entry:
+            look_ahead[sector.id] = lookup(crossing_ids, entry["look_ahead"], "crossing")
+
+    crossing_at = {direction: [NONE] * len(sectors) for direction in directions}
+    for entry, crossing in zip(description.get("crossings", []), crossings):
+        valid_signals = set()
+        for direction, names in entry.get("signals", {}).items():
+            if direction not in crossing_at:
+                raise ValueError("Unknown direction %s in crossing %s" % (direction, crossing.name))
+            for name in names:
+                sector = sectors[lookup(sector_ids, name, "sector")]
+                if crossing_at[direction][sector.id] != NONE:
+                    raise ValueError("Sector %s has signals of two crossings" % name)
+                crossing_at[direction][sector.id] = crossing.id
+                valid_signals.add((sector.color, direction))
+        if "signals" in entry:
+            crossing.valid_signals = frozenset(valid_signals)
+
+    stations = {}
+    for direction, name in description.get("stations", {}).items():
+        if direction not in successors:
+            raise ValueError("Unknown direction %s in stations" % direction)
+        stations[direction] = lookup(sector_ids, name, "sector")
+
+    return Layout(description.get("name", ""), sectors, crossings, successors, look_ahead,
+                  crossing_at, stations)
+
+
 def clear_track():
     for sector in sectors.items():
         sector[1].occupier = None
 
 
-#------------------ TRACK DEFINITION ----------------------------
+def initialize_crossings(train):
+    for crossing in layout.crossings:
+        crossing.initialize(train)
 
-# this track layout has one instance of cross-track
-xtrack = XTrack("Crossing 1")
-
-# sectors. Note that the xtrack sits right after the exit from RED_2
-#TODO max_speed doesn't work on the red sectors, since they lack a sector
-# entry signal tile. Use special handling when exiting the previous segment
-sectors = {"RED_1": Sector(RED, max_speed=2, max_speed_time=15.),
-           GREEN: Sector(GREEN, max_speed=5, max_speed_time=3.),
-           "RED_2": Sector(RED, max_speed=3, look_ahead=xtrack),
-           BLUE: StructuredSector(BLUE, max_speed_time=4.)
-           }
-
-station_sector_names = {DIRECTION_B: "RED_1",
-                        DIRECTION_A: "RED_2"}
 
+#------------------ TRACK DEFINITION ----------------------------
 
 # The track layout is defined by how the sectors connect to each
 # other. There are actually two tracks, one for each direction of
 # movement. In a fixed switch track, this is enough to completely
-# specify a train's trajectory. If movable switches are included,
-# we will probably need a 2-level dict to specify the two possible
-# choices allowed in the sector connections where a movable switch
-# is located.
-
-# Since in this basic initial implementation we have 2 red sectors
-# (stations), we use a special string to key them into the 'sectors'
-# dict.
-
-# A track
-sectors["RED_2"].next[DIRECTION_A] = sectors[BLUE]
-sectors[BLUE].next[DIRECTION_A] = sectors[GREEN]
-sectors[GREEN].next[DIRECTION_A] = sectors["RED_2"]
-
-# B track
-sectors["RED_1"].next[DIRECTION_B] = sectors[BLUE]
-sectors[BLUE].next[DIRECTION_B] = sectors[GREEN]
-sectors[GREEN].next[DIRECTION_B] = sectors["RED_1"]
+# specify a train's trajectory. The layout is described in a file
+# (layouts/figure8.json): it has two red sectors (stations), one for
+# each direction, and one crossing, right after the exit from RED_2.
+#TODO max_speed doesn't work on the red sectors, since they lack a sector
+# entry signal tile. Use special handling when exiting the previous segment
+layout = load_layout()
+
+# sectors keyed by name, and station sector names keyed by direction, as
+# used by the trains. Trains find the sectors and crossings ahead through the
+# layout.
+sectors = {sector.name: sector for sector in layout.sectors}
+station_sector_names = {direction: layout.sectors[sector_id].name
+                        for direction, sector_id in layout.stations.items()}
@@ -1,22 +1,7 @@
 import datetime
-import random
 import sys
-import time
-from colorsys import rgb_to_hsv
-from signal import (
-    BLUE,
-    GREEN,
-    HUE,
-    INTER_SECTOR,
-    PURPLE,
-    RED,
-    RGB_MINIMUM,
-    SATURATION,
-    V_MINIMUM,
-    YELLOW,
-)
-from threading import RLock, Thread, Timer
-from time import sleep
+from signal import INTER_SECTOR
+from threading import Lock
 
 from pylgbst.hub import SmartHub
 from pylgbst.peripherals import (
@@ -30,22 +15,35 @@ from pylgbst.peripherals import (
 )
 
 import uuid_definitions
+from blink import blink_scheduler
+from classifier import classifier
+from dwell import dwell_scheduler
 from event import EventProcessor, SensorEventFilter
-from gui import ASTATION, SECTOR, SIGNAL, XTRACK, tk_color, tkinter_output_queue
+from gui import ASTATION, LAPS, SECTOR, SIGNAL, XTRACK, tk_color, tkinter_output_queue
+from hub_writer import HubWriter
+from journal import Journal
+from operations import operations
+from position import PositionEstimator
+from reservations import wait_for
+from runtime import Wait, threaded
+from tracing import ACCELERATE, MOTOR, tracer
 from track import (
     DIRECTION_A,
-    MAXIMUM_TIME_STATION,
-    MINIMUM_TIME_STATION,
+    LOOKAHEAD,
     TIME_BLIND,
     XTrack,
     clear_track,
+    initialize_crossings,
+    layout,
     sectors,
     station_sector_names,
-    xtrack,
 )
 
 sign = lambda x: x and (1, -1)[x<0]
 
+# all motor handlers created so far, for metrics reporting
+motor_handlers = []
+
 
 class Train:
     '''
@@ -63,14 +61,16 @@ class Train:
     measurements in a text file that is named as the train instance, with suffix ".txt". If a
     file of the same name already exists, it will be appended with data from the current run.
 
-    A thread lock mechanism is used to prevent collisions in the thread-unsafe pylgbst
-    environment. A per-hub lock is provided by default, a global lock can be provided by the
-    caller when the need arises to synchronize among multiple instances of Train.
+    Writes to the hub go through a per-hub command queue (see hub_writer.HubWriter), drained
+    by a single writer thread. That prevents collisions in the thread-unsafe pylgbst
+    environment, while writes to different hubs proceed independently. A global lock can
+    still be provided by the caller, when the need arises to serialize writes among multiple
+    instances of Train.
 
     :param name: train name, used in the report
     :param gui_id: str used by the GUI to direct report to appropriate field
     :param ncars: int number of cars; used to normalize speed settings
-    :param lock: global lock used for threading access
+    :param lock: optional global lock held around each hub write
     :param gui: instance of GUI, used to report status info
     :param led_color: primary LED color used in this train instance
     :param led_secondary_color: secondary LED color used to signal a stopped train
@@ -79,15 +79,19 @@ class Train:
     :param linear: if True, use motor's linear duty cycle curve
     :param address: UUID of the train's internal hub
     :param direction: direction of movement on the track
+    :param runtime: control runtime; runtime.threaded, or an aio.AsyncRuntime
+    :param hub: optional hub object, used instead of connecting to the hub at address
     '''
     def __init__(self, name, gui_id="0", ncars=2, lock=None, report=False, record=False, linear=False,
                  gui=None, led_color=COLOR_BLUE, led_secondary_color=COLOR_ORANGE,
-                 direction=DIRECTION_A, address=uuid_definitions.HUB_TEST):
+                 direction=DIRECTION_A, address=uuid_definitions.HUB_TEST, runtime=threaded,
+                 hub=None):
 
         self.name = name
+        self.runtime = runtime
         self.gui_id = gui_id
         self.ncars = ncars
-        self.hub = SmartHub(address=address)
+        self.hub = hub if hub is not None else SmartHub(address=address)
         self.current = 0.
         self.voltage = 0.
         self.led_color = led_color
@@ -123,35 +127,36 @@ class Train:
         # this flag can be used to toggle between that, and manual mode.
         self.auto = False
 
-        # lock to control threaded access to hub functions
-        self.lock = lock
-        if self.lock is None:
-            self.lock = RLock()
+        # single writer thread and command queue for all hub writes
+        self.writer = HubWriter(self.name, lock=lock)
 
         # motor
         self.motor = self.hub.port_A
-        self.motor_handler = MotorHandler(self.motor, self.ncars, self.lock, linear)
+        self.motor_handler = MotorHandler(self.motor, self.ncars, self.writer, linear, trace_key=self)
         self.power_index = 0
 
+        # dead-reckoning position between signal tiles, from the motor
+        # power commanded
+        self.position = PositionEstimator(self.name, clock=self.runtime.clock)
+
         # led control. Set initial status to current power index
-        self.led_handler = LEDHandler(self, self.lock)
+        self.led_handler = LEDHandler(self, self.writer)
         self.led_handler.set_status_led(self.power_index)
 
-        # Thread control: threads are used to hold the train at a
-        # station for a timed interval, and to accelerate a train
-        # gradually between two power settings.
-        # These threads must be checked and eventually cancelled whenever
-        # an up_speed, down_speed, or stop command is issued by either the
+        # Thread control: a timer is used to hold the train at a station
+        # for a timed interval, and a procedure run by the runtime (a thread,
+        # or a task) accelerates a train gradually between two power settings.
+        # These must be checked and eventually cancelled whenever an
+        # up_speed, down_speed, or stop command is issued by either the
         # user or the controlling script.
         self.timer_station = None
         self.acceleration_thread = None
-        self.stop_acceleration_thread = False
 
         # GUI access
         self.gui = gui
         self.report_signal_timer = None
         if self.gui is not None:
-            xtrack.initialize(self)
+            initialize_crossings(self)
 
         if report:
             fp = None
@@ -195,6 +200,13 @@ class Train:
             output_buffer = self.gui.encode_int_variable(ASTATION, self.name, self.gui_id, self.astation)
             tkinter_output_queue.put(output_buffer)
 
+    def report_laps(self):
+        # update GUI with laps per hour
+        if self.gui is not None:
+            laps_per_hour = round(operations.laps_per_hour(self.name))
+            output_buffer = self.gui.encode_int_variable(LAPS, self.name, self.gui_id, laps_per_hour)
+            tkinter_output_queue.put(output_buffer)
+
     def report_sector(self, tkcolor, subtext=""):
         if self.gui is not None:
             output_buffer = self.gui.encode_str_variable(SECTOR, self.name, self.gui_id,
@@ -213,9 +225,9 @@ class Train:
 
             # stop reporting after a while
             if self.report_signal_timer is not None:
-                self.report_signal_timer.cancel()
-            self.report_signal_timer = Timer(0.5, self._shut_off_signal_color)
-            self.report_signal_timer.start()
+                self.report_signal_timer.reschedule(0.5)
+            else:
+                self.report_signal_timer = self.runtime.schedule(0.5, self._shut_off_signal_color)
 
     def _shut_off_signal_color(self):
         output_buffer = self.gui.encode_str_variable(SIGNAL, self.name, self.gui_id, tk_color[INTER_SECTOR])
@@ -252,6 +264,7 @@ class Train:
     def set_power(self, power_index, force_led_blink=False):
         self.power_index = power_index
         self.motor_handler.set_motor_power(self.power_index, self.voltage)
+        self.position.set_power(self.motor_handler.power)
         self.led_handler.set_status_led(self.power_index, force_blink=force_led_blink)
 
     def cancel_station_timer(self):
@@ -261,7 +274,7 @@ class Train:
 
     def cancel_acceleration_thread(self):
         if self.acceleration_thread is not None:
-            self.stop_acceleration_thread = True
+            self.acceleration_thread.cancel()
             self.acceleration_thread = None
 
     def cancel_speedup_timer(self):
@@ -274,32 +287,28 @@ class Train:
         self.cancel_acceleration_thread()
         self.cancel_station_timer()
 
-    # The `accelerate` method has to be run in a thread, and stopped whenever a
-    # set_power call takes place coming, typically, from the up_speed, dow_speed,
-    # or stop methods initiated by either the user remote, or the controlling script
-    # itself, as for instance in response from a sensor signal.
+    # The `accelerate` method has to be run concurrently (in a thread, or a task),
+    # and stopped whenever a set_power call takes place coming, typically, from the
+    # up_speed, dow_speed, or stop methods initiated by either the user remote, or the
+    # controlling script itself, as for instance in response from a sensor signal.
     def accelerate(self, power_index_values, power_index_signal, sleep_time=0.3):
         # if already running, stop it before starting a new acceleration ramp
         self.cancel_acceleration_thread()
 
-        self.acceleration_thread = Thread(target=self._accelerate,
-                                          args=(power_index_values,
-                                                power_index_signal,
-                                                sleep_time))
-        self.stop_acceleration_thread = False
-        self.acceleration_thread.start()
+        self.acceleration_thread = self.runtime.spawn(self._accelerate(power_index_values,
+                                                                       power_index_signal,
+                                                                       sleep_time))
 
+    # procedure (see runtime.py)
     def _accelerate(self, power_index_values, power_index_signal, sleep_time):
+        if tracer.enabled:
+            tracer.stamp(self, ACCELERATE)
         for k in power_index_values:
-            if self.stop_acceleration_thread:
-                break
             self.set_power(k * power_index_signal)
             if self.secondary_train is not None:
                 # secondary train runs in opposite direction as this train
                 self.secondary_train.set_power(- k * power_index_signal)
-            sleep(sleep_time)
-        self.stop_acceleration_thread = False
-        self.acceleration_thread = None
+            yield sleep_time
 
 
 class MotorHandler:
@@ -314,6 +323,12 @@ class MotorHandler:
 
     A correction factor related to the battery voltage drop that happens during
     use is also handled by this class.
+
+    Motor writes are coalesced before they go out over BLE. A write equal to
+    the last value sent to the motor is dropped. While a write is waiting in
+    the hub's command queue, newer settings replace its value instead of
+    queueing writes of their own, so only the latest setting is sent. This
+    cuts BLE traffic during acceleration ramps and handset button spamming.
     '''
     # NOMINAL_VOLTAGE = 8.3  # Volts (6 AAA Ni-MH batteries in hub - NEW)
     NOMINAL_VOLTAGE = 8.0  # Volts (6 AAA Ni-MH batteries in hub - after tens of recharges)
@@ -355,24 +370,81 @@ class MotorHandler:
     # or zero cars.
     ncars_correction = [0.85, 0.92, 1.]
 
-    def __init__(self, motor, ncars, lock, linear=False):
+    def __init__(self, motor, ncars, writer, linear=False, trace_key=None):
         self.motor = motor
         self.ncars = ncars
         self.power = 0.
-        self.lock = lock
+        self.writer = writer
         self.linear = linear
 
+        # latency traces are kept per train
+        self.trace_key = trace_key
+
+        # write coalescing: value waiting in the command queue (None if no
+        # write is queued), and last value handed to the motor, whether its
+        # write is done or still in flight. Requests are compared against
+        # the latter, so one made during a write isn't taken for a
+        # duplicate of the value the write replaces.
+        self.coalescing_lock = Lock()
+        self.pending_power = None
+        self.sent_power = None
+
+        # coalescing counters
+        self.requested = 0
+        self.written = 0
+        self.duplicates = 0
+        self.superseded = 0
+
+        motor_handlers.append(self)
+
         # linear voltage correction
         self.voltage_slope = (self.MAXIMUM_FACTOR - 1.0) / (self.MINIMUM_VOLTAGE - self.NOMINAL_VOLTAGE)
         self.voltage_zero = 1.0  - self.voltage_slope * self.NOMINAL_VOLTAGE
 
     def set_motor_power(self, index, voltage):
         power = self._compute_power(index, voltage)
-        self.lock.acquire()
-        self.motor.power(param=power)
-        self.lock.release()
         self.power = power
 
+        with self.coalescing_lock:
+            self.requested += 1
+            if self.pending_power is not None:
+                # a write is already queued: just update its value.
+                self.pending_power = power
+                self.superseded += 1
+                return
+            if power == self.sent_power:
+                self.duplicates += 1
+                return
+            self.pending_power = power
+
+        self.writer.submit(self._write_power)
+
+    # runs in the hub writer thread
+    def _write_power(self):
+        with self.coalescing_lock:
+            power = self.pending_power
+            self.pending_power = None
+            if power == self.sent_power:
+                # the queued value was replaced by the one already sent
+                self.duplicates += 1
+                return
+            self.sent_power = power
+
+        self.motor.power(param=power)
+
+        with self.coalescing_lock:
+            self.written += 1
+
+        if tracer.enabled:
+            tracer.stamp(self.trace_key, MOTOR)
+
+    @property
+    def saved(self):
+        '''
+        Number of motor writes that were not sent, out of those requested.
+        '''
+        return self.duplicates + self.superseded
+
     def _compute_power(self, index, voltage):
         duty = self.duty[index]
         if self.linear:
@@ -391,6 +463,20 @@ class MotorHandler:
         return self.power
 
 
+def dump_motor_metrics(fp=sys.stdout):
+    '''
+    Prints motor write coalescing counters for all motor handlers.
+    '''
+    fp.write("Motor writes\n")
+    fp.write("%-16s %9s %9s %9s %9s %9s\n" %
+             ("hub", "requested", "written", "duplicate", "replaced", "saved"))
+    for handler in motor_handlers:
+        fp.write("%-16s %9i %9i %9i %9i %9i\n" %
+                 (handler.writer.name[:16], handler.requested, handler.written,
+                  handler.duplicates, handler.superseded, handler.saved))
+    fp.flush()
+
+
 class SimpleTrain(Train):
     '''
     A SimpleTrain is a Train *not* equipped with a sensor. It may or may not have a
@@ -406,7 +492,7 @@ class SimpleTrain(Train):
     :param name: train name, used in the report
     :param gui_id: str used by the GUI to direct report to appropriate field
     :param ncars: int number of cars; used to normalize speed settings
-    :param lock: lock used for threading access
+    :param lock: optional global lock held around each hub write
     :param gui: instance of GUI, used to report status info
     :param led_color: primary LED color used in this train instance
     :param led_secondary_color: secondary LED color used to signal a stopped train
@@ -415,23 +501,25 @@ class SimpleTrain(Train):
     :param linear: if True, use motor's linear duty cycle curve
     :param address: UUID of the train's internal hub
     :param direction: direction of movement on the track
+    :param runtime: control runtime; runtime.threaded, or an aio.AsyncRuntime
     '''
     def __init__(self, name, gui_id="0", ncars=2, lock=None, report=False, record=False, linear=False,
                  gui=None, led_color=COLOR_BLUE, led_secondary_color=COLOR_ORANGE,
                  direction=DIRECTION_A,
-                 address=uuid_definitions.HUB_TEST): # test hub
+                 address=uuid_definitions.HUB_TEST, # test hub
+                 runtime=threaded):
 
         super(SimpleTrain, self).__init__(name, gui_id, ncars=ncars, lock=lock,
                                           report=report, record=record, linear=linear,
                                           gui=gui, led_color=led_color,
                                           led_secondary_color=led_secondary_color,
                                           direction=direction,
-                                          address=address)
+                                          address=address, runtime=runtime)
 
         self.headlight_handler = None
 
         if isinstance(self.hub.port_B, LEDLight):
-            self.headlight_handler = HeadlightHandler(self, self.lock)
+            self.headlight_handler = HeadlightHandler(self, self.writer)
 
     # in the methods that increase or decrease motor power, one has to
     # always call the headlight brightness control, since the power can
@@ -473,7 +561,7 @@ class SmartTrain(Train):
     :param name: train name, used in the report
     :param gui_id: str used by the GUI to direct report to appropriate field
     :param ncars: int number of cars; used to normalize speed settings
-    :param lock: lock used for threading access
+    :param lock: optional global lock held around each hub write
     :param gui: instance of GUI, used to report status info
     :param led_color: primary LED color used in this train instance
     :param led_secondary_color: secondary LED color used to signal a stopped train
@@ -482,29 +570,58 @@ class SmartTrain(Train):
     :param linear: if True, use motor's linear duty cycle curve
     :param address: UUID of the train's internal hub
     :param direction: direction of movement on the track
+    :param runtime: control runtime; runtime.threaded, or an aio.AsyncRuntime
+    :param lookahead: number of sectors to reserve ahead of the sector entered
+    :param journal: if True, log vision sensor samples and events in a binary file that
+        is named as the train instance, with suffix ".journal" (see journal.py)
+    :param hub: optional hub object, used instead of connecting to the hub at address
     '''
     def __init__(self, name, gui_id="0", ncars=2, lock=None, report=False, record=False, linear=False,
                  gui=None, led_color=COLOR_BLUE, led_secondary_color=COLOR_ORANGE,
-                 direction=DIRECTION_A, address=uuid_definitions.HUB_TEST): # test hub
+                 direction=DIRECTION_A, address=uuid_definitions.HUB_TEST, # test hub
+                 runtime=threaded, lookahead=LOOKAHEAD, journal=False, hub=None):
 
         super(SmartTrain, self).__init__(name, gui_id, ncars=ncars, lock=lock,
                                          report=report, record=record, linear=linear,
                                           gui=gui, led_color=led_color,
                                           led_secondary_color=led_secondary_color,
                                           direction=direction,
-                                          address=address)
+                                          address=address, runtime=runtime, hub=hub)
 
-        self.hub.vision_sensor.subscribe(self._vision_sensor_callback, granularity=4, mode=6)
+        self.lookahead = lookahead
+
+        # when trains deadlock, this one can give up the sectors it
+        # reserved ahead
+        wait_for.register(self.name, lambda: len(self._reserved_path()), self._release_path)
+
+        # raw samples and confirmed events can be logged, for replay
+        self.journal = None
+        if journal:
+            self.journal = Journal(self.name + ".journal", clock=self.runtime.clock)
 
         # events coming from the vision sensor need to be pre-processed in order
         # to filter out multiple detections, before being handled.
-        self.sensor_event_filter = SensorEventFilter(self)
-        self.event_processor = EventProcessor(self)
+        self.sensor_event_filter = SensorEventFilter(self, clock=self.runtime.clock,
+                                                     journal=self.journal)
+        self.event_processor = EventProcessor(self, clock=self.runtime.clock)
         # self.event_processor = DummyEventProcessor(self) # for debugging only
 
         self.initialize_sectors()
         clear_track()
 
+        self.hub.vision_sensor.subscribe(self._vision_sensor_callback, granularity=4, mode=6)
+
+    def _reserved_path(self):
+        sector = self.sector if self.sector is not None else self.previous_sector
+        if sector is None:
+            return []
+        return layout.reserved_path(sector, self.direction, self.name)
+
+    def _release_path(self):
+        sector = self.sector if self.sector is not None else self.previous_sector
+        if sector is not None:
+            layout.release_path(sector, self.direction, self.name)
+
     def initialize_sectors(self):
         '''
         When departing from a station, or when any situation requires a full
@@ -538,15 +655,25 @@ class SmartTrain(Train):
 
         self.cancel_station_timer()
 
-        # start a timed wait interval at a station
-        time_station = random.uniform(MINIMUM_TIME_STATION, MAXIMUM_TIME_STATION)
-        self.timer_station = Timer(time_station, self.restart_movement)
-        self.timer_station.start()
+        # start a timed wait interval at a station. Its length depends on
+        # how soon the path ahead is expected to be clear (see dwell.py).
+        time_station = dwell_scheduler.dwell(layout.station(self.direction),
+                                             self.direction, self.name)
+        # restart_movement hands the wait for the sector ahead to the
+        # train's event handling, so it doesn't block the timer.
+        self.timer_station = self.runtime.schedule(time_station, self.restart_movement)
 
         self.astation = time_station
         self.report_astation()
 
     def restart_movement(self):
+        # the end of a timed stop at a station
+        self.runtime.run(self._restart_movement(from_station=True), key=self)
+
+    # procedure (see runtime.py). Only restarts from a station stop count
+    # as station departures; the event processor also restarts trains
+    # stopped at the end of a structured sector.
+    def _restart_movement(self, from_station=False):
         self.astation = 0
         self.report_astation()
 
@@ -556,26 +683,35 @@ class SmartTrain(Train):
         # train.previous_sector was set to the sector the train is departing
         # from.
         self.led_handler.set_solid(COLOR_RED)
+        departing = self.runtime.clock()
         previous_sector = self.previous_sector
-        next_sector = previous_sector.next[self.direction]
-        while next_sector.occupier is not None and \
-              next_sector.occupier != self.name:
-            time.sleep(0.5)
+        next_sector = layout.next_sector(previous_sector, self.direction)
+        yield Wait(lambda: next_sector.occupier is None or next_sector.occupier == self.name,
+                   waiter=self.name, resource=next_sector)
+        operations.waited(self.name, next_sector, self.runtime.clock() - departing)
 
         # when restaring movement, check for the existence of a xtrack object
         # ahead. In case there is one, check its status, and either book it
         # and proceed moving, or wait until the xtrack is freed.
-        xt1 = previous_sector.look_ahead
+        xt1 = layout.exit_crossing(previous_sector)
         if xt1 is not None and isinstance(xt1, XTrack):
             # occupied; wait for opening
-            while not xt1.is_free(self):
-                time.sleep(0.5)
+            waiting = self.runtime.clock()
+            yield Wait(lambda: xt1.is_free(self), waiter=self.name, resource=xt1)
+            operations.waited(self.name, xt1, self.runtime.clock() - waiting)
 
             # book it when starting to leave
-            xtrack.book(self)
-
-        # immediately occupy next sector
-        next_sector.occupier = self.name
+            xt1.book(self)
+
+        # immediately occupy next sector, and the path beyond it if this
+        # train looks ahead. Another train may have grabbed the next sector
+        # while this one was waiting for the crossing.
+        yield Wait(lambda: layout.reserve_path(previous_sector, self.direction, self.name,
+                                               max(1, self.lookahead)),
+                   waiter=self.name, resource=next_sector)
+        if from_station:
+            dwell_scheduler.departed(self.runtime.clock() - departing)
+            operations.departed(self.name)
 
         # train is departing from station, so gui displays inter-sector color
         self.report_sector(tk_color[INTER_SECTOR])
@@ -583,7 +719,7 @@ class SmartTrain(Train):
         self.led_handler.set_solid(COLOR_GREEN)
         if self.secondary_train is not None:
             self.secondary_train.led_handler.set_solid(COLOR_GREEN)
-        sleep(1.0)
+        yield 1.0
 
         # need to find out if this train is running forward or reverse
         # Cannot use self.power_index since it is set to zero when train is
@@ -600,39 +736,28 @@ class SmartTrain(Train):
         # stopped rigth over a signal tile on the track. In that situation,
         # as soon as the movement starts, a false signal can be issued.
         self.signal_blind = True
-        self.signal_blind_timer = Timer(TIME_BLIND, self.activate_signals)
-        self.signal_blind_timer.start()
+        self.signal_blind_timer = self.runtime.schedule(TIME_BLIND, self.activate_signals)
 
         # accelerate just to move train out of station area into inter-sector
         # zone. Train will regain full speed when crossing sector signal.
         self.accelerate(list(range(1, 4)), power_index_signal, sleep_time=0.2)
 
     def _vision_sensor_callback(self, *args, **kwargs):
-        # use HSV as criterion for mapping colors
-        r = args[0]
-        g = args[1]
-        b = args[2]
-        h, s, v = rgb_to_hsv(r, g, b)
-
-        if h >= 1. or h <= 0.:
-            return
-
-        # RED hue flips back to zero when crossing 1. We add 1. here
-        # so the comparison logic downstream works.
-        if h > 0. and h <= 0.05:
-            h += 1.
-
-        # ignore events with low signal-to-noise ratio
-        if min(r, g, b) >= RGB_MINIMUM and v >= V_MINIMUM:
-
-            # find matching color.
-            for color in [PURPLE, BLUE, GREEN, RED, YELLOW, ]:
-
-                if (h >= HUE[color][0] and h <= HUE[color][1]) and \
-                   (s >= SATURATION[color][0] and s <= SATURATION[color][1]):
-
-                    self.sensor_event_filter.filter_event(color)
-                    return
+        if tracer.enabled:
+            tracer.sample(self)
+
+        # map RGB to a signal color. The classifier's lookup table gives the
+        # same results as converting to HSV and scanning the HUE/SATURATION
+        # tables in signal.py, at a fraction of the cost per sample.
+        color = classifier.classify(args[0], args[1], args[2])
+        if self.journal is not None:
+            self.journal.sample(args[0], args[1], args[2], color)
+
+        # samples that match no color are fed too: they vote against
+        # spurious detections. Filtering runs in the runtime's control
+        # context; in threaded mode, that's this BLE thread, which then
+        # only enqueues the events confirmed (see event_queue.py).
+        self.runtime.dispatch(self.sensor_event_filter.filter_event, color)
 
     # this method will set a flag that tells that it's safe now to get an
     # end-of-sector signal. The flag is managed by a timer and is used
@@ -657,6 +782,7 @@ class SmartTrain(Train):
         #     sectors[GREEN].occupier = None
         #     print("GREEN sector OPEN")
 
+        xtrack = layout.crossings[0]
         if xtrack.is_free(self):
             xtrack.booked = "dummy train"
         else:
@@ -708,94 +834,53 @@ class LEDHandler:
 
     A Handler class is used to send/receive messages to/from a train hub, minimizing
     the number of actual Bluetooth messages. This helps in shielding the BLE environment
-    from a flurry of unecessary messages. It also uses a lock to set hub parameters,
-    preventing collisions in pylgbst.
+    from a flurry of unecessary messages. Hub parameters are set through the hub's
+    command queue, preventing collisions in pylgbst.
     '''
     STATIC = 0
     BLINKING = 1
 
-    # blinking should be fast to minimize latency in handset response time
-    BLINK_TIME = 0.3 # seconds
+    # blinking starts with a delay after the motor stops. The delay is
+    # necessary to minimize latency when operating train with the handset
+    # buttons.
+    BLINK_DELAY = 2. # seconds
 
-    def __init__(self, train, lock):
+    def __init__(self, train, writer):
         self.train = train
-        self.lock = lock
+        self.writer = writer
         self.led = train.hub.led
         self.led_color = train.led_color
         self.led_secondary_color = train.led_secondary_color
         self.previous_power_index = 0
 
-        # we require a quite complex thread control mechanism to implement
-        # a blinking LED that starts with a delay when the motor stops. The
-        # delay is necessary to minimize latency when operating train with
-        # the handset buttons.
-        self.led_thread = None
-        self.delay_timer = None
-        self.led_thread_stop_switch = False
-        self.led_thread_is_running = False
+        # blinking itself is driven by the scheduler shared by all hubs.
+        self.blink_scheduler = blink_scheduler
 
         self.set_status_led(1)
 
     def set_solid(self, color):
-        self._cancel_led_thread()
-        self._cancel_delay_timer()
+        self.blink_scheduler.cancel(self)
 
-        self.lock.acquire()
-        self.led.set_color(color)
-        self.lock.release()
+        self.writer.submit(self.led.set_color, color)
 
     def set_status_led(self, new_power_index, force_blink=False):
         # here is the logic that prevents redundant BLE messages to be sent to the train hub
         if (self._led_desired_mode(new_power_index) != self._led_desired_mode(self.previous_power_index)) \
                 or force_blink:
 
-            self._cancel_led_thread()
-            self._cancel_delay_timer()
-
             if self._led_desired_mode(new_power_index) == self.STATIC:
-                self.lock.acquire()
-                self.led.set_color(self.led_color)
-                self.lock.release()
+                self.blink_scheduler.cancel(self)
+                self.writer.submit(self.led.set_color, self.led_color)
             else: # BLINKING
-                self.delay_timer = Timer(2., self._start_led_thread, [])
-                self.delay_timer.start()
+                self.blink_scheduler.start(self, self.writer, self.led,
+                                           (self.led_color, self.led_secondary_color),
+                                           delay=self.BLINK_DELAY)
 
             self.previous_power_index = new_power_index
 
-    def _start_led_thread(self):
-        self.led_thread = Thread(target=self._swap_led_color, args=(self.led_color, self.led_secondary_color))
-        self.led_thread_stop_switch = False
-        self.led_thread_is_running = True
-        self.led_thread.start()
-
     def _led_desired_mode(self, power_index):
         return self.BLINKING if power_index == 0 else self.STATIC
 
-    def _swap_led_color(self, c1, c2):
-        while not self.led_thread_stop_switch:
-            self.lock.acquire()
-            self.led.set_color(c1)
-            self.lock.release()
-            sleep(self.BLINK_TIME)
-            self.lock.acquire()
-            self.led.set_color(c2)
-            self.lock.release()
-            sleep(self.BLINK_TIME)
-
-        self.led_thread_is_running = False
-
-    def _cancel_led_thread(self):
-        if self.led_thread is not None:
-            self.led_thread_stop_switch = True
-            while self.led_thread_is_running:
-                sleep(self.BLINK_TIME / 10)
-            self.led_thread = None
-
-    def _cancel_delay_timer(self):
-        if self.delay_timer is not None:
-            self.delay_timer.cancel()
-            self.delay_timer = None
-
 
 class HeadlightHandler:
     '''
@@ -805,15 +890,14 @@ class HeadlightHandler:
 
     A Handler class is used to send/receive messages to/from a train hub, minimizing
     the number of actual Bluetooth messages. This helps in shielding the BLE environment
-    from a flurry of unecessary messages. It also uses a lock to set hub parameters,
-    preventing collisions in pylgbst.
+    from a flurry of unecessary messages. Hub parameters are set through the hub's
+    command queue, preventing collisions in pylgbst.
     '''
-    def __init__(self, train, lock):
-        self.lock = lock
+    def __init__(self, train, writer):
+        self.writer = writer
+        self.runtime = train.runtime
         self.headlight = train.hub.port_B
-        self.lock.acquire()
-        self.headlight_brightness = self.headlight.brightness
-        self.lock.release()
+        self.headlight_brightness = self.writer.call(lambda: self.headlight.brightness)
 
     # thread control
     headlight_timer = None
@@ -828,24 +912,20 @@ class HeadlightHandler:
                 brightness = 100
                 if brightness != self.headlight_brightness:
                     self._cancel_headlight_thread()
-                    self._set_brightness(brightness, self.lock)
+                    self._set_brightness(brightness)
                     self.headlight_brightness = brightness
             else:
                 # dim headlight after delay
                 if brightness != self.headlight_brightness:
                     self._cancel_headlight_thread()
-                    self.headlight_timer = Timer(3, self._set_brightness, [brightness, self.lock])
-                    self.headlight_timer.start()
+                    self.headlight_timer = self.runtime.schedule(3, self._set_brightness, brightness)
                     self.headlight_brightness = brightness
 
-    # wrapper to allow locking
-    def _set_brightness(self, brightness, lock):
-        lock.acquire()
-        self.headlight.set_brightness(brightness)
-        lock.release()
+    # headlight writes go through the hub's command queue
+    def _set_brightness(self, brightness):
+        self.writer.submit(self.headlight.set_brightness, brightness)
 
     def _cancel_headlight_thread(self):
         if self.headlight_timer is not None:
             self.headlight_timer.cancel()
             self.headlight_timer = None
-            sleep(0.1)
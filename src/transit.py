@@ -0,0 +1,158 @@
+'''
+Sector transit times learned from measurements.
+
+A train entering a sector is blind to sector signals for a while
+(Sector.sector_time), so that a spurious end-of-sector signal isn't taken
+for the real one, and runs at max speed for a while (Sector.max_speed_time)
+before dropping to the default speed ahead of the next signal. Both used to
+be hand-set constants.
+
+The event processor now measures, for each train, sector and entry power,
+the time from sector entry to the sector signal: the end of a regular
+sector, or the FAST-SLOW transition of a structured one. The entry power is
+the motor power commanded as the train enters the sector, in buckets
+POWER_STEP wide: a train that enters at a crawl, after a stop, takes longer
+than one that enters at speed. Transits
+in which the train stopped (at a crossing) are left out. Each measurement
+goes into an exponentially weighted moving average of the transit time,
+and of its variance, so memory is constant per train and sector.
+
+Once MINIMUM_SAMPLES transits have been measured, the earliest expected
+arrival at the sector signal is mean - SIGMAS * deviation. The guard timer
+then runs until GUARD_LEAD before that time, and max speed is held until
+SLOWDOWN_LEAD before it. Until then, the sector's own settings are used.
+The latest expected arrival, mean + SIGMAS * deviation, tells when a
+signal was probably missed: a train that hasn't seen its sector signal by
+then slows down, and holds the sector ahead, before it gets there (see
+EventProcessor._check_missed_signal).
+'''
+import math
+import sys
+from threading import Lock
+
+# weight of a new measurement in the moving averages
+ALPHA = 0.2
+
+# measurements needed before the estimates are used
+MINIMUM_SAMPLES = 3
+
+# width of the expected arrival window, in standard deviations
+SIGMAS = 2.
+
+# the guard timer ends this long before the earliest expected arrival
+GUARD_LEAD = 0.5 # s
+
+# time needed to slow down from max speed before the sector signal
+SLOWDOWN_LEAD = 1.5 # s
+
+# width of the entry power buckets (motor power, 0 to 1)
+POWER_STEP = 0.1
+
+
+def power_bucket(power):
+    '''
+    :return: the bucket of a motor power setting, in either direction
+    '''
+    return int(round(abs(power) / POWER_STEP))
+
+
+class MovingEstimate():
+    '''
+    Exponentially weighted moving average and variance of a measurement.
+    '''
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.variance = 0.
+
+    def add(self, value, alpha):
+        self.count += 1
+        if self.count == 1:
+            self.mean = value
+            return
+        difference = value - self.mean
+        self.mean += alpha * difference
+        self.variance = (1. - alpha) * (self.variance + alpha * difference * difference)
+
+    @property
+    def deviation(self):
+        return math.sqrt(self.variance)
+
+
+class TransitEstimator():
+    '''
+    Moving estimates of sector transit times, per train, sector and entry
+    power bucket.
+
+    :param alpha: weight of a new measurement in the moving averages
+    :param minimum_samples: measurements needed before estimates are used
+    '''
+    def __init__(self, alpha=ALPHA, minimum_samples=MINIMUM_SAMPLES):
+        self.alpha = alpha
+        self.minimum_samples = minimum_samples
+        self.lock = Lock()
+
+        # keyed by (train name, sector name, power bucket)
+        self.estimates = {}
+
+    def record(self, name, sector, power, transit_time):
+        '''
+        :param name: train name
+        :param sector: the sector traversed
+        :param power: motor power the train entered the sector with
+        :param transit_time: time from sector entry to the sector signal,
+            in seconds
+        '''
+        key = (name, sector.name, power_bucket(power))
+        with self.lock:
+            estimate = self.estimates.get(key)
+            if estimate is None:
+                estimate = self.estimates[key] = MovingEstimate()
+            estimate.add(transit_time, self.alpha)
+
+    def window(self, name, sector, power):
+        '''
+        :return: earliest and latest expected arrival at the sector signal,
+            in seconds from sector entry; None if too few transits were
+            measured
+        '''
+        with self.lock:
+            estimate = self.estimates.get((name, sector.name, power_bucket(power)))
+            if estimate is None or estimate.count < self.minimum_samples:
+                return None
+            spread = SIGMAS * estimate.deviation
+            return max(estimate.mean - spread, 0.), estimate.mean + spread
+
+    def guard_time(self, name, sector, power):
+        '''
+        :return: time to stay blind to sector signals after entering the
+            sector, in seconds
+        '''
+        window = self.window(name, sector, power)
+        if window is None:
+            return sector.sector_time
+        return max(window[0] - GUARD_LEAD, sector.sector_time)
+
+    def max_speed_time(self, name, sector, power):
+        '''
+        :return: time to hold max speed after entering the sector, in seconds
+        '''
+        window = self.window(name, sector, power)
+        if window is None:
+            return sector.max_speed_time
+        return max(window[0] - SLOWDOWN_LEAD, 0.)
+
+    def dump(self, fp=sys.stdout):
+        with self.lock:
+            fp.write("Sector transit times (s)\n")
+            fp.write("%-12s %-10s %5s %7s %7s %9s\n" %
+                     ("train", "sector", "power", "count", "mean", "deviation"))
+            for (name, sector, bucket), estimate in sorted(self.estimates.items()):
+                fp.write("%-12s %-10s %5.1f %7i %7.2f %9.2f\n" %
+                         (name, sector, bucket * POWER_STEP, estimate.count, estimate.mean,
+                          estimate.deviation))
+            fp.flush()
+
+
+# estimates shared by all trains
+transit_times = TransitEstimator()
@@ -0,0 +1,59 @@
+''' Measures the per-sample cost of classifying vision sensor samples, with
+    the reference HSV classifier (the original vision sensor callback logic)
+    and with the lookup table classifier.
+
+    Samples are the RGB captures in the data directory.
+'''
+import csv
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+
+from classifier import ColorClassifier, classify_rgb  # noqa: E402
+
+REPEAT = 50
+
+
+def ingest(filenames):
+    samples = []
+    for filename in filenames:
+        with open(filename, mode='r') as csv_file:
+            for row in csv.reader(csv_file):
+                if row:
+                    samples.append(tuple(int(float(x)) for x in row))
+    return samples
+
+
+def per_sample_time(function, samples):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        for r, g, b in samples:
+            function(r, g, b)
+    return (time.perf_counter() - start) / (REPEAT * len(samples))
+
+
+if __name__ == '__main__':
+    filenames = glob.glob(os.path.join(os.path.dirname(__file__), "data", "*.csv"))
+    filenames = [f for f in filenames if not f.endswith("lego_colors.csv")]
+    samples = ingest(filenames)
+
+    start = time.perf_counter()
+    classifier = ColorClassifier()
+    build_time = time.perf_counter() - start
+
+    # warm up: refines the ambiguous cells the captures land in
+    for r, g, b in samples:
+        classifier.classify(r, g, b)
+
+    before = per_sample_time(classify_rgb, samples)
+    after = per_sample_time(classifier.classify, samples)
+
+    print("samples:         %i" % len(samples))
+    print("table build:     %6.3f s   (coverage %4.1f%%)" % (build_time, classifier.coverage * 100))
+    print("refined cells:   %i" % len(classifier.refined))
+    print("HSV classifier:  %6.3f us/sample" % (before * 1.e6))
+    print("table lookup:    %6.3f us/sample" % (after * 1.e6))
+    print("speedup:         %6.1f x" % (before / after))
@@ -0,0 +1,7 @@
+''' Makes the helpers in support.py importable by the unit tests, which
+    pytest imports with --import-mode=importlib (see pyproject.toml).
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
@@ -0,0 +1,35 @@
+''' Helpers shared by the unit tests.
+'''
+import contextlib
+import os
+import sys
+
+SRC = os.path.join(os.path.dirname(__file__), os.pardir, "src")
+
+if SRC not in sys.path:
+    sys.path.insert(0, SRC)
+
+
+@contextlib.contextmanager
+def local_signal():
+    '''
+    src/signal.py shares its name with the standard library module, which
+    the test runner may have imported already. Modules under test imported
+    in this context are imported against the local one; the standard
+    library module is put back on the way out.
+    '''
+    saved = sys.modules.pop("signal", None)
+    try:
+        yield
+    finally:
+        if saved is not None:
+            sys.modules["signal"] = saved
+
+
+class VirtualClock():
+    ''' A clock that only moves when the test sets now. '''
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
@@ -0,0 +1,120 @@
+''' Unit test that verifies that the shared blink scheduler blinks LEDs of
+    several hubs from one thread, staggered, and stops them at once.
+'''
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+
+import blink  # noqa: E402
+import hub_writer  # noqa: E402
+
+
+class _TestWriter():
+    ''' Stands in for HubWriter; writes right away. '''
+    def try_submit(self, function, *args):
+        function(*args)
+        return True
+
+
+class _TestLED():
+    ''' Records color changes, with their time and thread. '''
+    def __init__(self):
+        self.changes = []
+
+    def set_color(self, color):
+        self.changes.append((color, time.monotonic(), threading.current_thread()))
+
+
+class TestBlinkScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = blink.BlinkScheduler(period=0.02, slots=4)
+        self.writer = _TestWriter()
+
+    def test_blink(self):
+        leds = [_TestLED() for _ in range(3)]
+        for n, led in enumerate(leds):
+            self.scheduler.start(n, self.writer, led, ("A", "B"))
+        time.sleep(0.15)
+        with self.scheduler.condition:
+            dues = [self.scheduler.blinkers[n].due for n in range(3)]
+        for n in range(3):
+            self.scheduler.cancel(n)
+
+        threads = set()
+        for led in leds:
+            colors = [change[0] for change in led.changes]
+            self.assertGreaterEqual(len(colors), 4)
+            self.assertEqual(colors[:4], ["A", "B", "A", "B"])
+            threads.update(change[2] for change in led.changes)
+        self.assertEqual(threads, {self.scheduler.thread})
+
+        # each LED got its own phase slot. Due times are checked, since
+        # the time changes are made at depends on thread scheduling.
+        slots = set()
+        for due in dues:
+            phase = (due % self.scheduler.period) / self.scheduler.period
+            slots.add(round(phase * self.scheduler.slots) % self.scheduler.slots)
+        self.assertEqual(len(slots), 3)
+
+    def test_cancel(self):
+        led = _TestLED()
+        self.scheduler.start("led", self.writer, led, ("A", "B"))
+        time.sleep(0.05)
+        self.scheduler.cancel("led")
+        self.assertFalse(self.scheduler.is_blinking("led"))
+        count = len(led.changes)
+        time.sleep(0.05)
+        self.assertEqual(len(led.changes), count)
+
+    def test_delay(self):
+        led = _TestLED()
+        start = time.monotonic()
+        self.scheduler.start("led", self.writer, led, ("A", "B"), delay=0.1)
+        time.sleep(0.05)
+        self.assertEqual(led.changes, [])
+        time.sleep(0.1)
+        self.scheduler.cancel("led")
+        self.assertGreaterEqual(led.changes[0][1] - start, 0.1)
+
+    # a hub with a full command queue doesn't hold up the others, or
+    # callers
+    def test_full_queue(self):
+        gate = threading.Event()
+        stalled = hub_writer.HubWriter("stalled", maxsize=1)
+        stalled.submit(gate.wait)
+        led = _TestLED()
+        self.scheduler.start("stalled", stalled, _TestLED(), ("A", "B"))
+        self.scheduler.start("led", self.writer, led, ("A", "B"))
+        time.sleep(0.15)
+
+        start = time.monotonic()
+        self.scheduler.cancel("stalled")
+        self.scheduler.cancel("led")
+        self.assertLess(time.monotonic() - start, 0.05)
+        self.assertGreaterEqual(len(led.changes), 4)
+        self.assertGreater(stalled.dropped, 0)
+        gate.set()
+        stalled.close()
+
+    # color changes still queued when the LED is cancelled aren't made
+    def test_cancel_queued(self):
+        gate = threading.Event()
+        writer = hub_writer.HubWriter("slow")
+        writer.submit(gate.wait)
+        led = _TestLED()
+        self.scheduler.start("led", writer, led, ("A", "B"))
+        time.sleep(0.05)
+        self.scheduler.cancel("led")
+        self.assertGreater(writer.depth, 0)
+
+        gate.set()
+        writer.close()
+        self.assertEqual(led.changes, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+''' Unit test that verifies that HUE/SATURATION tables fitted to the
+    captures separate the signal colors from each other and from the
+    background.
+'''
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+from support import SRC, local_signal
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+with local_signal():
+    if np is not None:
+        import calibration
+        import colorimetry
+
+
+@unittest.skipIf(np is None, "requires numpy")
+class TestCalibration(unittest.TestCase):
+    def setUp(self):
+        self.filenames = sorted(glob.glob(os.path.join(DATA, "*.csv")))
+        self.samples = calibration.load_labeled_samples(self.filenames)
+        self.boxes = calibration.fit(self.samples)
+        self.hue = {color: box[0] for color, box in self.boxes.items()}
+        self.saturation = {color: box[1] for color, box in self.boxes.items()}
+
+    def test_no_overlap(self):
+        colors = list(self.boxes)
+        for n, color_1 in enumerate(colors):
+            for color_2 in colors[n + 1:]:
+                apart = any(self.boxes[color_1][axis][1] < self.boxes[color_2][axis][0] or
+                            self.boxes[color_2][axis][1] < self.boxes[color_1][axis][0]
+                            for axis in (0, 1))
+                self.assertTrue(apart, (color_1, color_2))
+
+    # every labeled capture classifies to its own color or to no color,
+    # and almost all samples of each signal color are recognized.
+    def test_captures(self):
+        colors = list(self.boxes)
+        names = [colorimetry.NONE] + colors
+        for filename in self.filenames:
+            label = colorimetry.CAPTURE_LABELS.get(colorimetry.capture_name(filename))
+            if label is None:
+                continue
+            codes = colorimetry.classify(colorimetry.load_capture(filename), hue=self.hue,
+                                         saturation=self.saturation, colors=colors)
+            wrong = np.count_nonzero((codes != 0) & (codes != names.index(label)))
+            self.assertEqual(wrong, 0, filename)
+            if label != colorimetry.NONE:
+                self.assertGreater(np.mean(codes == names.index(label)), 0.95, filename)
+
+    def test_update_signal_module(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "signal.py")
+            shutil.copy(os.path.join(SRC, "signal.py"), filename)
+            calibration.update_signal_module(filename, self.hue, self.saturation)
+
+            namespace = {}
+            with open(filename, mode='r') as f:
+                exec(f.read(), namespace)
+        finally:
+            shutil.rmtree(directory)
+
+        for color, (hue_range, saturation_range) in self.boxes.items():
+            self.assertEqual(namespace["HUE"][color], hue_range)
+            self.assertEqual(namespace["SATURATION"][color], saturation_range)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+''' Unit test that verifies that the lookup table color classifier gives
+    the same results as the reference HSV classifier.
+'''
+import csv
+import glob
+import os
+import random
+import unittest
+
+from support import local_signal
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+with local_signal():
+    import classifier
+
+
+def _captures():
+    samples = []
+    for filename in sorted(glob.glob(os.path.join(DATA, "*.csv"))):
+        if filename.endswith("lego_colors.csv"):
+            continue
+        with open(filename, mode='r') as csv_file:
+            for row in csv.reader(csv_file):
+                if row:
+                    samples.append(tuple(int(float(x)) for x in row))
+    return samples
+
+
+class TestClassifier(unittest.TestCase):
+    def setUp(self):
+        self.classifier = classifier.classifier
+
+    def assertMatchesReference(self, samples):
+        for r, g, b in samples:
+            self.assertEqual(self.classifier.classify(r, g, b),
+                             classifier.classify_rgb(r, g, b), (r, g, b))
+
+    # every sample recorded over signal tiles, track, and carpet
+    def test_captures(self):
+        samples = _captures()
+        self.assertGreater(len(samples), 0)
+        self.assertMatchesReference(samples)
+
+    # dense sweep around the RED tile, where hue wraps around
+    def test_red_sweep(self):
+        samples = [(r, g, b) for r in range(180, 260, 3)
+                   for g in range(10, 70) for b in range(10, 70)]
+        self.assertMatchesReference(samples)
+
+    # random samples over the range where signal tiles read. A finer,
+    # smaller table keeps refinement of ambiguous cells cheap.
+    def test_random(self):
+        self.classifier = classifier.ColorClassifier(shift=3, bits=8)
+        rng = random.Random(42)
+        samples = [(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+                   for _ in range(30000)]
+        self.assertMatchesReference(samples)
+
+    # samples that fall outside the table
+    def test_out_of_table(self):
+        self.assertMatchesReference([(1023, 150, 160), (600, 90, 85), (900, 900, 900)])
+        self.assertEqual(self.classifier.classify(216., 32., 44.),
+                         classifier.classify_rgb(216., 32., 44.))
+
+    # a table built from other colorimetry parameters follows them
+    def test_custom_tables(self):
+        hue = {"RED": (0.97, 1.02)}
+        saturation = {"RED": (0.5, 0.95)}
+        custom = classifier.ColorClassifier(hue=hue, saturation=saturation, colors=["RED"])
+        samples = _captures()
+        for r, g, b in samples:
+            self.assertEqual(custom.classify(r, g, b),
+                             classifier.classify_rgb(r, g, b, hue=hue, saturation=saturation,
+                                                     colors=["RED"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+''' Unit test that verifies that the vectorized batch classifier gives the
+    same results as the reference classifier used by the vision sensor.
+'''
+import colorsys
+import glob
+import os
+import unittest
+
+from support import local_signal
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+with local_signal():
+    import classifier
+    if np is not None:
+        import colorimetry
+
+
+@unittest.skipIf(np is None, "requires numpy")
+class TestColorimetry(unittest.TestCase):
+    def setUp(self):
+        filenames = sorted(glob.glob(os.path.join(DATA, "*.csv")))
+        self.filenames = [f for f in filenames if not f.endswith("lego_colors.csv")]
+        self.rgb = np.concatenate([colorimetry.load_capture(f) for f in self.filenames])
+
+        # a few edge cases: grays, black, pure RED, and hues at the wrap point
+        extra = np.array([[0., 0., 0.], [120., 120., 120.], [200., 30., 30.],
+                          [200., 40., 31.], [200., 31., 40.], [255., 0., 0.]])
+        self.rgb = np.concatenate([self.rgb, extra])
+
+    def test_hsv(self):
+        h, s, v = colorimetry.rgb_to_hsv(self.rgb)
+        for k, (r, g, b) in enumerate(self.rgb):
+            self.assertEqual((h[k], s[k], v[k]), colorsys.rgb_to_hsv(r, g, b))
+
+    def test_classify(self):
+        codes = colorimetry.classify(self.rgb)
+        names = [None] + classifier.SIGNAL_COLORS
+        for k, (r, g, b) in enumerate(self.rgb):
+            self.assertEqual(names[codes[k]], classifier.classify_rgb(r, g, b))
+
+    def test_confusion_matrix(self):
+        expected = np.array([0, 0, 1, 1, 2])
+        classified = np.array([0, 1, 1, 1, 0])
+        matrix = colorimetry.confusion_matrix(expected, classified, 3)
+        self.assertListEqual(matrix.tolist(), [[1, 1, 0], [0, 2, 0], [1, 0, 0]])
+
+
+if __name__ == "__main__":
+    unittest.main()
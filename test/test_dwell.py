@@ -0,0 +1,128 @@
+''' Unit test that verifies that station dwell times follow the occupancy
+    of the path ahead of the station, within the dwell time bounds.
+'''
+import io
+import unittest
+
+from support import local_signal
+
+with local_signal():
+    import dwell
+    import replay
+    import track
+
+A = track.DIRECTION_A
+B = track.DIRECTION_B
+
+
+class _TestTrain():
+    def __init__(self, name):
+        self.name = name
+
+    def report_xtrack(self, color):
+        pass
+
+
+def _ring(n):
+    ''' Description of a ring of n sectors, with a crossing at the exit of
+        the first station.
+    '''
+    colors = ["GREEN", "BLUE"]
+    sectors = [{"name": "S%i" % i, "color": colors[i % 2], "transit_time": 4.,
+                "next": {A: "S%i" % ((i + 1) % n), B: "S%i" % ((i - 1) % n)}}
+               for i in range(n)]
+    sectors[0]["look_ahead"] = "X0"
+    names = [sector["name"] for sector in sectors]
+    return {"name": "ring",
+            "crossings": [{"name": "X0", "signals": {A: names, B: names}}],
+            "sectors": sectors,
+            "stations": {A: "S0", B: "S3"}}
+
+
+class TestDwellScheduler(unittest.TestCase):
+    def setUp(self):
+        self.layout = track.compile_layout(_ring(6))
+        self.scheduler = dwell.DwellScheduler(minimum=2., maximum=12., layout=self.layout)
+        self.station = self.layout.station(A)
+
+    def dwell(self):
+        return self.scheduler.dwell(self.station, A, "train 1")
+
+    def test_clear_path(self):
+        self.assertEqual(self.dwell(), 2.)
+
+    def test_occupied_path(self):
+        s1, s2 = self.layout.sectors[1:3]
+        s2.occupier = "train 2"
+        dwell_time = self.dwell()
+        self.assertAlmostEqual(dwell_time, 4. + dwell.MARGIN, delta=0.05)
+
+        # the train's own reservations don't count
+        s2.occupier = None
+        s1.occupier = "train 1"
+        self.assertEqual(self.dwell(), 2.)
+
+    def test_sector_held_for_long(self):
+        # a train past its typical transit time is expected to leave soon
+        s1 = self.layout.sectors[1]
+        s1.occupier = "train 2"
+        s1.transit_time = 0.
+        self.assertEqual(self.dwell(), 2.)
+
+    def test_booked_crossing(self):
+        self.station.look_ahead.book(_TestTrain("train 2"))
+        self.assertAlmostEqual(self.dwell(), dwell.CROSSING_TIME + dwell.MARGIN)
+
+    def test_bounds(self):
+        for sector in self.layout.sectors[1:3]:
+            sector.transit_time = 60.
+        self.layout.sectors[2].occupier = "train 2"
+        self.assertEqual(self.dwell(), 12.)
+
+        self.scheduler.adaptive = False
+        for i in range(20):
+            self.assertTrue(2. <= self.dwell() <= 12.)
+
+    def test_metrics(self):
+        self.dwell()
+        self.scheduler.departed(0.)
+        self.scheduler.adaptive = False
+        self.dwell()
+        self.scheduler.departed(1.)
+
+        adaptive = self.scheduler.metrics[dwell.ADAPTIVE]
+        self.assertEqual((adaptive.dwells, adaptive.departures, adaptive.blocked), (1, 1, 0))
+        self.assertEqual(self.scheduler.metrics[dwell.RANDOM].blocked, 1)
+
+        fp = io.StringIO()
+        self.scheduler.dump(fp)
+        self.assertIn(dwell.RANDOM, fp.getvalue())
+
+
+class TestDepartures(unittest.TestCase):
+    def setUp(self):
+        track.clear_track()
+        self.runtime = replay.ReplayRuntime()
+        self.train = replay.ReplayTrain("Departing", self.runtime)
+        self.metrics = dwell.dwell_scheduler.metrics[dwell.dwell_scheduler.policy]
+        self.departures = self.metrics.departures
+
+    def tearDown(self):
+        track.clear_track()
+
+    def test_station_departure(self):
+        self.train.restart_movement()
+        self.runtime.advance(10.)
+        self.assertEqual(self.metrics.departures, self.departures + 1)
+
+    def test_restart_after_stop_and_wait(self):
+        # the event processor restarts a train stopped at the end of a
+        # structured sector: not a station departure
+        self.runtime.run(self.train._restart_movement(), key=self.train)
+        self.runtime.advance(10.)
+        self.assertEqual(self.metrics.departures, self.departures)
+        self.assertEqual(self.train.powers[-1][1], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+''' Unit test that verifies that the vision sensor event filter confirms
+    colors by k-of-n voting, and suppresses double detections per train.
+'''
+import unittest
+
+from support import local_signal
+
+with local_signal():
+    from signal import BLUE, GREEN, RED
+
+    import event
+
+
+class _TestTrain():
+    ''' Stands in for SmartTrain, recording the events it gets. '''
+    def __init__(self):
+        self.event_processor = self
+        self.events = []
+
+    def process_event(self, event_key):
+        self.events.append(event_key)
+
+
+class TestSensorEventFilter(unittest.TestCase):
+    def setUp(self):
+        self.train = _TestTrain()
+        self.filter = event.SensorEventFilter(self.train, votes=2, window=3)
+
+    def feed(self, samples, event_filter=None):
+        for sample in samples:
+            (event_filter or self.filter).filter_event(sample)
+
+    def test_isolated_samples_rejected(self):
+        self.feed([GREEN, None, None, BLUE, None, None, RED, None])
+        self.assertEqual(self.train.events, [])
+
+    def test_confirmed(self):
+        self.feed([None, GREEN, None, GREEN, GREEN, GREEN, None])
+        self.assertEqual(self.train.events, [GREEN])
+
+    def test_double_detection(self):
+        self.feed([BLUE, BLUE, None, None, None, BLUE, BLUE])
+        self.assertEqual(self.train.events, [BLUE])
+
+        # once TIME_THRESHOLD has passed, the color is confirmed again
+        self.filter.events[BLUE] -= event.TIME_THRESHOLD + 0.1
+        self.feed([None, None, None, BLUE, BLUE])
+        self.assertEqual(self.train.events, [BLUE, BLUE])
+
+    # a detection in one train doesn't suppress detections in another
+    def test_per_train(self):
+        other_train = _TestTrain()
+        other_filter = event.SensorEventFilter(other_train, votes=2, window=3)
+        self.feed([RED, RED])
+        self.feed([RED, RED], event_filter=other_filter)
+        self.assertEqual(self.train.events, [RED])
+        self.assertEqual(other_train.events, [RED])
+
+    def test_journal(self):
+        # confirmed events are logged with the filter's clock
+        class _TestJournal():
+            def __init__(self):
+                self.events = []
+
+            def event(self, color, event_time):
+                self.events.append((color, event_time))
+
+        log = _TestJournal()
+        event_filter = event.SensorEventFilter(self.train, votes=2, window=3,
+                                               clock=lambda: 12.5, journal=log)
+        self.feed([GREEN, GREEN, GREEN], event_filter=event_filter)
+        self.assertEqual(log.events, [(GREEN, 12.5)])
+
+    def test_invalid_votes(self):
+        with self.assertRaises(ValueError):
+            event.SensorEventFilter(self.train, votes=4, window=3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+''' Unit test that verifies that the event processor's state machine
+    dispatches events on (train state, sector kind, event color), and counts
+    the transitions taken.
+'''
+import io
+import unittest
+
+from support import local_signal
+
+with local_signal():
+    from signal import BLUE, GREEN, PURPLE, RED, YELLOW
+
+    import event
+    import track
+
+
+class _TestRuntime():
+    def run(self, procedure, key=None, event=None):
+        for step in procedure:
+            pass
+
+
+class _TestTrain():
+    def __init__(self):
+        self.name = "train 1"
+        self.runtime = _TestRuntime()
+        self.auto = True
+        self.signal_blind = False
+        self.sector = None
+        self.just_entered_sector = False
+
+    def report_signal(self, color):
+        pass
+
+
+class _TestEventProcessor(event.EventProcessor):
+    ''' Records the handlers called, instead of driving a train. '''
+    def __init__(self, train):
+        super().__init__(train)
+        self.calls = []
+
+    def _record(name):
+        def handler(self, event_key):
+            self.calls.append((name, event_key))
+        return handler
+
+    _enter_sector = _record("enter")
+    _leave_sector = _record("leave")
+    _leave_fast_sub_sector = _record("fast")
+    _leave_structured_sector = _record("slow")
+    _process_station_event = _record("station")
+    _process_xtrack_event = _record("xtrack")
+    recover = _record("recover")
+
+
+class TestStateMachine(unittest.TestCase):
+    def setUp(self):
+        self.train = _TestTrain()
+        self.processor = _TestEventProcessor(self.train)
+
+    def process(self, event_key):
+        self.processor.process_event(event_key)
+        return self.processor.calls[-1][0] if self.processor.calls else None
+
+    def test_between_sectors(self):
+        self.assertEqual(self.process(GREEN), "enter")
+        self.assertEqual(self.process(BLUE), "enter")
+        self.assertEqual(self.process(RED), "station")
+        self.assertEqual(self.process(YELLOW), "xtrack")
+
+    def test_regular_sector(self):
+        self.train.sector = track.sectors["GREEN"]
+        self.train.just_entered_sector = True
+        self.assertEqual(self.process(GREEN), "recover")
+
+        self.train.just_entered_sector = False
+        self.assertEqual(self.process(GREEN), "leave")
+        self.assertEqual(self.process(BLUE), "recover")
+
+    def test_structured_sector(self):
+        sector = track.sectors["BLUE"]
+        self.train.sector = sector
+        sector.sub_sector_type = track.FAST
+        self.assertEqual(self.process(BLUE), "fast")
+        sector.sub_sector_type = track.SLOW
+        self.assertEqual(self.process(BLUE), "slow")
+        self.assertEqual(self.process(GREEN), "recover")
+
+    def test_ignored(self):
+        # colors with no transition, and trains not in auto mode
+        self.process(PURPLE)
+        self.train.auto = False
+        self.process(GREEN)
+        self.assertEqual(self.processor.calls, [])
+
+    def test_transitions_counted(self):
+        self.process(GREEN)
+        self.process(GREEN)
+        count, last = self.processor.transitions[(event.BETWEEN_SECTORS, None, GREEN)]
+        self.assertEqual(count, 2)
+        self.assertGreater(last, 0.)
+
+    def test_dump(self):
+        self.process(GREEN)
+        fp = io.StringIO()
+        event.dump_transitions(fp)
+        self.assertIn(event.BETWEEN_SECTORS, fp.getvalue())
+
+    def test_table_from_layout(self):
+        layout = track.compile_layout({
+            "sectors": [{"name": "S0", "color": "GREEN", "next": {}},
+                        {"name": "S1", "color": "YELLOW", "structured": True, "next": {}}]})
+        table = event.TransitionTable(layout)
+        self.assertEqual(table.kinds, [(event.REGULAR, GREEN), (event.STRUCTURED, YELLOW)])
+        self.assertEqual(table.table[(event.IN_SECTOR, (event.REGULAR, GREEN), GREEN)],
+                         "_leave_sector")
+        self.assertNotIn((event.IN_SECTOR, (event.STRUCTURED, YELLOW), YELLOW), table.table)
+
+
+if __name__ == '__main__':
+    unittest.main()
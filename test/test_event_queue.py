@@ -0,0 +1,211 @@
+''' Unit test that verifies that per-train event queues hand events to a
+    worker thread, in order, apply their overflow policy to sensor events
+    when full, coalesce repeated sensor events, and drop stale ones, but
+    never drop other items.
+'''
+import io
+import threading
+import time
+import unittest
+
+from support import local_signal
+
+with local_signal():
+    import event_queue
+    import reservations
+    import runtime
+
+
+class TestEventQueue(unittest.TestCase):
+    def setUp(self):
+        self.handled = []
+        self.dropped = []
+        self.gate = threading.Event()
+
+    def tearDown(self):
+        self.gate.set()
+
+    def handler(self, event):
+        # the first event holds the worker until the gate opens
+        self.gate.wait()
+        self.handled.append(event)
+
+    def make_queue(self, policy, max_age=event_queue.EVENT_MAX_AGE):
+        return event_queue.EventQueue("test", self.handler, maxsize=3, policy=policy,
+                                      on_drop=self.dropped.append, max_age=max_age)
+
+    def drain(self, queue):
+        self.gate.set()
+        deadline = time.monotonic() + 1.
+        while time.monotonic() < deadline:
+            done = queue.handled + queue.stale + queue.dropped + queue.coalesced
+            if done == queue.submitted:
+                break
+            time.sleep(0.005)
+
+    def test_in_order(self):
+        queue = self.make_queue(event_queue.DROP_OLDEST)
+        for i in range(3):
+            self.assertTrue(queue.submit(i))
+        self.drain(queue)
+        self.assertEqual(self.handled, [0, 1, 2])
+        self.assertNotEqual(queue.thread, threading.current_thread())
+
+    def test_drop_oldest(self):
+        queue = self.make_queue(event_queue.DROP_OLDEST)
+        queue.submit(0, tag=0)
+        time.sleep(0.02)
+
+        # event 0 is being handled; 1 to 3 fill the queue
+        for i in range(1, 6):
+            self.assertTrue(queue.submit(i, tag=i))
+        self.assertEqual(self.dropped, [1, 2])
+        self.assertEqual((queue.dropped, queue.max_depth), (2, 3))
+        self.drain(queue)
+        self.assertEqual(self.handled, [0, 3, 4, 5])
+
+    def test_drop_newest(self):
+        queue = self.make_queue(event_queue.DROP_NEWEST)
+        queue.submit(0, tag=0)
+        time.sleep(0.02)
+        results = [queue.submit(i, tag=i) for i in range(1, 6)]
+        self.assertEqual(results, [True, True, True, False, False])
+        self.drain(queue)
+        self.assertEqual(self.handled, [0, 1, 2, 3])
+        self.assertEqual(self.dropped, [4, 5])
+
+    def test_block(self):
+        queue = self.make_queue(event_queue.BLOCK)
+        queue.submit(0, tag=0)
+        time.sleep(0.02)
+        for i in range(1, 4):
+            queue.submit(i, tag=i)
+
+        threading.Timer(0.03, self.gate.set).start()
+        started = time.monotonic()
+        self.assertTrue(queue.submit(4, tag=4))
+        self.assertGreaterEqual(time.monotonic() - started, 0.02)
+        self.drain(queue)
+        self.assertEqual(self.handled, [0, 1, 2, 3, 4])
+        self.assertEqual(queue.dropped, 0)
+
+    def test_control_kept(self):
+        # items with no tag (control procedures) are never dropped, even
+        # from a full queue
+        for policy in [event_queue.DROP_OLDEST, event_queue.DROP_NEWEST]:
+            self.handled = []
+            self.dropped = []
+            self.gate.clear()
+            queue = self.make_queue(policy)
+            queue.submit(0, tag=0)
+            time.sleep(0.02)
+            for i in range(1, 4):
+                queue.submit(i, tag=i)
+
+            self.assertTrue(queue.submit("restart"))
+            self.assertTrue(queue.submit("stop"))
+            self.assertEqual(queue.depth, 5)
+            self.assertEqual(self.dropped, [])
+
+            # the next sensor event still goes by the policy
+            queue.submit(4, tag=4)
+            self.drain(queue)
+            if policy == event_queue.DROP_OLDEST:
+                self.assertEqual(self.handled, [0, 2, 3, "restart", "stop", 4])
+                self.assertEqual(self.dropped, [1])
+            else:
+                self.assertEqual(self.handled, [0, 1, 2, 3, "restart", "stop"])
+                self.assertEqual(self.dropped, [4])
+
+    def test_coalesce(self):
+        # a sensor event repeated while the first one waits is dropped
+        queue = event_queue.EventQueue("test", self.handler, on_drop=self.dropped.append)
+        queue.submit("blue 0", tag="BLUE")
+        time.sleep(0.02)
+        self.assertTrue(queue.submit("red 1", tag="RED"))
+        self.assertFalse(queue.submit("red 2", tag="RED"))
+        self.assertTrue(queue.submit("restart"))
+        self.assertFalse(queue.submit("red 3", tag="RED"))
+
+        # the same color, after another one, is a new sector
+        self.assertTrue(queue.submit("blue 4", tag="BLUE"))
+        self.assertTrue(queue.submit("red 5", tag="RED"))
+
+        self.drain(queue)
+        self.assertEqual(self.handled, ["blue 0", "red 1", "restart", "blue 4", "red 5"])
+        self.assertEqual(self.dropped, ["red 2", "red 3"])
+        self.assertEqual((queue.coalesced, queue.dropped), (2, 0))
+
+        # once handled, the same color is an event again
+        self.assertTrue(queue.submit("red 6", tag="RED"))
+
+    def test_stale(self):
+        # sensor events that waited longer than max_age are dropped, others
+        # are handled however long they waited
+        queue = self.make_queue(event_queue.DROP_OLDEST, max_age=0.02)
+        queue.submit("blue 0", tag="BLUE")
+        time.sleep(0.01)
+        queue.submit("red 1", tag="RED")
+        queue.submit("restart")
+        time.sleep(0.05)
+
+        self.drain(queue)
+        self.assertEqual(self.handled, ["blue 0", "restart"])
+        self.assertEqual(self.dropped, ["red 1"])
+        self.assertEqual((queue.stale, queue.dropped), (1, 0))
+
+    def test_errors(self):
+        def handler(event):
+            raise RuntimeError("test")
+
+        queue = event_queue.EventQueue("test", handler)
+        queue.submit(0)
+        self.drain(queue)
+        self.assertEqual((queue.handled, queue.errors), (1, 1))
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            event_queue.EventQueue("test", self.handler, policy="drop all")
+
+    def test_dump(self):
+        queue = self.make_queue(event_queue.DROP_OLDEST)
+        queue.submit(0)
+        self.drain(queue)
+        fp = io.StringIO()
+        event_queue.dump_event_queues(fp)
+        self.assertIn("test", fp.getvalue())
+
+
+def _blocking(steps, state):
+    steps.append("start")
+    yield lambda: state["free"]
+    steps.append("done")
+
+
+class TestThreadedRuntimeQueues(unittest.TestCase):
+    def test_keyed_procedures(self):
+        # keyed procedures don't block the caller, and run in order
+        manager = reservations.ReservationManager()
+        threaded = runtime.ThreadedRuntime(manager=manager)
+        steps = []
+        state = {"free": False}
+
+        started = time.monotonic()
+        threaded.run(_blocking(steps, state), key="train")
+        threaded.run(_blocking(steps, {"free": True}), key="train")
+        self.assertLess(time.monotonic() - started, 0.05)
+
+        time.sleep(0.02)
+        self.assertEqual(steps, ["start"])
+        state["free"] = True
+        manager.notify()
+
+        queue = threaded.queue("train")
+        deadline = time.monotonic() + 1.
+        while queue.handled < 2 and time.monotonic() < deadline:
+            time.sleep(0.005)
+        self.assertEqual(steps, ["start", "done", "start", "done"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+''' Unit test that verifies that hub commands are written in order, by a
+    single writer thread per hub, and that callers don't wait on writes.
+'''
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+
+import hub_writer  # noqa: E402
+
+
+class _TestHub():
+    ''' Records writes, and the threads they come from. '''
+    def __init__(self, write_time=0.):
+        self.write_time = write_time
+        self.values = []
+        self.threads = set()
+
+    def write(self, value):
+        time.sleep(self.write_time)
+        self.values.append(value)
+        self.threads.add(threading.current_thread())
+        return value
+
+
+class TestHubWriter(unittest.TestCase):
+    def test_order_and_single_writer(self):
+        hub = _TestHub()
+        writer = hub_writer.HubWriter("test")
+        callers = [threading.Thread(target=lambda k=k: [writer.submit(hub.write, (k, n))
+                                                        for n in range(50)])
+                   for k in range(4)]
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join()
+        writer.close()
+
+        self.assertEqual(len(hub.values), 200)
+        self.assertEqual(hub.threads, {writer.thread})
+        for k in range(4):
+            self.assertEqual([v for v in hub.values if v[0] == k], [(k, n) for n in range(50)])
+        self.assertEqual(writer.writes, 200)
+        self.assertEqual(writer.submitted, 200)
+
+    # a slow hub doesn't hold up callers, or writes to other hubs
+    def test_slow_hub(self):
+        slow_hub = _TestHub(write_time=0.2)
+        fast_hub = _TestHub()
+        slow_writer = hub_writer.HubWriter("slow")
+        fast_writer = hub_writer.HubWriter("fast")
+
+        start = time.perf_counter()
+        slow_writer.submit(slow_hub.write, 1)
+        slow_writer.submit(slow_hub.write, 2)
+        self.assertLess(time.perf_counter() - start, 0.1)
+
+        self.assertEqual(fast_writer.call(fast_hub.write, 3), 3)
+        self.assertLess(time.perf_counter() - start, 0.1)
+
+        slow_writer.close()
+        fast_writer.close()
+        self.assertEqual(slow_hub.values, [1, 2])
+        self.assertGreaterEqual(slow_writer.write_latency.maximum, 200.)
+
+    # writes that can be lost are dropped when the queue is full
+    def test_try_submit(self):
+        hub = _TestHub()
+        gate = threading.Event()
+        writer = hub_writer.HubWriter("full", maxsize=1)
+        writer.submit(gate.wait)
+        while writer.depth:
+            time.sleep(0.001)
+
+        self.assertTrue(writer.try_submit(hub.write, 1))
+        self.assertFalse(writer.try_submit(hub.write, 2))
+        gate.set()
+        writer.close()
+        self.assertEqual(hub.values, [1])
+        self.assertEqual((writer.submitted, writer.dropped), (2, 1))
+
+    def test_call_error(self):
+        writer = hub_writer.HubWriter("error")
+        with self.assertRaises(ZeroDivisionError):
+            writer.call(lambda: 1 / 0)
+        writer.close()
+        self.assertEqual(writer.errors, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
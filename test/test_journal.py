@@ -0,0 +1,197 @@
+''' Unit test that verifies that vision sensor journals round-trip through
+    their binary file, and that a journal replays through the sensor event
+    filter and event processor on a virtual clock.
+'''
+import io
+import os
+import tempfile
+import time
+import unittest
+
+from support import VirtualClock, local_signal
+
+with local_signal():
+    from signal import BLUE, RED
+
+    import journal
+    import replay
+    import track
+    from runtime import Wait
+
+# raw samples the classifier maps to each color
+SAMPLES = {BLUE: (16, 64, 112), RED: (224, 32, 48), None: (0, 0, 0)}
+
+# sample period of the vision sensor, in seconds
+PERIOD = 0.05
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".journal")
+        os.close(fd)
+        self.clock = VirtualClock()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_round_trip(self):
+        log = journal.Journal(self.path, clock=self.clock)
+        self.clock.now = 1.5
+        log.sample(16, 64, 112, BLUE)
+        log.sample(-3, 70000, 5, None)
+        log.event(BLUE, 1.25)
+        log.close()
+
+        records = list(journal.read_journal(self.path))
+        self.assertEqual(os.path.getsize(self.path), 4 * journal.RECORD.size)
+        self.assertEqual(records, [(0., 0, 0, 0, None, journal.START),
+                                   (1.5, 16, 64, 112, BLUE, journal.SAMPLE),
+                                   (1.5, 0, 0xffff, 5, None, journal.SAMPLE),
+                                   (1.25, 0, 0, 0, BLUE, journal.EVENT)])
+
+    def test_runs(self):
+        # each journal opened on the file appends a run
+        for samples in [2, 3]:
+            log = journal.Journal(self.path, clock=self.clock)
+            for i in range(samples):
+                log.sample(0, 0, 0, None)
+            log.close()
+
+        # a record cut short is skipped
+        with open(self.path, "ab") as fp:
+            fp.write(b"\0" * 5)
+
+        runs = journal.runs(journal.read_journal(self.path))
+        self.assertEqual([len(run) for run in runs], [2, 3])
+
+        fp = io.StringIO()
+        journal.dump_journal(self.path, fp)
+        self.assertIn(self.path, fp.getvalue())
+
+    def test_close_journals(self):
+        log = journal.Journal(self.path, clock=self.clock)
+        log.sample(0, 0, 0, None)
+        journal.close_journals()
+        self.assertFalse(log.thread.is_alive())
+        self.assertEqual(log.records, 2)
+        self.assertNotIn(log, journal.journals)
+
+
+def _sleeper(steps, name, delays):
+    for delay in delays:
+        yield delay
+        steps.append((name, delay))
+
+
+def _waiter(steps, condition, timeout):
+    result = yield Wait(condition, timeout=timeout)
+    steps.append(result)
+
+
+class TestReplayRuntime(unittest.TestCase):
+    def setUp(self):
+        self.runtime = replay.ReplayRuntime()
+        self.calls = []
+
+    def test_schedule(self):
+        self.runtime.schedule(2., self.calls.append, "b")
+        self.runtime.schedule(1., self.calls.append, "a")
+        cancelled = self.runtime.schedule(1.5, self.calls.append, "x")
+        moved = self.runtime.schedule(0.5, self.calls.append, "c")
+        cancelled.cancel()
+        moved.reschedule(3.)
+
+        self.runtime.advance(2.5)
+        self.assertEqual(self.calls, ["a", "b"])
+        self.assertEqual(self.runtime.clock(), 2.5)
+        self.runtime.advance(10.)
+        self.assertEqual(self.calls, ["a", "b", "c"])
+
+    def test_keyed_procedures(self):
+        steps = []
+        self.runtime.run(_sleeper(steps, "first", [1., 1.]), key="train")
+        self.runtime.run(_sleeper(steps, "second", [0.5]), key="train")
+        self.runtime.spawn(_sleeper(steps, "spawned", [0.5]))
+
+        self.runtime.advance(5.)
+        self.assertEqual(steps, [("spawned", 0.5), ("first", 1.), ("first", 1.),
+                                 ("second", 0.5)])
+
+    def test_cancel(self):
+        steps = []
+        handle = self.runtime.spawn(_sleeper(steps, "ramp", [1., 1.]))
+        self.runtime.advance(1.5)
+        handle.cancel()
+        self.runtime.advance(5.)
+        self.assertEqual(steps, [("ramp", 1.)])
+
+    def test_waits(self):
+        state = {"free": False}
+        steps = []
+        self.runtime.run(_waiter(steps, lambda: state["free"], None))
+        self.runtime.run(_waiter(steps, lambda: False, 2.))
+
+        self.runtime.advance(1.)
+        self.assertEqual(steps, [])
+        self.runtime.dispatch(state.update, free=True)
+        self.assertEqual(steps, [True])
+        self.runtime.advance(2.)
+        self.assertEqual(steps, [True, False])
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".journal")
+        os.close(fd)
+        self.clock = VirtualClock()
+        self.journal = journal.Journal(self.path, clock=self.clock)
+
+    def tearDown(self):
+        os.remove(self.path)
+        track.clear_track()
+
+    def signal(self, color, samples=4):
+        for i in range(samples):
+            self.journal.sample(*SAMPLES[color], color)
+            self.clock.now += PERIOD
+
+    def idle(self, seconds):
+        self.signal(None, int(seconds / PERIOD))
+
+    def test_replay(self):
+        # one lap from the station: through the structured sector, into
+        # the station sector, and to the stop
+        laps = 3
+        for lap in range(laps):
+            self.idle(3.)
+            for color, seconds in [(BLUE, 6.), (BLUE, 4.), (BLUE, 5.), (RED, 3.), (RED, 20.)]:
+                self.signal(color)
+                self.journal.event(color)
+                self.idle(seconds)
+        self.journal.close()
+
+        started = time.perf_counter()
+        train = replay.replay(self.path, name="Replayed")
+        elapsed = time.perf_counter() - started
+
+        handlers = [handler for t, color, handler in train.events]
+        self.assertEqual(handlers, laps * ["_enter_sector", "_leave_fast_sub_sector",
+                                           "_leave_structured_sector", "_process_station_event",
+                                           "_process_station_event"])
+        self.assertEqual(len(train.recorded), len(train.events))
+
+        # the train stopped at the station, then left it again
+        self.assertIn(0, [power for t, power in train.powers])
+        self.assertGreater(train.powers[-1][1], 0)
+
+        # events are stamped on the virtual clock
+        self.assertAlmostEqual(train.events[0][0], 3. + PERIOD, places=6)
+        self.assertGreater(train.runtime.clock() / elapsed, 50.)
+
+        fp = io.StringIO()
+        replay.dump_replay(train, fp)
+        self.assertIn("_enter_sector", fp.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,248 @@
+''' Unit test that verifies that track layouts are loaded from layout
+    files and compiled into an indexed graph, with any number of crossings,
+    and that trains reserve paths of several sectors at once.
+'''
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from support import local_signal
+
+with local_signal():
+    import track
+
+A = track.DIRECTION_A
+B = track.DIRECTION_B
+
+
+class _TestTrain():
+    def __init__(self, name):
+        self.name = name
+
+    def report_xtrack(self, color):
+        pass
+
+
+def _ring(n):
+    ''' Description of a ring of n sectors, with a crossing every 4 sectors.
+        Each crossing's signals show up in its 4 sectors.
+    '''
+    colors = ["GREEN", "BLUE"]
+    sectors = []
+    for i in range(n):
+        sector = {"name": "S%i" % i, "color": colors[i % 2],
+                  "next": {A: "S%i" % ((i + 1) % n), B: "S%i" % ((i - 1) % n)}}
+        if i % 4 == 0:
+            sector["look_ahead"] = "X%i" % (i // 4)
+        sectors.append(sector)
+    crossings = []
+    for i in range((n + 3) // 4):
+        names = ["S%i" % k for k in range(4 * i, min(4 * i + 4, n))]
+        crossings.append({"name": "X%i" % i, "signals": {A: names, B: names}})
+    return {"name": "ring",
+            "crossings": crossings,
+            "sectors": sectors,
+            "stations": {A: "S0", B: "S1"}}
+
+
+class TestLayout(unittest.TestCase):
+    def test_default_layout(self):
+        # the layout file reproduces the original, hand-wired track
+        sectors = track.sectors
+        self.assertEqual(set(sectors), {"RED_1", "GREEN", "RED_2", "BLUE"})
+        self.assertIs(sectors["RED_2"].next[A], sectors["BLUE"])
+        self.assertIs(sectors["BLUE"].next[A], sectors["GREEN"])
+        self.assertIs(sectors["GREEN"].next[A], sectors["RED_2"])
+        self.assertIs(sectors["RED_1"].next[B], sectors["BLUE"])
+        self.assertIs(sectors["BLUE"].next[B], sectors["GREEN"])
+        self.assertIs(sectors["GREEN"].next[B], sectors["RED_1"])
+
+        xtrack = track.layout.crossing("Crossing 1")
+        self.assertIs(sectors["RED_2"].look_ahead, xtrack)
+        self.assertIsNone(sectors["RED_1"].look_ahead)
+        self.assertIsInstance(sectors["BLUE"], track.StructuredSector)
+        self.assertEqual(sectors["RED_1"].max_speed_time, 15.)
+        self.assertEqual(sectors["GREEN"].max_speed, 5)
+        self.assertEqual(track.station_sector_names, {A: "RED_2", B: "RED_1"})
+
+    def test_indexed_graph(self):
+        layout = track.layout
+        for sector in layout.sectors:
+            self.assertIs(layout.sectors[sector.id], sector)
+            for direction, next_sector in sector.next.items():
+                self.assertEqual(layout.next(sector.id, direction), next_sector.id)
+
+        red_1 = layout.sector("RED_1")
+        self.assertEqual(layout.next(red_1.id, A), track.NONE)
+        xtrack = layout.crossing("Crossing 1")
+        self.assertEqual(layout.look_ahead[layout.sector_ids["RED_2"]], xtrack.id)
+        self.assertIs(layout.station(B), red_1)
+
+    def test_lookups(self):
+        layout = track.layout
+        sectors = track.sectors
+        xtrack = layout.crossing("Crossing 1")
+        self.assertIs(layout.next_sector(sectors["RED_2"], A), sectors["BLUE"])
+        self.assertIsNone(layout.next_sector(sectors["RED_1"], A))
+        self.assertIs(layout.exit_crossing(sectors["RED_2"]), xtrack)
+        self.assertIsNone(layout.exit_crossing(sectors["RED_1"]))
+        self.assertIs(layout.crossing_in(sectors["GREEN"], B), xtrack)
+        self.assertIsNone(layout.crossing_in(sectors["RED_1"], A))
+
+    def test_path_tables(self):
+        layout = track.compile_layout(_ring(6))
+        s0, s1, s2, s3, s4, s5 = layout.sectors
+        self.assertEqual(layout.paths[A][0], (s1, s2, s3, s4, s5))
+        self.assertEqual(layout.paths[B][2], (s1, s0, s5, s4, s3))
+
+        # a path that runs into a loop, not back to its start, ends before
+        # it repeats a sector
+        description = _ring(4)
+        description["sectors"][3]["next"][A] = "S1"
+        layout = track.compile_layout(description)
+        self.assertEqual([s.name for s in layout.paths[A][0]], ["S1", "S2", "S3"])
+
+    def test_large_layout(self):
+        started = time.perf_counter()
+        layout = track.compile_layout(_ring(60))
+        self.assertLess(time.perf_counter() - started, 0.1)
+
+        self.assertEqual(len(layout.sectors), 60)
+        self.assertEqual(len(layout.crossings), 15)
+        self.assertEqual(layout.successors[A][59], 0)
+        self.assertEqual(layout.successors[B][0], 59)
+        self.assertIs(layout.sector("S8").look_ahead, layout.crossing("X2"))
+        self.assertEqual(layout.look_ahead[9], track.NONE)
+
+    def test_default_crossing(self):
+        sectors = track.sectors
+        xtrack = track.layout.crossing("Crossing 1")
+        for name in ["RED_2", "BLUE", "GREEN"]:
+            self.assertIs(sectors[name].crossing[A], xtrack)
+        for name in ["RED_1", "BLUE", "GREEN"]:
+            self.assertIs(sectors[name].crossing[B], xtrack)
+        self.assertNotIn(A, sectors["RED_1"].crossing)
+        self.assertEqual(xtrack.valid_signals, track.XTrack.DEFAULT_SIGNALS)
+
+    def test_crossings(self):
+        layout = track.compile_layout(_ring(12))
+        x0, x1, x2 = layout.crossings
+        self.assertIs(layout.sector("S5").crossing[A], x1)
+        self.assertEqual(layout.crossing_at[B][11], x2.id)
+        self.assertEqual(x1.valid_signals, {("GREEN", A), ("BLUE", A), ("GREEN", B), ("BLUE", B)})
+
+        # crossings have their own booking state and lock
+        train = _TestTrain("train 1")
+        other = _TestTrain("train 2")
+        x0.book(train)
+        self.assertFalse(x0.is_free(other))
+        self.assertTrue(x1.is_free(other))
+        self.assertIsNot(x0.lock, x1.lock)
+
+    def test_path(self):
+        layout = track.compile_layout(_ring(6))
+        s0, s1, s2, s3, s4, s5 = layout.sectors
+        self.assertEqual(layout.path(s0, A, 3), [s1, s2, s3])
+        self.assertEqual(layout.path(s0, B, 2), [s5, s4])
+
+        # paths don't wrap around to their start
+        self.assertEqual(layout.path(s0, A, 10), [s1, s2, s3, s4, s5])
+
+    def test_locate(self):
+        layout = track.compile_layout(_ring(6))
+        s0, s1, s2, s3, s4, s5 = layout.sectors
+        self.assertEqual(layout.locate(s0, A, "BLUE"), [s1])
+        self.assertEqual(layout.locate(s0, A, "GREEN"), [s1, s2])
+        self.assertEqual(layout.locate(s3, B, "BLUE"), [s2, s1])
+        self.assertEqual(layout.locate(s0, A, "RED"), [])
+
+    def test_reserve_path(self):
+        layout = track.compile_layout(_ring(6))
+        s0, s1, s2, s3, s4, s5 = layout.sectors
+        self.assertEqual(layout.reserve_path(s0, A, "train 1", 3), [s1, s2, s3])
+        self.assertEqual([s.occupier for s in layout.sectors],
+                         [None, "train 1", "train 1", "train 1", None, None])
+
+        # the longest free path is reserved; a taken next sector blocks
+        self.assertEqual(layout.reserve_path(s4, B, "train 2", 3), [])
+        self.assertEqual(layout.reserve_path(s5, A, "train 2", 3), [s0])
+
+        # as the train advances, the path moves with it
+        s1.occupier = None
+        self.assertEqual(layout.reserve_path(s1, A, "train 1", 3), [s2, s3, s4])
+
+        layout.release_path(s1, A, "train 1")
+        self.assertEqual([s.occupier for s in layout.sectors],
+                         ["train 2", None, None, None, None, None])
+
+    def test_path_stops_at_booked_crossing(self):
+        layout = track.compile_layout(_ring(8))
+        s0, s1, s2, s3, s4 = layout.sectors[:5]
+        crossing = s4.look_ahead
+        crossing.book(_TestTrain("train 2"))
+
+        # the train can enter s4, but not leave it
+        self.assertEqual(layout.reserve_path(s1, A, "train 1", 5), [s2, s3, s4])
+        self.assertEqual(layout.reserve_path(s4, A, "train 1", 5), [])
+
+    def test_errors(self):
+        description = _ring(4)
+        description["sectors"][1]["next"][A] = "nowhere"
+        with self.assertRaises(ValueError):
+            track.compile_layout(description)
+
+        description = _ring(4)
+        description["sectors"][0]["look_ahead"] = "nowhere"
+        with self.assertRaises(ValueError):
+            track.compile_layout(description)
+
+        description = _ring(4)
+        description["sectors"][2]["color"] = "ORANGE"
+        with self.assertRaises(ValueError):
+            track.compile_layout(description)
+
+        # signals in one sector can't belong to two crossings
+        description = _ring(8)
+        description["crossings"][1]["signals"][A].append("S0")
+        with self.assertRaises(ValueError):
+            track.compile_layout(description)
+
+    def test_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ring.json")
+            with open(path, "w") as f:
+                json.dump(_ring(8), f)
+            layout = track.load_layout(path)
+        self.assertEqual(layout.name, "ring")
+        self.assertEqual(len(layout.sectors), 8)
+
+    @unittest.skipIf(track.tomllib is None, "TOML needs python 3.11")
+    def test_load_toml(self):
+        text = '\n'.join([
+            'name = "loop"',
+            '[[sectors]]',
+            'name = "RED_1"',
+            'color = "RED"',
+            'next = {clockwise = "GREEN"}',
+            '[[sectors]]',
+            'name = "GREEN"',
+            'color = "GREEN"',
+            'max_speed = 5',
+            'next = {clockwise = "RED_1"}',
+            '[stations]',
+            'clockwise = "RED_1"',
+        ])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "loop.toml")
+            with open(path, "w") as f:
+                f.write(text)
+            layout = track.load_layout(path)
+        self.assertEqual(layout.successors[A], [1, 0])
+        self.assertEqual(layout.sector("GREEN").max_speed, 5)
+        self.assertIs(layout.station(A), layout.sector("RED_1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+''' Unit test that verifies that redundant motor power writes are
+    coalesced before they reach the hub.
+'''
+import threading
+import time
+import unittest
+
+from support import local_signal
+
+with local_signal():
+    import hub_writer
+    import train
+
+VOLTAGE = train.MotorHandler.NOMINAL_VOLTAGE
+
+
+class _TestMotor():
+    ''' Records power writes. Writes block while the gate is closed. '''
+    def __init__(self):
+        self.values = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def power(self, param):
+        self.gate.wait()
+        self.values.append(param)
+
+
+class TestMotorHandler(unittest.TestCase):
+    def setUp(self):
+        self.motor = _TestMotor()
+        self.writer = hub_writer.HubWriter("test")
+        self.handler = train.MotorHandler(self.motor, 2, self.writer)
+
+    def tearDown(self):
+        self.motor.gate.set()
+        self.writer.close()
+
+    def power(self, index):
+        return self.handler._compute_power(index, VOLTAGE)
+
+    def test_duplicates(self):
+        for index in [3, 3, 3, 0, 0]:
+            self.handler.set_motor_power(index, VOLTAGE)
+            self.writer.call(lambda: None)
+        self.assertEqual(self.motor.values, [self.power(3), self.power(0)])
+        self.assertEqual(self.handler.duplicates, 3)
+        self.assertEqual(self.handler.written, 2)
+
+    # while a write is queued, newer settings replace it
+    def test_latest_wins(self):
+        self.handler.set_motor_power(1, VOLTAGE)
+        self.writer.call(lambda: None)
+
+        # hold up the writer thread, so that the next writes queue up
+        self.motor.gate.clear()
+        self.writer.submit(lambda: self.motor.gate.wait())
+        for index in range(2, 8):
+            self.handler.set_motor_power(index, VOLTAGE)
+        self.motor.gate.set()
+        self.writer.call(lambda: None)
+
+        self.assertEqual(self.motor.values, [self.power(1), self.power(7)])
+        self.assertEqual(self.handler.requested, 7)
+        self.assertEqual(self.handler.superseded, 5)
+        self.assertEqual(self.handler.saved, 5)
+        self.assertEqual(self.writer.submitted, 5)
+
+    # a queued write that ends up back at the value already sent is dropped
+    def test_back_to_sent(self):
+        self.handler.set_motor_power(5, VOLTAGE)
+        self.writer.call(lambda: None)
+
+        self.motor.gate.clear()
+        self.writer.submit(lambda: self.motor.gate.wait())
+        self.handler.set_motor_power(6, VOLTAGE)
+        self.handler.set_motor_power(5, VOLTAGE)
+        self.motor.gate.set()
+        self.writer.call(lambda: None)
+
+        self.assertEqual(self.motor.values, [self.power(5)])
+        self.assertEqual(self.handler.written, 1)
+
+    # a stop requested while a write is in flight is still written
+    def test_stop_during_write(self):
+        self.handler.set_motor_power(0, VOLTAGE)
+        self.writer.call(lambda: None)
+
+        self.motor.gate.clear()
+        self.handler.set_motor_power(4, VOLTAGE)
+        # wait for the writer thread to take the write
+        while self.handler.pending_power is not None:
+            time.sleep(0.001)
+        self.handler.set_motor_power(0, VOLTAGE)
+        self.motor.gate.set()
+        self.writer.call(lambda: None)
+
+        self.assertEqual(self.motor.values, [self.power(0), self.power(4), self.power(0)])
+        self.assertEqual(self.handler.duplicates, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
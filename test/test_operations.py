@@ -0,0 +1,95 @@
+''' Unit test that verifies that operational metrics (laps per hour, waits,
+    station dwell times, sector occupancy) are computed from train
+    transitions.
+'''
+import io
+import json
+import unittest
+
+from support import VirtualClock, local_signal
+
+with local_signal():
+    import operations
+    import track
+
+
+class TestOperationalMetrics(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.metrics = operations.OperationalMetrics(clock=self.clock)
+        self.station = track.sectors["RED_2"]
+        self.blue = track.sectors["BLUE"]
+        self.green = track.sectors["GREEN"]
+
+    def lap(self, dwell, transit):
+        # departs after dwell, runs through two sectors, stops at the station
+        self.clock.now += dwell
+        self.metrics.departed("train 1")
+        self.metrics.entered("train 1", self.blue)
+        self.clock.now += transit
+        self.metrics.entered("train 1", self.green)
+        self.clock.now += transit
+        self.metrics.left("train 1")
+        self.metrics.stopped("train 1", self.station)
+
+    def test_laps_per_hour(self):
+        self.metrics.stopped("train 1", self.station)
+        self.assertEqual(self.metrics.laps_per_hour("train 1"), 0.)
+        for i in range(3):
+            self.lap(4., 8.)
+        self.assertAlmostEqual(self.metrics.laps_per_hour("train 1"), 3600. / 20.)
+        self.assertEqual(self.metrics.laps_per_hour("train 2"), 0.)
+
+    def test_dwell_and_occupancy(self):
+        self.metrics.stopped("train 1", self.station)
+        self.lap(4., 8.)
+        self.lap(6., 8.)
+        snapshot = self.metrics.snapshot()
+        self.assertEqual(snapshot["elapsed"], 42.)
+        train = snapshot["trains"]["train 1"]
+        self.assertEqual((train["laps"], train["dwells"]), (2, 2))
+        self.assertEqual(train["mean_dwell"], 5.)
+
+        # the train is still at the station
+        occupancy = snapshot["occupancy"]
+        self.assertAlmostEqual(occupancy["BLUE"], 16. / 42.)
+        self.assertAlmostEqual(occupancy["RED_2"], 10. / 42.)
+
+    def test_waits(self):
+        xtrack = track.layout.crossing("Crossing 1")
+        self.metrics.waited("train 1", self.blue, 2.)
+        self.metrics.waited("train 1", self.blue, 1.)
+        self.metrics.waited("train 1", xtrack, 3.)
+
+        # the sector was free
+        self.metrics.waited("train 1", self.green, 0.)
+
+        train = self.metrics.snapshot()["trains"]["train 1"]
+        self.assertEqual(train["waits"], {"BLUE": {"count": 2, "time": 3.},
+                                          "Crossing 1": {"count": 1, "time": 3.}})
+        self.assertEqual(train["wait_time"], 6.)
+
+    def test_constant_memory(self):
+        self.metrics.stopped("train 1", self.station)
+        for i in range(100):
+            self.lap(1., 1.)
+            self.metrics.waited("train 1", self.blue, 1.)
+        self.assertEqual(len(self.metrics.sectors), 3)
+        self.assertEqual(len(self.metrics.trains["train 1"].waits), 1)
+
+    def test_dump(self):
+        self.metrics.stopped("train 1", self.station)
+        self.lap(4., 8.)
+        self.clock.now += 1.
+
+        fp = io.StringIO()
+        self.metrics.dump_json(fp)
+        self.assertEqual(json.loads(fp.getvalue())["trains"]["train 1"]["laps"], 1)
+
+        fp = io.StringIO()
+        self.metrics.dump(fp)
+        self.assertIn("train 1", fp.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
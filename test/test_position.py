@@ -0,0 +1,91 @@
+''' Unit test that verifies that train positions are estimated between
+    signal tiles from the motor power history, and re-anchored at tiles.
+'''
+import io
+import unittest
+
+from support import VirtualClock, local_signal
+
+with local_signal():
+    import position
+    import track
+    import transit
+
+
+class TestPositionEstimator(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.estimator = position.PositionEstimator("train 1", clock=self.clock)
+        self.sector = track.sectors["GREEN"]
+
+    def tearDown(self):
+        position.estimators.remove(self.estimator)
+
+    def transit(self, profile):
+        # runs through the sector with the given (power, duration) profile
+        self.estimator.entered(self.sector)
+        for power, duration in profile:
+            self.estimator.set_power(power)
+            self.clock.now += duration
+        self.estimator.passed_signal()
+
+    def test_integrates_power(self):
+        self.estimator.set_power(0.5)
+        self.clock.now += 2.
+        self.estimator.set_power(-1.)
+        self.clock.now += 1.
+        self.estimator.set_power(0.)
+        self.clock.now += 5.
+        self.estimator.set_power(0.)
+        self.assertAlmostEqual(self.estimator.distance, 2.)
+
+    def test_unknown_until_learned(self):
+        self.estimator.entered(self.sector)
+        self.assertIsNone(self.estimator.distance_to_signal())
+
+        for i in range(transit.MINIMUM_SAMPLES):
+            self.transit([(0.5, 8.)])
+        self.assertIsNone(self.estimator.distance_to_signal())
+
+        self.estimator.entered(self.sector)
+        self.assertAlmostEqual(self.estimator.distance_to_signal(), 4.)
+
+    def test_distance_to_signal(self):
+        for i in range(5):
+            self.transit([(0.5, 8.)])
+
+        # at full power, the train covers the same distance in less time
+        self.estimator.entered(self.sector)
+        self.estimator.set_power(1.)
+        self.clock.now += 1.
+        self.assertAlmostEqual(self.estimator.distance_to_signal(), 3.)
+        self.assertAlmostEqual(self.estimator.time_to_signal(), 3.)
+
+        # a stopped train covers no distance
+        self.estimator.set_power(0.)
+        self.clock.now += 10.
+        self.assertAlmostEqual(self.estimator.distance_to_signal(), 3.)
+        self.assertIsNone(self.estimator.time_to_signal())
+
+    def test_stops_dont_skew_lengths(self):
+        for i in range(5):
+            self.transit([(0.5, 4.), (0., 20.), (0.5, 4.)])
+        self.assertAlmostEqual(self.estimator.lengths["GREEN"].mean, 4.)
+
+    def test_anchor(self):
+        for i in range(5):
+            self.transit([(0.5, 8.)])
+        self.estimator.entered(self.sector)
+        self.estimator.anchor()
+        self.assertIsNone(self.estimator.distance_to_signal())
+        self.assertEqual(self.estimator.lengths["GREEN"].count, 5)
+
+    def test_dump(self):
+        self.transit([(0.5, 8.)])
+        fp = io.StringIO()
+        position.dump_positions(fp)
+        self.assertIn("train 1", fp.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+''' Unit test that verifies that a train that missed signals is placed back
+    in the sector it is really in, or stops all trains when that sector is
+    held by another one; and that recoveries and resets are counted.
+'''
+import io
+import unittest
+
+from support import VirtualClock, local_signal
+
+with local_signal():
+    from signal import BLUE, GREEN
+
+    import recovery
+    import replay
+    import track
+    import transit
+
+# long enough for any sector timer to go off
+SETTLE = 30.
+
+
+class _TestDispatcher():
+    def __init__(self):
+        self.emergency_stops = 0
+
+    def emergency_stop(self):
+        self.emergency_stops += 1
+
+
+class TestRecovery(unittest.TestCase):
+    def setUp(self):
+        track.clear_track()
+        self.runtime = replay.ReplayRuntime()
+        # the train departs from its station, RED_2, towards BLUE
+        self.train = replay.ReplayTrain("Recovering", self.runtime)
+        self.train.dispatcher = _TestDispatcher()
+        recovery.recoveries.trains.pop(self.train.name, None)
+        self.clear_transits()
+
+    def tearDown(self):
+        track.clear_track()
+        self.clear_transits()
+
+    def clear_transits(self):
+        estimates = transit.transit_times.estimates
+        for key in [key for key in estimates if key[0] == self.train.name]:
+            del estimates[key]
+
+    def signal(self, color):
+        self.train.event_processor.process_event(color)
+        self.runtime.advance(self.runtime.now + SETTLE)
+        return self.train.events[-1][2]
+
+    def recovered(self):
+        metrics = recovery.recoveries.trains.get(self.train.name)
+        return metrics.recovered if metrics is not None else 0
+
+    def test_missed_sector_exit(self):
+        # the BLUE end-of-sector signal is missed; the next one is GREEN
+        self.signal(BLUE)
+        self.signal(BLUE)
+        self.assertEqual(self.signal(GREEN), "recover")
+
+        self.assertIs(self.train.sector, track.sectors["GREEN"])
+        self.assertIs(self.train.previous_sector, track.sectors["BLUE"])
+        self.assertEqual(track.sectors["GREEN"].occupier, self.train.name)
+        self.assertIsNone(track.sectors["BLUE"].occupier)
+        self.assertEqual(self.recovered(), 1)
+        self.assertTrue(self.train.auto)
+
+        # and carries on from there
+        self.assertEqual(self.signal(GREEN), "_leave_sector")
+
+    def test_missed_station(self):
+        # the train leaves GREEN and misses both station signals
+        self.train.sector = track.sectors["GREEN"]
+        track.sectors["GREEN"].occupier = self.train.name
+        self.assertEqual(self.signal(GREEN), "_leave_sector")
+        self.assertEqual(self.signal(BLUE), "_enter_sector")
+
+        self.assertIs(self.train.sector, track.sectors["BLUE"])
+        self.assertIs(self.train.previous_sector, track.sectors["RED_2"])
+        self.assertEqual(track.sectors["BLUE"].occupier, self.train.name)
+        self.assertEqual(recovery.recoveries.trains[self.train.name].skipped, 1)
+
+    def test_sector_taken(self):
+        self.signal(BLUE)
+        self.signal(BLUE)
+        track.sectors["GREEN"].occupier = "Other"
+        self.signal(GREEN)
+
+        self.assertEqual(self.train.dispatcher.emergency_stops, 1)
+        self.assertIs(self.train.sector, track.sectors["BLUE"])
+        self.assertEqual(track.sectors["GREEN"].occupier, "Other")
+        self.assertEqual(recovery.recoveries.trains[self.train.name].emergency_stops, 1)
+
+    def test_no_dispatcher(self):
+        self.train.dispatcher = None
+        self.signal(BLUE)
+        self.signal(BLUE)
+        track.sectors["GREEN"].occupier = "Other"
+        self.signal(GREEN)
+        self.assertFalse(self.train.auto)
+        self.assertEqual(self.train.power_index, 0)
+
+    def test_spurious(self):
+        # the entry signal, seen twice
+        self.train.event_processor.process_event(BLUE)
+        self.train.event_processor.process_event(BLUE)
+        self.assertEqual(self.train.events[-1][2], "recover")
+        self.assertIs(self.train.sector, track.sectors["BLUE"])
+        self.assertEqual(self.recovered(), 0)
+        self.assertEqual(recovery.recoveries.trains[self.train.name].spurious, 1)
+
+    def test_exit_signal_seen_again(self):
+        # a slow train sees the exit signal of the sector it left twice
+        self.train.sector = track.sectors["GREEN"]
+        track.sectors["GREEN"].occupier = self.train.name
+        self.assertEqual(self.signal(GREEN), "_leave_sector")
+        self.assertEqual(self.signal(GREEN), "_enter_sector")
+
+        self.assertIsNone(self.train.sector)
+        self.assertIs(self.train.previous_sector, track.sectors["GREEN"])
+        self.assertEqual(self.train.dispatcher.emergency_stops, 0)
+        self.assertEqual(self.recovered(), 0)
+        self.assertEqual(recovery.recoveries.trains[self.train.name].spurious, 1)
+
+    def learn_transit(self):
+        # the train crosses BLUE to its FAST-SLOW signal in 5 s, when it
+        # enters at speed
+        self.train.set_power(4)
+        for i in range(transit.MINIMUM_SAMPLES):
+            transit.transit_times.record(self.train.name, track.sectors["BLUE"],
+                                         self.train.motor_handler.power, 5.)
+        self.train.event_processor.process_event(BLUE)
+
+    def test_signal_overdue(self):
+        # the FAST-SLOW signal is missed
+        self.learn_transit()
+        self.runtime.advance(self.runtime.now + 4.)
+        self.assertEqual(recovery.recoveries.trains.get(self.train.name), None)
+        self.runtime.advance(self.runtime.now + 2.)
+        self.assertEqual(recovery.recoveries.trains[self.train.name].late, 1)
+
+        # it slows down, with the sector ahead held
+        self.runtime.advance(self.runtime.now + SETTLE)
+        self.assertEqual(self.train.power_index, track.SECTOR_EXIT_SPEED)
+        self.assertEqual(track.sectors["GREEN"].occupier, self.train.name)
+
+    def test_signal_in_time(self):
+        self.learn_transit()
+        self.runtime.advance(self.runtime.now + 4.5)
+        self.assertEqual(self.signal(BLUE), "_leave_fast_sub_sector")
+        self.assertEqual(recovery.recoveries.trains.get(self.train.name), None)
+
+
+class TestRecoveryMetrics(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.metrics = recovery.RecoveryMetrics(clock=self.clock)
+
+    def test_counters(self):
+        self.metrics.recovered("train 1", 2)
+        self.metrics.recovered("train 1", 0)
+        self.metrics.spurious("train 1")
+        self.metrics.emergency_stop("train 2")
+        train = self.metrics.trains["train 1"]
+        self.assertEqual((train.recovered, train.skipped, train.spurious), (2, 2, 1))
+        self.assertEqual(self.metrics.trains["train 2"].emergency_stops, 1)
+
+    def test_downtime(self):
+        self.clock.now = 10.
+        self.metrics.manual_reset()
+        self.clock.now = 15.
+        self.metrics.manual_reset()
+        self.clock.now = 70.
+        self.metrics.restarted()
+        self.clock.now = 100.
+        self.metrics.restarted()
+        self.assertEqual(self.metrics.manual_resets, 2)
+        self.assertEqual(self.metrics.downtime, 60.)
+
+        self.metrics.emergency_stop("train 1")
+        self.clock.now = 130.
+        self.metrics.restarted()
+        self.assertEqual(self.metrics.downtime, 90.)
+
+    def test_dump(self):
+        self.metrics.recovered("train 1", 1)
+        fp = io.StringIO()
+        self.metrics.dump(fp)
+        self.assertIn("train 1", fp.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,292 @@
+''' Unit test that verifies that trains waiting for a sector or crossing
+    are woken up as soon as it is released, that waits time out and can be
+    cancelled, that sectors are reserved atomically, and that deadlocks
+    between waiting trains are detected and resolved.
+'''
+import threading
+import time
+import unittest
+
+from support import local_signal
+
+with local_signal():
+    import reservations
+    import track
+
+
+class _TestTrain():
+    def __init__(self, name):
+        self.name = name
+        self.gui = None
+
+    def report_xtrack(self, color):
+        pass
+
+
+class TestReservationManager(unittest.TestCase):
+    def setUp(self):
+        self.manager = reservations.ReservationManager()
+        self.released = []
+
+    def release_later(self, delay, state):
+        def release():
+            time.sleep(delay)
+            state["free"] = True
+            self.released.append(time.perf_counter())
+            self.manager.notify()
+        threading.Thread(target=release).start()
+
+    def test_wakeup(self):
+        state = {"free": False}
+        self.release_later(0.05, state)
+        self.assertTrue(self.manager.wait(lambda: state["free"]))
+        woken = time.perf_counter()
+
+        # woken up in milliseconds, not at the next re-check
+        self.assertLess((woken - self.released[0]) * 1000., 20.)
+        self.assertEqual(self.manager.waits, 1)
+        self.assertEqual(self.manager.latency.count, 1)
+        self.assertLess(self.manager.latency.maximum, 20.)
+
+    def test_no_wait(self):
+        self.assertTrue(self.manager.wait(lambda: True))
+        self.assertEqual(self.manager.waits, 1)
+        self.assertEqual(self.manager.latency.count, 0)
+
+    def test_timeout(self):
+        started = time.monotonic()
+        self.assertFalse(self.manager.wait(lambda: False, timeout=0.05))
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        self.assertEqual(self.manager.timeouts, 1)
+
+    def test_cancel_all(self):
+        threading.Timer(0.03, self.manager.cancel_all).start()
+        with self.assertRaises(reservations.WaitCancelled):
+            self.manager.wait(lambda: False)
+        self.assertEqual(self.manager.cancelled, 1)
+
+        # later waits are not affected
+        self.assertTrue(self.manager.wait(lambda: True))
+
+    def test_is_cancelled(self):
+        cancelled = []
+
+        def cancel():
+            cancelled.append(True)
+            self.manager.wake()
+
+        threading.Timer(0.03, cancel).start()
+        with self.assertRaises(reservations.WaitCancelled):
+            self.manager.wait(lambda: False, is_cancelled=lambda: bool(cancelled))
+
+
+class _TestSector():
+    pass
+
+
+class TestReservationTable(unittest.TestCase):
+    def setUp(self):
+        self.manager = reservations.ReservationManager()
+        self.table = reservations.ReservationTable(self.manager)
+        self.sectors = [_TestSector() for i in range(3)]
+        for sector in self.sectors:
+            self.table.register(sector)
+
+    def test_try_acquire(self):
+        a, b, c = self.sectors
+        self.assertTrue(self.table.try_acquire([a], "train 1"))
+        self.assertTrue(self.table.try_acquire([a], "train 1"))
+        self.assertFalse(self.table.try_acquire([a], "train 2"))
+        self.assertEqual(self.table.occupier(a), "train 1")
+
+    def test_all_or_none(self):
+        a, b, c = self.sectors
+        self.table.try_acquire([b], "train 1")
+        self.assertFalse(self.table.try_acquire([c, b, a], "train 2"))
+        self.assertEqual(self.table.snapshot(), {a: None, b: "train 1", c: None})
+
+        self.assertTrue(self.table.try_acquire([c, b, a], "train 1"))
+        self.assertEqual(self.table.snapshot([a, c]), {a: "train 1", c: "train 1"})
+
+    def test_release(self):
+        a, b, c = self.sectors
+        self.table.try_acquire([a], "train 1")
+        self.table.try_acquire([b], "train 2")
+
+        # only sectors owned by the given train are released
+        self.table.release([a, b], "train 1")
+        self.assertEqual(self.table.snapshot(), {a: None, b: "train 2", c: None})
+
+        self.table.release([b])
+        self.assertIsNone(self.table.occupier(b))
+
+    def test_versions(self):
+        a = self.sectors[0]
+        entry = self.table.entries[a]
+        self.table.try_acquire([a], "train 1")
+        self.table.try_acquire([a], "train 1")
+        self.table.release([a], "train 1")
+        self.assertEqual(entry.version, 4)
+
+    def test_contention(self):
+        # many trains race for overlapping sector pairs; each sector ends
+        # up with exactly one owner, and owners hold both sectors of a pair.
+        a, b, c = self.sectors
+        pairs = [[a, b], [b, c], [c, a]]
+        winners = []
+        barrier = threading.Barrier(12)
+
+        def race(name, pair):
+            barrier.wait()
+            if self.table.try_acquire(pair, name):
+                winners.append((name, pair))
+
+        threads = [threading.Thread(target=race, args=("train %i" % i, pairs[i % 3]))
+                   for i in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # any two pairs overlap, so there is a single winner
+        self.assertEqual(len(winners), 1)
+        name, pair = winners[0]
+        for sector in pair:
+            self.assertEqual(self.table.occupier(sector), name)
+
+    def test_release_wakes_waiters(self):
+        a = self.sectors[0]
+        self.table.try_acquire([a], "train 2")
+        threading.Timer(0.03, self.table.release, args=([a], "train 2")).start()
+        self.assertTrue(self.manager.wait(lambda: self.table.try_acquire([a], "train 1"),
+                                          timeout=1.))
+        self.assertEqual(self.table.occupier(a), "train 1")
+        self.assertLess(self.manager.latency.maximum, 20.)
+
+
+class _TestResource():
+    def __init__(self, occupier=None):
+        self.occupier = occupier
+
+
+class TestWaitForGraph(unittest.TestCase):
+    def setUp(self):
+        self.graph = reservations.WaitForGraph()
+        self.stops = []
+        self.graph.emergency_stop = self.stops.append
+
+    def policy(self, name, held, cost):
+        # name gives up the resources in held, at the given cost
+        def release():
+            for resource in held:
+                resource.occupier = None
+        self.graph.register(name, lambda: cost, release)
+
+    def test_chain(self):
+        s1 = _TestResource("B")
+        s2 = _TestResource("C")
+        self.graph.add("B", s2)
+        self.assertEqual(self.graph.near_deadlocks, 0)
+        self.graph.add("A", s1)
+        self.assertEqual(self.graph.near_deadlocks, 1)
+        self.assertEqual(self.graph.longest_chain, 2)
+        self.assertEqual(self.graph.deadlocks, 0)
+
+        self.graph.remove("B")
+        self.assertEqual(self.graph.waiting, {"A": s1})
+
+    def test_cheapest_train_releases(self):
+        s1 = _TestResource("B")
+        s2 = _TestResource("C")
+        s3 = _TestResource("A")
+        self.policy("A", [s3], 3)
+        self.policy("B", [s1], 1)
+        self.policy("C", [s2], 2)
+        self.graph.add("A", s1)
+        self.graph.add("B", s2)
+        self.graph.add("C", s3)
+
+        self.assertEqual(self.graph.deadlocks, 1)
+        self.assertEqual(self.graph.resolved, 1)
+        self.assertIsNone(s1.occupier)
+        self.assertEqual((s2.occupier, s3.occupier), ("C", "A"))
+        self.assertEqual(self.stops, [])
+
+    def test_emergency_stop(self):
+        # neither train has anything to give up
+        s1 = _TestResource("B")
+        s2 = _TestResource("A")
+        self.policy("A", [], 0)
+        self.graph.add("A", s1)
+        self.graph.add("B", s2)
+
+        self.assertEqual(self.graph.emergency_stops, 1)
+        self.assertEqual(len(self.stops), 1)
+        self.assertEqual(set(waiter for waiter, resource in self.stops[0]), {"A", "B"})
+
+    def test_waits_join_the_graph(self):
+        # two trains wait for each other's sector; the emergency stop
+        # cancels both waits.
+        manager = reservations.ReservationManager(graph=self.graph)
+        self.graph.emergency_stop = lambda cycle: manager.cancel_all()
+        s1 = _TestResource("B")
+        s2 = _TestResource("A")
+        results = []
+
+        def wait(name, resource):
+            try:
+                manager.wait(lambda: resource.occupier is None, waiter=name, resource=resource)
+                results.append(True)
+            except reservations.WaitCancelled:
+                results.append(False)
+
+        threads = [threading.Thread(target=wait, args=("A", s1)),
+                   threading.Thread(target=wait, args=("B", s2))]
+        threads[0].start()
+        time.sleep(0.02)
+        threads[1].start()
+        for thread in threads:
+            thread.join(1.)
+            self.assertFalse(thread.is_alive())
+
+        self.assertEqual(results, [False, False])
+        self.assertEqual(self.graph.deadlocks, 1)
+        self.assertEqual(self.graph.waiting, {})
+
+
+class TestTrackNotifications(unittest.TestCase):
+    def setUp(self):
+        self.sector = track.Sector(track.GREEN)
+        self.train = _TestTrain("train 1")
+        self.other = _TestTrain("train 2")
+        self.xtrack = track.XTrack("test")
+
+    def wait(self, predicate, action):
+        # waits on the shared manager, which the track objects notify
+        threading.Timer(0.05, action).start()
+        started = time.monotonic()
+        self.assertTrue(reservations.reservations.wait(predicate, timeout=1.))
+        return time.monotonic() - started
+
+    def test_sector_release(self):
+        self.sector.occupier = self.other.name
+
+        def release():
+            self.sector.occupier = None
+
+        elapsed = self.wait(lambda: self.sector.occupier is None, release)
+        self.assertLess(elapsed, 0.05 + 0.02)
+
+    def test_xtrack_release(self):
+        self.xtrack.book(self.other)
+        self.assertFalse(self.xtrack.is_free(self.train))
+
+        def release():
+            self.xtrack.book(self.other)
+
+        elapsed = self.wait(lambda: self.xtrack.is_free(self.train), release)
+        self.assertLess(elapsed, 0.05 + 0.02)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,217 @@
+''' Unit test that verifies that control procedures run the same way under
+    the threaded and the asyncio control runtimes.
+'''
+import asyncio
+import threading
+import time
+import unittest
+
+from support import local_signal
+
+with local_signal():
+    import aio
+    import reservations
+    import runtime
+
+
+def _procedure(steps, state):
+    ''' Waits for state["free"], sleeps briefly, then records each step. '''
+    steps.append("start")
+    yield lambda: state["free"]
+    steps.append("free")
+    yield 0.01
+    steps.append("done")
+
+
+def _timed(steps, state):
+    free = yield runtime.Wait(lambda: state["free"], timeout=0.02)
+    steps.append(free)
+
+
+def _ramp(steps, count, interval):
+    for i in range(count):
+        steps.append(i)
+        yield interval
+
+
+def _blocked(done, name, resource):
+    yield runtime.Wait(lambda: resource.occupier is None, waiter=name, resource=resource)
+    done.append(name)
+
+
+class _TestResource():
+    def __init__(self, occupier=None):
+        self.occupier = occupier
+
+
+class TestThreadedRuntime(unittest.TestCase):
+    def setUp(self):
+        self.manager = reservations.ReservationManager()
+        self.runtime = runtime.ThreadedRuntime(manager=self.manager)
+        self.steps = []
+
+    def release(self, state):
+        state["free"] = True
+        self.manager.notify()
+
+    def test_run(self):
+        state = {"free": False}
+        threading.Timer(0.03, self.release, args=(state,)).start()
+        started = time.monotonic()
+        self.runtime.run(_procedure(self.steps, state))
+        self.assertEqual(self.steps, ["start", "free", "done"])
+        self.assertLess(time.monotonic() - started, reservations.WAKEUP_TIMEOUT)
+
+    def test_timeout(self):
+        self.runtime.run(_timed(self.steps, {"free": False}))
+        self.assertEqual(self.steps, [False])
+        self.assertEqual(self.manager.timeouts, 1)
+
+    def test_cancel_all(self):
+        state = {"free": False}
+        thread = threading.Thread(target=self.runtime.run, args=(_procedure(self.steps, state),))
+        thread.start()
+        time.sleep(0.02)
+        self.manager.cancel_all()
+        thread.join(1.)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(self.steps, ["start"])
+        self.assertEqual(self.manager.cancelled, 1)
+
+    def test_spawn_and_cancel(self):
+        handle = self.runtime.spawn(_ramp(self.steps, 100, 0.01))
+        time.sleep(0.035)
+        handle.cancel()
+        handle.thread.join(1.)
+        self.assertFalse(handle.thread.is_alive())
+        self.assertLess(len(self.steps), 10)
+
+    def test_fan_out(self):
+        # calls run concurrently: each one waits for all the others
+        barrier = threading.Barrier(4, timeout=1.)
+        calls = []
+
+        def call(i):
+            barrier.wait()
+            calls.append(i)
+
+        self.runtime.fan_out(lambda i=i: call(i) for i in range(4))
+        self.assertEqual(sorted(calls), [0, 1, 2, 3])
+
+    def test_cancel_waiting(self):
+        state = {"free": False}
+        handle = self.runtime.spawn(_procedure(self.steps, state))
+        time.sleep(0.02)
+        handle.cancel()
+        handle.thread.join(1.)
+        self.assertFalse(handle.thread.is_alive())
+        self.assertEqual(self.steps, ["start"])
+
+    def test_emergency_stop_from_wait(self):
+        # a deadlock found by a blocked wait stops all trains, as
+        # Controller.reset_all does: ramps are cancelled concurrently, then
+        # waits are cancelled.
+        graph = reservations.WaitForGraph()
+        manager = reservations.ReservationManager(graph=graph)
+        threaded = runtime.ThreadedRuntime(manager=manager)
+        ramps = [threaded.spawn(_ramp(self.steps, 1000, 0.01)) for i in range(2)]
+
+        def reset_all(cycle):
+            threaded.fan_out(ramp.cancel for ramp in ramps)
+            manager.cancel_all()
+        graph.emergency_stop = reset_all
+
+        s1 = _TestResource("B")
+        s2 = _TestResource("A")
+        done = []
+        procedures = [(threading.Thread(target=threaded.run,
+                                        args=(_blocked(done, name, resource),), daemon=True))
+                      for name, resource in [("A", s1), ("B", s2)]]
+        for thread in procedures:
+            thread.start()
+            time.sleep(0.02)
+        for thread in procedures + [ramp.thread for ramp in ramps]:
+            thread.join(1.)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(graph.emergency_stops, 1)
+        self.assertEqual(done, [])
+
+
+class TestAsyncRuntime(unittest.TestCase):
+    def setUp(self):
+        self.manager = reservations.ReservationManager()
+        self.runtime = aio.AsyncRuntime(manager=self.manager)
+        self.loop = self.runtime.loop
+        self.steps = []
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_wakeup_on_dispatch(self):
+        # the predicate is released from another thread, through dispatch;
+        # the waiting procedure must not have to wait for WAKEUP_TIMEOUT.
+        state = {"free": False}
+
+        def release():
+            time.sleep(0.02)
+            self.runtime.dispatch(state.update, free=True)
+
+        started = time.monotonic()
+        task = self.runtime.run(_procedure(self.steps, state))
+        threading.Thread(target=release).start()
+        self.loop.run_until_complete(task)
+        self.assertEqual(self.steps, ["start", "free", "done"])
+        self.assertLess(time.monotonic() - started, reservations.WAKEUP_TIMEOUT)
+        self.assertEqual(self.manager.latency.count, 1)
+
+    def test_timeout(self):
+        task = self.runtime.run(_timed(self.steps, {"free": False}))
+        self.loop.run_until_complete(task)
+        self.assertEqual(self.steps, [False])
+
+    def test_cancel_all(self):
+        state = {"free": False}
+        task = self.runtime.run(_procedure(self.steps, state))
+        self.runtime.schedule(0.02, self.manager.cancel_all)
+        self.loop.run_until_complete(task)
+        self.assertEqual(self.steps, ["start"])
+        self.assertEqual(self.manager.cancelled, 1)
+
+    def test_keyed_procedures_run_in_order(self):
+        state = {"free": False}
+        first = self.runtime.run(_procedure(self.steps, state), key="train")
+        second = self.runtime.run(_ramp(self.steps, 2, 0.), key="train")
+        self.runtime.schedule(0.02, state.update, free=True)
+        self.loop.run_until_complete(asyncio.wait([first, second]))
+        self.assertEqual(self.steps, ["start", "free", "done", 0, 1])
+        self.assertEqual(self.runtime.chains, {})
+
+    def test_fan_out(self):
+        calls = []
+        self.runtime.fan_out(lambda i=i: calls.append(i) for i in range(3))
+        self.assertEqual(calls, [0, 1, 2])
+
+    def test_schedule_and_cancel(self):
+        calls = []
+        self.runtime.schedule(0.01, calls.append, 1)
+        cancelled = self.runtime.schedule(0.01, calls.append, 2)
+        rescheduled = self.runtime.schedule(0.01, calls.append, 3)
+        cancelled.cancel()
+        rescheduled.reschedule(0.03)
+        self.loop.run_until_complete(asyncio.sleep(0.02))
+        self.assertEqual(calls, [1])
+        self.loop.run_until_complete(asyncio.sleep(0.03))
+        self.assertEqual(calls, [1, 3])
+
+    def test_spawn_and_cancel(self):
+        task = self.runtime.spawn(_ramp(self.steps, 100, 0.01))
+        self.loop.run_until_complete(asyncio.sleep(0.035))
+        task.cancel()
+        self.loop.run_until_complete(asyncio.wait([task]))
+        self.assertTrue(task.cancelled())
+        self.assertLess(len(self.steps), 10)
+        self.assertEqual(self.runtime.tasks, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
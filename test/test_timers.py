@@ -0,0 +1,101 @@
+''' Unit test that verifies that the central timer scheduler runs calls in
+    due time order, honors cancel and reschedule, keeps the thread count
+    flat, and shuts down.
+'''
+import threading
+import unittest
+
+from support import VirtualClock, local_signal
+
+with local_signal():
+    import timers
+
+
+class TestTimerScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.scheduler = timers.TimerScheduler(clock=self.clock)
+        self.calls = []
+
+    def tearDown(self):
+        self.scheduler.shutdown()
+
+    def record(self, value):
+        self.calls.append(value)
+
+    def advance(self, seconds):
+        # moves the clock, and returns once the scheduler thread has run
+        # the calls due by then
+        self.clock.now += seconds
+        done = threading.Event()
+        self.scheduler.schedule(0., done.set)
+        self.scheduler.wake()
+        self.assertTrue(done.wait(1.))
+
+    def test_order(self):
+        for value, delay in [(3, 3.), (1, 1.), (2, 2.)]:
+            self.scheduler.schedule(delay, self.record, value)
+        self.advance(1.5)
+        self.assertEqual(self.calls, [1])
+        self.advance(2.)
+        self.assertEqual(self.calls, [1, 2, 3])
+        self.assertEqual(self.scheduler.pending, 0)
+
+    def test_cancel_and_reschedule(self):
+        cancelled = self.scheduler.schedule(1., self.record, "cancelled")
+        moved = self.scheduler.schedule(1., self.record, "moved")
+        self.scheduler.schedule(2., self.record, "fixed")
+        cancelled.cancel()
+        moved.reschedule(3.)
+        self.assertEqual(self.scheduler.pending, 2)
+        self.advance(2.5)
+        self.assertEqual(self.calls, ["fixed"])
+        self.advance(1.)
+        self.assertEqual(self.calls, ["fixed", "moved"])
+
+        # a call that already ran can be scheduled again
+        moved.reschedule(1.)
+        self.advance(1.)
+        self.assertEqual(self.calls, ["fixed", "moved", "moved"])
+
+    # a call cancelled, or rescheduled, after it came due doesn't run then
+    def test_cancel_when_due(self):
+        def cancel_others():
+            self.record("first")
+            cancelled.cancel()
+            moved.reschedule(1.)
+
+        self.scheduler.schedule(1., cancel_others)
+        cancelled = self.scheduler.schedule(1., self.record, "cancelled")
+        moved = self.scheduler.schedule(1., self.record, "moved")
+        self.advance(1.)
+        self.assertEqual(self.calls, ["first"])
+        self.advance(1.)
+        self.assertEqual(self.calls, ["first", "moved"])
+        self.assertEqual(self.scheduler.pending, 0)
+
+    def test_thread_count(self):
+        self.advance(0.)
+        threads = threading.active_count()
+        handles = [self.scheduler.schedule(1. + 0.1 * (n % 5), self.record, n) for n in range(500)]
+        for handle in handles[::2]:
+            handle.cancel()
+        self.assertEqual(threading.active_count(), threads)
+        self.advance(2.)
+        self.assertEqual(len(self.calls), 250)
+        self.assertEqual(self.scheduler.pending, 0)
+
+    def test_shutdown(self):
+        self.scheduler.schedule(1., self.record, "dropped")
+        thread = self.scheduler.thread
+        self.scheduler.shutdown()
+        self.assertFalse(thread.is_alive())
+
+        self.clock.now += 2.
+        self.scheduler.schedule(0., self.record, "late")
+        self.assertIs(self.scheduler.thread, thread)
+        self.assertEqual(self.calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+''' Unit test that verifies that latency traces are aggregated into the
+    right per-stage histograms.
+'''
+import io
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+
+import tracing  # noqa: E402
+
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.tracer = tracing.Tracer(enabled=True)
+
+    def test_histogram(self):
+        histogram = tracing.Histogram(bins=[1., 10.])
+        for latency in [0.5, 0.7, 5., 50.]:
+            histogram.add(latency)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.quantile(0.5), 1.)
+        self.assertEqual(histogram.quantile(1.), 50.)
+        self.assertAlmostEqual(histogram.mean, 14.05)
+
+    def test_trace(self):
+        self.tracer.sample("train")
+        self.tracer.start("train")
+        self.tracer.stamp("train", tracing.PROCESS)
+        time.sleep(0.002)
+        self.tracer.stamp("train", tracing.MOTOR)
+
+        histograms = self.tracer.histograms
+        for stage in [tracing.FILTER, tracing.PROCESS, tracing.MOTOR, tracing.TOTAL]:
+            self.assertEqual(histograms[stage].count, 1, stage)
+        self.assertEqual(histograms[tracing.ACCELERATE].count, 0)
+        self.assertGreaterEqual(histograms[tracing.TOTAL].maximum, 2.)
+
+        # the trace ended at MOTOR; further motor commands are not counted
+        self.tracer.stamp("train", tracing.MOTOR)
+        self.assertEqual(histograms[tracing.MOTOR].count, 1)
+
+    # traces are kept apart per train
+    def test_per_train(self):
+        self.tracer.start("train 1")
+        self.tracer.stamp("train 2", tracing.MOTOR)
+        self.assertEqual(self.tracer.histograms[tracing.MOTOR].count, 0)
+        self.tracer.stamp("train 1", tracing.MOTOR)
+        self.assertEqual(self.tracer.histograms[tracing.MOTOR].count, 1)
+
+    def test_dump(self):
+        self.tracer.start("train")
+        self.tracer.stamp("train", tracing.MOTOR)
+        output = io.StringIO()
+        self.tracer.dump(fp=output)
+        self.assertIn(tracing.TOTAL, output.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+''' Unit test that verifies that sector transit times are estimated from
+    measurements, and that the sector guard and max speed timers follow
+    the estimates.
+'''
+import io
+import random
+import unittest
+
+from support import local_signal
+
+with local_signal():
+    import track
+    import transit
+
+
+class TestTransitEstimator(unittest.TestCase):
+    def setUp(self):
+        self.estimator = transit.TransitEstimator()
+        self.sector = track.sectors["GREEN"]
+
+    def record(self, transit_time, name="train 1", power=0.7):
+        self.estimator.record(name, self.sector, power, transit_time)
+
+    def test_sector_settings_until_enough_samples(self):
+        for i in range(transit.MINIMUM_SAMPLES - 1):
+            self.record(10.)
+        self.assertIsNone(self.estimator.window("train 1", self.sector, 0.7))
+        self.assertEqual(self.estimator.guard_time("train 1", self.sector, 0.7),
+                         self.sector.sector_time)
+        self.assertEqual(self.estimator.max_speed_time("train 1", self.sector, 0.7),
+                         self.sector.max_speed_time)
+
+    def test_constant_transit(self):
+        for i in range(5):
+            self.record(10.)
+        self.assertEqual(self.estimator.window("train 1", self.sector, 0.7), (10., 10.))
+        self.assertEqual(self.estimator.guard_time("train 1", self.sector, 0.7),
+                         10. - transit.GUARD_LEAD)
+        self.assertEqual(self.estimator.max_speed_time("train 1", self.sector, 0.7),
+                         10. - transit.SLOWDOWN_LEAD)
+
+    def test_noisy_transit(self):
+        generator = random.Random(1)
+        for i in range(200):
+            self.record(generator.gauss(10., 0.5))
+        earliest, latest = self.estimator.window("train 1", self.sector, 0.7)
+        self.assertTrue(8. < earliest < 9.5)
+        self.assertTrue(10.5 < latest < 12.)
+
+    def test_tracks_changes(self):
+        for i in range(10):
+            self.record(10.)
+        for i in range(30):
+            self.record(6.)
+        earliest, latest = self.estimator.window("train 1", self.sector, 0.7)
+        self.assertAlmostEqual((earliest + latest) / 2., 6., delta=0.1)
+
+    def test_keys(self):
+        # estimates are kept per train and power setting
+        for i in range(5):
+            self.record(10.)
+            self.record(20., name="train 2")
+            self.record(30., power=-0.5)
+        self.assertEqual(self.estimator.window("train 2", self.sector, 0.7), (20., 20.))
+        self.assertEqual(self.estimator.window("train 1", self.sector, 0.5), (30., 30.))
+        self.assertEqual(len(self.estimator.estimates), 3)
+
+    def test_power_buckets(self):
+        # nearby entry powers share an estimate
+        for i in range(5):
+            self.record(10., power=0.68)
+            self.record(10., power=-0.72)
+        self.assertEqual(self.estimator.window("train 1", self.sector, 0.7), (10., 10.))
+        self.assertIsNone(self.estimator.window("train 1", self.sector, 0.3))
+        self.assertEqual(len(self.estimator.estimates), 1)
+
+    def test_guard_never_shorter_than_sector_setting(self):
+        for i in range(5):
+            self.record(0.5)
+        self.assertEqual(self.estimator.guard_time("train 1", self.sector, 0.7),
+                         self.sector.sector_time)
+        self.assertEqual(self.estimator.max_speed_time("train 1", self.sector, 0.7), 0.)
+
+    def test_dump(self):
+        self.record(10.)
+        fp = io.StringIO()
+        self.estimator.dump(fp)
+        self.assertIn("GREEN", fp.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()